@@ -0,0 +1,183 @@
+import io
+import os
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+TARGET_RATE = 16000
+# frames quieter than this are never speech, whatever the noise floor (dBFS)
+VAD_ABS_FLOOR_DB = float(os.environ.get("AUDIO_VAD_FLOOR_DB", "-45"))
+# speech must stand this far above the clip's own noise floor (dB)
+VAD_MARGIN_DB = float(os.environ.get("AUDIO_VAD_MARGIN_DB", "10"))
+# less voiced audio than this is treated as silence
+VAD_MIN_VOICED_MS = int(os.environ.get("AUDIO_VAD_MIN_VOICED_MS", "200"))
+FRAME_MS = 30
+PAD_MS = 150
+FFMPEG_TIMEOUT = 15
+
+
+class PreprocessResult:
+    """Outcome of preprocess(): ``status`` is "ok", "silent" or "passthrough".
+
+    "passthrough" carries the original upload, either because nothing here
+    could decode it or because the re-encoded clip would not be smaller.
+    """
+
+    __slots__ = ("status", "content", "filename", "duration_ms", "voiced_ms")
+
+    def __init__(self, status: str, content: bytes, filename: str, duration_ms: int | None = None, voiced_ms: int | None = None):
+        self.status = status
+        self.content = content
+        self.filename = filename
+        self.duration_ms = duration_ms
+        self.voiced_ms = voiced_ms
+
+
+def _decode_wav(content: bytes) -> tuple[np.ndarray, int] | None:
+    try:
+        with wave.open(io.BytesIO(content), "rb") as w:
+            width = w.getsampwidth()
+            channels = w.getnchannels()
+            rate = w.getframerate()
+            raw = w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        return None
+    if channels > 1:
+        samples = samples[: len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _decode_ffmpeg(content: bytes) -> tuple[np.ndarray, int] | None:
+    # webm/opus from MediaRecorder; ffmpeg resamples to 16 kHz mono on the way out
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    try:
+        proc = subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(TARGET_RATE), "pipe:1"],
+            input=content,
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0 or not proc.stdout:
+        return None
+    return np.frombuffer(proc.stdout, dtype="<i2").astype(np.float32) / 32768.0, TARGET_RATE
+
+
+def decode_audio(content: bytes) -> tuple[np.ndarray, int] | None:
+    """Mono float32 samples in [-1, 1] and their rate, or None if no local decoder applies."""
+    if content[:4] == b"RIFF" and content[8:12] == b"WAVE":
+        return _decode_wav(content)
+    return _decode_ffmpeg(content)
+
+
+def resample(samples: np.ndarray, rate: int, target: int = TARGET_RATE) -> np.ndarray:
+    if rate == target or len(samples) == 0:
+        return samples
+    if rate > target:
+        # box low-pass over one output period before decimating to limit aliasing
+        width = int(round(rate / target))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode="same")
+    n_out = int(round(len(samples) * target / rate))
+    src = np.arange(len(samples), dtype=np.float64)
+    dst = np.linspace(0, len(samples) - 1, n_out)
+    return np.interp(dst, src, samples).astype(np.float32)
+
+
+def voiced_span(samples: np.ndarray, rate: int) -> tuple[int, int, int] | None:
+    """Energy-based VAD: (start, end, voiced_samples) of the speech region, or None if silent.
+
+    A frame counts as speech when it is above an absolute floor and
+    VAD_MARGIN_DB above the quietest 10% of frames (the room noise). That
+    relative rule is capped at VAD_MARGIN_DB below the loudest frame, so a
+    clip that is speech from end to end (no quiet lead-in, little dynamic
+    range) is not mistaken for its own noise floor.
+    """
+    frame = max(1, rate * FRAME_MS // 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return None
+    frames = samples[: n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    noise_floor = float(np.percentile(db, 10))
+    peak = float(db.max())
+    threshold = max(VAD_ABS_FLOOR_DB, min(noise_floor + VAD_MARGIN_DB, peak - VAD_MARGIN_DB))
+    voiced = np.flatnonzero(db > threshold)
+    if len(voiced) * FRAME_MS < VAD_MIN_VOICED_MS:
+        return None
+    pad = rate * PAD_MS // 1000
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * frame + pad)
+    return start, end, len(voiced) * frame
+
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+def encode_flac(samples: np.ndarray, rate: int) -> bytes | None:
+    """Lossless FLAC through ffmpeg, about half the size of the WAV; None without ffmpeg."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    try:
+        proc = subprocess.run(
+            [ffmpeg, "-nostdin", "-loglevel", "error", "-f", "s16le", "-ac", "1", "-ar", str(rate), "-i", "pipe:0", "-f", "flac", "pipe:1"],
+            input=pcm.tobytes(),
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if proc.returncode != 0 or not proc.stdout:
+        return None
+    return proc.stdout
+
+
+def preprocess(content: bytes, filename: str) -> PreprocessResult:
+    """Decode, reject silence, trim and resample an upload before transcription.
+
+    Formats no local decoder understands are passed through untouched, and
+    so is a voiced clip whose trimmed re-encoding (FLAC, or WAV without
+    ffmpeg) would be larger than the upload, as a short opus clip usually is.
+    """
+    decoded = decode_audio(content)
+    if decoded is None:
+        return PreprocessResult("passthrough", content, filename)
+    samples, rate = decoded
+    duration_ms = len(samples) * 1000 // rate if rate else 0
+    span = voiced_span(samples, rate)
+    if span is None:
+        return PreprocessResult("silent", b"", filename, duration_ms, 0)
+    start, end, voiced = span
+    trimmed = resample(samples[start:end], rate)
+    voiced_ms = voiced * 1000 // rate
+    encoded, ext = encode_flac(trimmed, TARGET_RATE), "flac"
+    if encoded is None:
+        encoded, ext = encode_wav(trimmed, TARGET_RATE), "wav"
+    if len(encoded) >= len(content):
+        return PreprocessResult("passthrough", content, filename, duration_ms, voiced_ms)
+    stem = os.path.splitext(filename or "voice")[0]
+    return PreprocessResult("ok", encoded, f"{stem}.{ext}", duration_ms, voiced_ms)
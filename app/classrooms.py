@@ -0,0 +1,56 @@
+import re
+import threading
+from typing import Callable, Generic, TypeVar
+
+from fastapi import Header, HTTPException, Query
+
+# everything stored before classrooms existed belongs here, and clients that send none keep using it
+DEFAULT_CLASSROOM = "default"
+
+_CLASSROOM_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+T = TypeVar("T")
+
+
+def classroom_id(
+    classroom: str | None = Query(None, description="classroom (lesson) id; defaults to the shared default classroom"),
+    x_classroom: str | None = Header(None),
+) -> str:
+    """FastAPI dependency: the classroom a request belongs to.
+
+    Taken from ``?classroom=`` (EventSource cannot set headers) or the
+    ``X-Classroom`` header, in that order.
+    """
+    value = classroom or x_classroom or DEFAULT_CLASSROOM
+    if not _CLASSROOM_ID.fullmatch(value):
+        raise HTTPException(status_code=422, detail="invalid classroom id")
+    return value
+
+
+class PerClassroom(Generic[T]):
+    """In-memory state kept separately for each classroom, created on first use.
+
+    ``registry(classroom)`` returns that classroom's instance of
+    ``factory(classroom)``; the same object is returned on every call.
+    """
+
+    def __init__(self, factory: Callable[[str], T]):
+        self._factory = factory
+        self._items: dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, classroom: str = DEFAULT_CLASSROOM) -> T:
+        item = self._items.get(classroom)
+        if item is None:
+            with self._lock:
+                item = self._items.get(classroom)
+                if item is None:
+                    item = self._items[classroom] = self._factory(classroom)
+        return item
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def items(self) -> list[tuple[str, T]]:
+        with self._lock:
+            return list(self._items.items())
@@ -0,0 +1,64 @@
+import sqlite3
+import zlib
+from uuid import uuid4
+
+from typing import Callable
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from app.classrooms import classroom_id
+from app.db import iter_conn
+from app.events import Broadcaster
+
+# hub versions restart at 0 with the process; this keeps old tokens from matching
+BOOT_ID = uuid4().hex[:8]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]
+
+
+def table_versions(conn: sqlite3.Connection, tables: tuple[str, ...]) -> dict[str, int]:
+    placeholders = ", ".join("?" * len(tables))
+    rows = conn.execute(f"SELECT name, version FROM table_versions WHERE name IN ({placeholders})", tables).fetchall()
+    return {row["name"]: row["version"] for row in rows}
+
+
+def conditional(*tables: str, hub: Callable[[str], Broadcaster] | None = None):
+    """Dependency factory for conditional GETs.
+
+    The ETag is built from the change counters of ``tables`` (maintained by
+    triggers, see _m8_table_versions in app/db.py) plus the request URL, so
+    it costs one indexed SELECT and never reads row data. When If-None-Match already carries it
+    the request ends here with 304. With ``hub`` (a classroom -> hub
+    lookup) the classroom's hub version is used instead once it holds a
+    value (for data that is published before it is committed). The counters
+    are per table, not per classroom: a write in one classroom only costs
+    the others a full response on their next poll.
+    """
+
+    def dependency(
+        request: Request,
+        response: Response,
+        conn: sqlite3.Connection = Depends(iter_conn),
+        classroom: str = Depends(classroom_id),
+    ) -> None:
+        classroom_hub = hub(classroom) if hub is not None else None
+        if classroom_hub is not None and classroom_hub.latest is not None:
+            parts = [f"{BOOT_ID}.{classroom_hub.version}"]
+        else:
+            versions = table_versions(conn, tables)
+            parts = [f"{t}.{versions.get(t, 0)}" for t in tables]
+        # the classroom may come from a header, which the URL does not show
+        url = classroom + " " + request.url.path + ("?" + request.url.query if request.url.query else "")
+        parts.append(format(zlib.crc32(url.encode("utf-8")), "08x"))
+        etag = '"' + "-".join(parts) + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request, etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+    return dependency
@@ -0,0 +1,79 @@
+import sqlite3
+import threading
+
+from app.cache import LRUCache, SingleFlight
+from app.classrooms import DEFAULT_CLASSROOM
+
+# everyone in the class asks for the same pointer and course at the start of a lesson
+class_course_cache = LRUCache(maxsize=64)
+course_cache = LRUCache(maxsize=16)
+flights = SingleFlight()
+
+_MISSING = object()
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def _current_generation() -> int:
+    with _generation_lock:
+        return _generation
+
+
+def _bump_generation() -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+
+
+def _cached(cache: LRUCache, key, load):
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    def fill():
+        generation = _current_generation()
+        value = load()
+        # a writer that committed while we were reading must not be overwritten by our stale copy
+        if generation == _current_generation():
+            cache.set(key, value)
+        return value
+
+    return flights.do((id(cache), key), fill)
+
+
+def get_class_course(conn: sqlite3.Connection, classroom: str = DEFAULT_CLASSROOM) -> dict | None:
+    """A classroom's class_course pointer ({course_id, set_at}) or None if none is set."""
+
+    def load():
+        row = conn.execute("SELECT course_id, set_at FROM class_course WHERE classroom_id = ?", (classroom,)).fetchone()
+        if not row or not row["course_id"]:
+            return None
+        return {"course_id": row["course_id"], "set_at": row["set_at"]}
+
+    return _cached(class_course_cache, classroom, load)
+
+
+def get_course(conn: sqlite3.Connection, course_id: str) -> dict | None:
+    """A course row ({course_id, gpx, created_at}) or None if it does not exist."""
+
+    def load():
+        row = conn.execute("SELECT course_id, gpx_content, created_at FROM courses WHERE course_id = ?", (course_id,)).fetchone()
+        if not row:
+            return None
+        return {"course_id": row["course_id"], "gpx": row["gpx_content"], "created_at": row["created_at"]}
+
+    return _cached(course_cache, course_id, load)
+
+
+def invalidate_class_course(classroom: str = DEFAULT_CLASSROOM) -> None:
+    _bump_generation()
+    class_course_cache.pop(classroom)
+
+
+def invalidate_course(course_id: str) -> None:
+    _bump_generation()
+    course_cache.pop(course_id)
+
+
+def stats() -> dict:
+    return {"class_course": class_course_cache.stats(), "courses": course_cache.stats(), "single_flight": flights.stats()}
@@ -0,0 +1,206 @@
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from app.classrooms import DEFAULT_CLASSROOM, PerClassroom
+from app.db import pool
+from app.events import Broadcaster, status_hubs
+
+# how many of the newest comments the snapshot can include
+DASHBOARD_RECENT = 50
+
+COMMENT_FIELDS = ("comment_id", "user_id", "text", "reply_to", "genre", "student_id", "created_at", "lat", "lon")
+
+
+def _to_ms(iso: str | None) -> int | None:
+    if not iso:
+        return None
+    try:
+        return int(datetime.fromisoformat(iso.replace("Z", "+00:00")).timestamp() * 1000)
+    except ValueError:
+        return None
+
+
+def _to_iso(ms: int | None) -> str | None:
+    if ms is None:
+        return None
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).replace(tzinfo=None).isoformat(timespec="milliseconds") + "Z"
+
+
+def course_summary(conn: sqlite3.Connection, course_id: str | None, set_at: str | None = None) -> dict | None:
+    if not course_id:
+        return None
+    row = conn.execute(
+        "SELECT point_count, distance_m, min_lat, min_lon, max_lat, max_lon FROM course_geometry WHERE course_id = ?",
+        (course_id,),
+    ).fetchone()
+    out = {"course_id": course_id, "set_at": set_at, "point_count": None, "distance_m": None, "bbox": None}
+    if row:
+        out["point_count"] = row["point_count"]
+        out["distance_m"] = round(row["distance_m"], 1)
+        out["bbox"] = [row["min_lon"], row["min_lat"], row["max_lon"], row["max_lat"]]
+    return out
+
+
+class Dashboard:
+    """One classroom's teacher dashboard aggregates, maintained incrementally in memory.
+
+    Loaded once from the database on first use; afterwards every comment,
+    student, track upload, status and course change updates the counters
+    through the on_* hooks and publishes a delta on ``hub``. Writers call
+    the hooks while still holding the writer connection, and the initial
+    load also runs under it, so no commit is counted twice or missed.
+    """
+
+    def __init__(self, classroom: str = DEFAULT_CLASSROOM, recent_size: int = DASHBOARD_RECENT):
+        self.classroom = classroom
+        self.hub = Broadcaster(queue_size=256)
+        self.version = 0
+        self.loaded = False
+        self._lock = threading.RLock()
+        self._students: dict[str, dict] = {}
+        self._recent: deque[dict] = deque(maxlen=recent_size)
+        self._total_comments = 0
+        self._status: dict | None = None
+        self._course: dict | None = None
+
+    def ensure_loaded(self) -> None:
+        if self.loaded:
+            return
+        with pool.writer() as conn, self._lock:
+            if self.loaded:
+                return
+            self._load(conn)
+            self.loaded = True
+
+    def _load(self, conn: sqlite3.Connection) -> None:
+        classroom = (self.classroom,)
+        for row in conn.execute("SELECT student_id, name FROM students WHERE classroom_id = ?", classroom):
+            self._student(row["student_id"], row["name"])
+        for row in conn.execute(
+            "SELECT student_id, COUNT(*) AS n, MAX(created_at) AS last FROM comments"
+            " WHERE classroom_id = ? AND student_id IS NOT NULL GROUP BY student_id",
+            classroom,
+        ):
+            entry = self._student(row["student_id"])
+            entry["comment_count"] = row["n"]
+            entry["_seen"] = max(entry["_seen"] or 0, _to_ms(row["last"]) or 0) or None
+        for row in conn.execute("SELECT student_id, MAX(ts) AS ts FROM track_points WHERE classroom_id = ? GROUP BY student_id", classroom):
+            entry = self._student(row["student_id"])
+            entry["_seen"] = max(entry["_seen"] or 0, row["ts"])
+        self._total_comments = conn.execute("SELECT COUNT(*) FROM comments WHERE classroom_id = ?", classroom).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT {', '.join(COMMENT_FIELDS)} FROM comments WHERE classroom_id = ? ORDER BY created_at DESC LIMIT ?",
+            (self.classroom, self._recent.maxlen),
+        ).fetchall()
+        for row in reversed(rows):
+            self._recent.append(self._comment(dict(row)))
+        # the hub is ahead of the table (status rows are committed write-behind)
+        status = conn.execute(
+            "SELECT status, created_at FROM statuses WHERE classroom_id = ? ORDER BY id DESC LIMIT 1", classroom
+        ).fetchone()
+        status_hub = status_hubs(self.classroom)
+        if status_hub.latest is not None:
+            self._status = dict(status_hub.latest)
+        elif status:
+            self._status = {"status": status["status"], "created_at": status["created_at"]}
+        pointer = conn.execute("SELECT course_id, set_at FROM class_course WHERE classroom_id = ?", classroom).fetchone()
+        if pointer:
+            self._course = course_summary(conn, pointer["course_id"], pointer["set_at"])
+
+    def _student(self, student_id: str, name: str | None = None) -> dict:
+        entry = self._students.get(student_id)
+        if entry is None:
+            entry = self._students[student_id] = {"student_id": student_id, "name": name, "comment_count": 0, "_seen": None}
+        elif name is not None:
+            entry["name"] = name
+        return entry
+
+    def _comment(self, comment: dict) -> dict:
+        out = {k: comment.get(k) for k in COMMENT_FIELDS}
+        entry = self._students.get(comment.get("student_id") or "")
+        out["student_name"] = entry["name"] if entry else None
+        return out
+
+    @staticmethod
+    def _student_view(entry: dict) -> dict:
+        return {
+            "student_id": entry["student_id"],
+            "name": entry["name"],
+            "comment_count": entry["comment_count"],
+            "last_seen": _to_iso(entry["_seen"]),
+        }
+
+    def _publish(self, delta: dict) -> None:
+        self.version += 1
+        self.hub.publish({**delta, "version": self.version})
+
+    # hooks: no-ops until the first snapshot has loaded the baseline
+
+    def on_comment(self, comment: dict) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            self._total_comments += 1
+            delta = {"type": "comment", "total_comments": self._total_comments}
+            student_id = comment.get("student_id")
+            if student_id:
+                entry = self._student(student_id)
+                entry["comment_count"] += 1
+                entry["_seen"] = max(entry["_seen"] or 0, _to_ms(comment.get("created_at")) or 0) or None
+                delta["student"] = self._student_view(entry)
+            delta["comment"] = self._comment(comment)
+            self._recent.append(delta["comment"])
+            self._publish(delta)
+
+    def on_student(self, student_id: str, name: str) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            entry = self._student(student_id, name)
+            self._publish({"type": "student", "student": self._student_view(entry)})
+
+    def on_track(self, student_id: str, last_ts: int) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            entry = self._student(student_id)
+            if entry["_seen"] is not None and entry["_seen"] >= last_ts:
+                return
+            entry["_seen"] = last_ts
+            self._publish({"type": "presence", "student_id": student_id, "last_seen": _to_iso(last_ts)})
+
+    def on_status(self, status: dict) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            self._status = dict(status)
+            self._publish({"type": "status", "status": self._status})
+
+    def on_course(self, conn: sqlite3.Connection, course_id: str, set_at: str) -> None:
+        with self._lock:
+            if not self.loaded:
+                return
+            self._course = course_summary(conn, course_id, set_at)
+            self._publish({"type": "course", "course": self._course})
+
+    def snapshot(self, recent: int = 20) -> dict:
+        self.ensure_loaded()
+        with self._lock:
+            students = sorted((self._student_view(e) for e in self._students.values()), key=lambda s: (s["name"] or "", s["student_id"]))
+            recent_comments = list(self._recent)[-recent:][::-1] if recent > 0 else []
+            return {
+                "type": "snapshot",
+                "version": self.version,
+                "generated_at": datetime.utcnow().isoformat() + "Z",
+                "status": self._status,
+                "course": self._course,
+                "totals": {"students": len(self._students), "comments": self._total_comments},
+                "students": students,
+                "recent_comments": recent_comments,
+            }
+
+
+dashboards: PerClassroom[Dashboard] = PerClassroom(Dashboard)
+dashboard = dashboards(DEFAULT_CLASSROOM)
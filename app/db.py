@@ -1,26 +1,270 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Iterator
 from datetime import datetime
-import sys
 
-DB_PATH = Path(__file__).resolve().parent.parent / "data" / "app.db"
+from app import metrics
+from app.classrooms import DEFAULT_CLASSROOM
+
+# MACHI_DB_PATH points scripts (e.g. the load simulation) at a scratch database
+DB_PATH = Path(os.environ.get("MACHI_DB_PATH") or Path(__file__).resolve().parent.parent / "data" / "app.db")
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# pool sizing (override via env for larger classrooms)
+POOL_SIZE = int(os.environ.get("MACHI_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("MACHI_DB_POOL_TIMEOUT", "10"))
+
+# applied once to every new connection; negative cache_size is in KiB
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+_VERBS = {"SELECT": "select", "WITH": "select", "INSERT": "insert", "REPLACE": "insert", "UPDATE": "update", "DELETE": "delete", "PRAGMA": "pragma"}
+_verb_cache: dict[str, str] = {}
+
+
+def _verb(sql: str) -> str:
+    verb = _verb_cache.get(sql)
+    if verb is None:
+        words = sql.split(None, 1)
+        verb = _VERBS.get(words[0].upper(), "other") if words else "other"
+        if len(_verb_cache) < 1024:
+            _verb_cache[sql] = verb
+    return verb
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports statement and fetch time to app.metrics.
+
+    Rows read by iterating the cursor directly are not timed; fetchone /
+    fetchmany / fetchall are.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_db(_verb(sql), time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_db(_verb(sql), time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.observe_db("fetch", time.perf_counter() - start)
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.observe_db("fetch", time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.observe_db("fetch", time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose statements, fetches and commits are timed (see TimedCursor)."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.observe_db("commit", time.perf_counter() - start)
+
 
 def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+    start = time.perf_counter()
+    factory = TimedConnection if metrics.METRICS_ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False, factory=factory)
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    if metrics.METRICS_ENABLED:
+        metrics.observe_db("connect", time.perf_counter() - start)
     return conn
 
 
-def init_db() -> None:
-    conn = get_connection()
-    cur = conn.cursor()
-    # comments table (ensure schema exists). Do NOT drop existing comments
-    # on startup - dropping here caused persisted comments to be erased when
-    # the app restarted. Use IF NOT EXISTS to keep data safe.
-    cur.execute(
+class PoolTimeout(RuntimeError):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Request handlers check connections out with acquire()/release() (see
+    iter_conn). Writes are funnelled through a single dedicated writer
+    connection guarded by a lock so concurrent requests never fight over
+    the SQLite write lock.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats_lock = threading.Lock()
+        self._writer: sqlite3.Connection | None = None
+        self._writer_lock = threading.Lock()
+        self._opened = 0
+        self._checked_out = 0
+        self._acquires = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._writer_acquires = 0
+        self._writer_wait_total = 0.0
+        self._writer_wait_max = 0.0
+
+    def acquire(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"no database connection available after {self.timeout}s")
+        waited = time.perf_counter() - start
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = get_connection()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._stats_lock:
+                self._opened += 1
+        with self._stats_lock:
+            self._checked_out += 1
+            self._acquires += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        try:
+            # never hand out a connection with a half-finished transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.close()
+            with self._stats_lock:
+                self._opened -= 1
+        finally:
+            with self._stats_lock:
+                self._checked_out -= 1
+            self._slots.release()
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        start = time.perf_counter()
+        if not self._writer_lock.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"database writer busy for more than {self.timeout}s")
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self._writer_acquires += 1
+            self._writer_wait_total += waited
+            self._writer_wait_max = max(self._writer_wait_max, waited)
+        try:
+            if self._writer is None:
+                self._writer = get_connection()
+            conn = self._writer
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+        finally:
+            self._writer_lock.release()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "size": self.size,
+                "open": self._opened,
+                "idle": self._idle.qsize(),
+                "checked_out": self._checked_out,
+                "acquires": self._acquires,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "writer_acquires": self._writer_acquires,
+                "writer_wait_total_ms": round(self._writer_wait_total * 1000, 3),
+                "writer_wait_max_ms": round(self._writer_wait_max * 1000, 3),
+            }
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._stats_lock:
+            self._opened = 0
+
+
+pool = ConnectionPool()
+
+
+# tables whose GET endpoints answer If-None-Match (see app/conditional.py)
+VERSIONED_TABLES = ("comments", "students", "users", "courses", "class_course", "statuses")
+# tables whose rows belong to one classroom (class_course and course_results are keyed by it)
+CLASSROOM_TABLES = ("comments", "students", "statuses", "groq_logs", "track_points")
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    # databases from before user_version was tracked may already have it
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Numbered schema migrations, applied in order by init_db() and recorded in
+# PRAGMA user_version. Never edit or renumber one that has shipped: append a
+# new one. Everything uses IF NOT EXISTS / column probes because databases
+# created before versioning start at user_version 0 with part of it applied.
+
+
+def _m1_core_tables(conn: sqlite3.Connection) -> None:
+    # comments are never dropped here: an earlier DROP on startup erased persisted comments
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS comments (
             comment_id TEXT PRIMARY KEY,
@@ -33,27 +277,8 @@ def init_db() -> None:
         )
         """
     )
-    # Ensure lat/lon columns exist for comments (store location of comment)
-    cur.execute("PRAGMA table_info(comments)")
-    cols = [r[1] for r in cur.fetchall()]
-    print(f"[init_db] comments columns before migration: {cols}")
-    if 'lat' not in cols:
-        try:
-            cur.execute("ALTER TABLE comments ADD COLUMN lat REAL")
-            print("[init_db] added column: lat")
-        except Exception:
-            e = sys.exc_info()[1]
-            print(f"[init_db] failed to add column lat: {e}")
-    if 'lon' not in cols:
-        try:
-            cur.execute("ALTER TABLE comments ADD COLUMN lon REAL")
-            print("[init_db] added column: lon")
-        except Exception:
-            e = sys.exc_info()[1]
-            print(f"[init_db] failed to add column lon: {e}")
-
     # users table for mapping name to uuid
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
             user_id TEXT PRIMARY KEY,
@@ -62,9 +287,8 @@ def init_db() -> None:
         )
         """
     )
-
     # students table for student registration
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS students (
             student_id TEXT PRIMARY KEY,
@@ -73,9 +297,8 @@ def init_db() -> None:
         )
         """
     )
-
     # courses table to store GPX content
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS courses (
             course_id TEXT PRIMARY KEY,
@@ -84,20 +307,8 @@ def init_db() -> None:
         )
         """
     )
-
-    # class_course pointer table (single row stored by key)
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS class_course (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            course_id TEXT,
-            set_at TEXT
-        )
-        """
-    )
-
     # statuses log
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS statuses (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -106,16 +317,12 @@ def init_db() -> None:
         )
         """
     )
-
     # ensure there is at least one initial status (デバッグ) to avoid client-side overwrite logic
-    cur.execute("SELECT COUNT(1) as cnt FROM statuses")
-    row = cur.fetchone()
-    if row and row[0] == 0:
+    if conn.execute("SELECT COUNT(1) FROM statuses").fetchone()[0] == 0:
         now = datetime.utcnow().isoformat() + "Z"
-        cur.execute("INSERT INTO statuses (status, created_at) VALUES (?, ?)", ("デバッグ", now))
-
+        conn.execute("INSERT INTO statuses (status, created_at) VALUES (?, ?)", ("デバッグ", now))
     # groq logs (text/audio)
-    cur.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS groq_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -127,22 +334,352 @@ def init_db() -> None:
         )
         """
     )
-    conn.commit()
-    conn.close()
 
 
-def iter_conn() -> Generator[sqlite3.Connection, None, None]:
+def _m2_comment_locations(conn: sqlite3.Connection) -> None:
+    # location of a comment, plus an R*Tree over it (id = comments.rowid) kept in sync by triggers
+    _add_column(conn, "comments", "lat", "REAL")
+    _add_column(conn, "comments", "lon", "REAL")
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS comments_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS comments_rtree_ai AFTER INSERT ON comments
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO comments_rtree VALUES (NEW.rowid, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS comments_rtree_au AFTER UPDATE OF lat, lon ON comments
+        BEGIN
+            DELETE FROM comments_rtree WHERE id = OLD.rowid;
+            INSERT INTO comments_rtree SELECT NEW.rowid, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+            WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS comments_rtree_ad AFTER DELETE ON comments
+        BEGIN
+            DELETE FROM comments_rtree WHERE id = OLD.rowid;
+        END
+        """
+    )
+    # backfill rows written before the index existed
+    conn.execute(
+        """
+        INSERT INTO comments_rtree
+        SELECT rowid, lat, lat, lon, lon FROM comments
+        WHERE lat IS NOT NULL AND lon IS NOT NULL
+          AND rowid NOT IN (SELECT id FROM comments_rtree)
+        """
+    )
+
+
+def _m3_text_normalisation(conn: sqlite3.Connection) -> None:
+    # text is normalised on insert; these mark which rows went through it (see app/text.py)
+    _add_column(conn, "comments", "text_norm_version", "INTEGER")
+    _add_column(conn, "students", "name_norm_version", "INTEGER")
+
+
+def _m4_course_geometry(conn: sqlite3.Connection) -> None:
+    # parsed course geometry (typed arrays as BLOBs) derived once at upload
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS course_geometry (
+            course_id TEXT PRIMARY KEY,
+            point_count INTEGER NOT NULL,
+            distance_m REAL NOT NULL,
+            min_lat REAL,
+            min_lon REAL,
+            max_lat REAL,
+            max_lon REAL,
+            coords BLOB NOT NULL,
+            ele BLOB NOT NULL,
+            times BLOB NOT NULL,
+            etag TEXT NOT NULL
+        )
+        """
+    )
+    # simplified level-of-detail point indices (uint32 BLOB) per course
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS course_lod (
+            course_id TEXT NOT NULL,
+            tolerance_m REAL NOT NULL,
+            indices BLOB NOT NULL,
+            PRIMARY KEY (course_id, tolerance_m)
+        )
+        """
+    )
+
+
+def _m5_reply_cache(conn: sqlite3.Connection) -> None:
+    # persistent tier of the captain reply cache (see app/reply_cache.py)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS groq_cache (
+            key TEXT PRIMARY KEY,
+            output TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+
+
+def _m6_track_points(conn: sqlite3.Connection) -> None:
+    # student GPS traces: one row per kept fix, lat/lon as integer 1e-7 degrees (~1 cm)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS track_points (
+            student_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            lat_e7 INTEGER NOT NULL,
+            lon_e7 INTEGER NOT NULL,
+            accuracy_m INTEGER,
+            PRIMARY KEY (student_id, ts)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _m7_classrooms(conn: sqlite3.Connection) -> None:
+    # classroom dimension (see app/classrooms.py); rows from before it belong to the default classroom
+    for table in CLASSROOM_TABLES:
+        _add_column(conn, table, "classroom_id", f"TEXT NOT NULL DEFAULT '{DEFAULT_CLASSROOM}'")
+
+    # class_course pointer table: one row per classroom; the old single-row
+    # table (CHECK id = 1) becomes the default classroom's row
+    legacy = "id" in _columns(conn, "class_course")
+    if legacy:
+        conn.execute("ALTER TABLE class_course RENAME TO class_course_single")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS class_course (
+            classroom_id TEXT PRIMARY KEY,
+            course_id TEXT,
+            set_at TEXT
+        )
+        """
+    )
+    if legacy:
+        conn.execute(
+            "INSERT INTO class_course (classroom_id, course_id, set_at) SELECT ?, course_id, set_at FROM class_course_single WHERE id = 1",
+            (DEFAULT_CLASSROOM,),
+        )
+        conn.execute("DROP TABLE class_course_single")
+
+    # route-completion results per lesson (classroom + course + the time it was set), see app/results.py.
+    # Derived data: a copy keyed without the classroom is dropped and recomputed on demand.
+    cols = _columns(conn, "course_results")
+    if cols and "classroom_id" not in cols:
+        conn.execute("DROP TABLE course_results")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS course_results (
+            classroom_id TEXT NOT NULL,
+            course_id TEXT NOT NULL,
+            set_at TEXT NOT NULL,
+            computed_at TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (classroom_id, course_id, set_at)
+        )
+        """
+    )
+
+    # every read is scoped to one classroom, so each index leads with it:
+    # comment lists/feeds by time or by rowid/seq (the implicit last key of the plain index)
+    conn.execute("DROP INDEX IF EXISTS idx_comments_created_at")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_classroom_created ON comments(classroom_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_classroom ON comments(classroom_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_students_classroom_created ON students(classroom_id, created_at)")
+    # latest status of a classroom is the last entry of its (classroom_id, id) range
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_statuses_classroom ON statuses(classroom_id, id)")
+    # results read a classroom's fixes since the lesson started
+    conn.execute("DROP INDEX IF EXISTS idx_track_points_ts")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_track_points_classroom_ts ON track_points(classroom_id, ts)")
+
+
+def _m8_table_versions(conn: sqlite3.Connection) -> None:
+    # per-table change counters, bumped by triggers; conditional GETs compare these instead of the rows.
+    # After _m7 so the rebuilt class_course gets its triggers too.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table in VERSIONED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+                """
+            )
+
+
+def _m9_comment_seq(conn: sqlite3.Connection) -> None:
+    # feed cursors and the R*Tree need a stable key: VACUUM may renumber the implicit rowid of a
+    # TEXT-keyed table, but never an INTEGER PRIMARY KEY. Old rowids become seq, so cursors stay valid.
+    if "seq" in _columns(conn, "comments"):
+        return
+    conn.execute(
+        f"""
+        CREATE TABLE comments_seq (
+            seq INTEGER PRIMARY KEY,
+            comment_id TEXT UNIQUE,
+            user_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            reply_to TEXT,
+            genre TEXT,
+            student_id TEXT,
+            created_at TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            text_norm_version INTEGER,
+            classroom_id TEXT NOT NULL DEFAULT '{DEFAULT_CLASSROOM}'
+        )
+        """
+    )
+    cols = "comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon, text_norm_version, classroom_id"
+    conn.execute(f"INSERT INTO comments_seq (seq, {cols}) SELECT rowid, {cols} FROM comments")
+    conn.execute("DROP TABLE comments")
+    conn.execute("ALTER TABLE comments_seq RENAME TO comments")
+    # indexes and triggers went with the old table
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_classroom_created ON comments(classroom_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_classroom ON comments(classroom_id)")
+    _m2_comment_locations(conn)
+    _m8_table_versions(conn)
+
+
+def _m10_rtree_on_seq(conn: sqlite3.Connection) -> None:
+    # key comments_rtree on comments.seq by name, and rebuild it: a database vacuumed while the
+    # index still followed the implicit rowid may hold entries that point at the wrong comments
+    for name in ("comments_rtree_ai", "comments_rtree_au", "comments_rtree_ad"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute(
+        """
+        CREATE TRIGGER comments_rtree_ai AFTER INSERT ON comments
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO comments_rtree VALUES (NEW.seq, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER comments_rtree_au AFTER UPDATE OF lat, lon ON comments
+        BEGIN
+            DELETE FROM comments_rtree WHERE id = OLD.seq;
+            INSERT INTO comments_rtree SELECT NEW.seq, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+            WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER comments_rtree_ad AFTER DELETE ON comments
+        BEGIN
+            DELETE FROM comments_rtree WHERE id = OLD.seq;
+        END
+        """
+    )
+    conn.execute("DELETE FROM comments_rtree")
+    conn.execute(
+        "INSERT INTO comments_rtree SELECT seq, lat, lat, lon, lon FROM comments WHERE lat IS NOT NULL AND lon IS NOT NULL"
+    )
+
+
+MIGRATIONS = (
+    (1, _m1_core_tables),
+    (2, _m2_comment_locations),
+    (3, _m3_text_normalisation),
+    (4, _m4_course_geometry),
+    (5, _m5_reply_cache),
+    (6, _m6_track_points),
+    (7, _m7_classrooms),
+    (8, _m8_table_versions),
+    (9, _m9_comment_seq),
+    (10, _m10_rtree_on_seq),
+)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db() -> list[int]:
+    """Apply the migrations newer than the database's user_version; returns their numbers.
+
+    Called once at startup (and by scripts/tests that need the schema).
+    Each migration commits together with its version bump, under a write
+    lock, so concurrent starters apply it exactly once. An up-to-date
+    database costs one PRAGMA read.
+    """
     conn = get_connection()
+    # explicit transactions: the sqlite3 module would otherwise commit around DDL
+    conn.isolation_level = None
+    applied = []
     try:
-        yield conn
+        if schema_version(conn) >= MIGRATIONS[-1][0]:
+            return applied
+        for version, migrate in MIGRATIONS:
+            if schema_version(conn) >= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # another process may have applied it while this one waited for the lock
+                if schema_version(conn) < version:
+                    migrate(conn)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    applied.append(version)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
     finally:
         conn.close()
+    return applied
+
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    # context manager for a pooled connection outside of a dependency
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def iter_conn() -> Generator[sqlite3.Connection, None, None]:
+    # FastAPI dependency: a pooled connection for the duration of the request
+    with read_connection() as conn:
+        yield conn
+
+
+def iter_write_conn() -> Generator[sqlite3.Connection, None, None]:
+    # FastAPI dependency: the dedicated writer connection (serialised)
+    with pool.writer() as conn:
+        yield conn
+
 
+def write_connection():
+    # context manager for writes outside of a dependency (e.g. after a slow upstream call)
+    return pool.writer()
 
-# Ensure DB is initialized when module is imported (useful for tests/import-time)
-try:
-    init_db()
-except Exception:
-    e = sys.exc_info()[1]
-    # do not raise here, but print the error so migration issues are visible during import
-    print(f"[init_db] import-time init_db() raised exception: {e}")
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Callable
+
+from app.classrooms import DEFAULT_CLASSROOM, PerClassroom
+
+
+class Broadcaster:
+    """In-process fan-out hub for server-push channels.
+
+    Writers call publish() from any thread (sync handlers run in the
+    threadpool); every connected subscriber gets the event on its own
+    asyncio queue. The latest event is kept so new subscribers receive the
+    current value immediately without touching the database.
+    """
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self.latest: dict | None = None
+        # bumped on every change of ``latest``; used as a cheap validator for polling clients
+        self.version = 0
+        self._lock = threading.Lock()
+        self._subscribers: set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: dict) -> None:
+        with self._lock:
+            self.latest = event
+            self.version += 1
+            subscribers = list(self._subscribers)
+        for loop, q in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, q, event)
+            except RuntimeError:
+                # loop already closed; the subscriber will be dropped on exit
+                pass
+
+    def seed(self, event: dict) -> None:
+        # set the current value without notifying (used on first connect)
+        with self._lock:
+            if self.latest is None:
+                self.latest = event
+                self.version += 1
+
+    def _put(self, q: asyncio.Queue, event: dict) -> None:
+        if q.full():
+            # slow consumer: drop the oldest event, the newest one wins
+            try:
+                q.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        q.put_nowait(event)
+
+    async def subscribe(self, initial: Callable[[], dict] | None = None) -> AsyncIterator[dict]:
+        """Yield the current value, then every change.
+
+        With ``initial`` its result is sent first instead of ``latest``; it is
+        computed after registering, so no event published meanwhile is lost.
+        """
+        q: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        entry = (asyncio.get_running_loop(), q)
+        with self._lock:
+            self._subscribers.add(entry)
+            current = self.latest if initial is None else None
+        if initial is not None:
+            current = initial()
+        try:
+            if current is not None:
+                yield current
+            while True:
+                event = await q.get()
+                if event != current:
+                    current = event
+                    yield event
+        finally:
+            with self._lock:
+                self._subscribers.discard(entry)
+
+
+def sse_event(event_name: str, data) -> str:
+    return f"event: {event_name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def sse_stream(hub: Broadcaster, event_name: str, heartbeat: float = 15.0, initial: Callable[[], dict] | None = None) -> AsyncIterator[str]:
+    """Render hub events as text/event-stream frames, with keep-alive comments."""
+    events = hub.subscribe(initial)
+    pending: asyncio.Task | None = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=heartbeat)
+            if not done:
+                # keeps proxies (cloudflared) from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            event = pending.result()
+            pending = None
+            yield sse_event(event_name, event)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        await events.aclose()
+
+
+# latest lesson status per classroom; fed by POST /api/status and POST /api/control/status
+status_hubs: PerClassroom[Broadcaster] = PerClassroom(lambda classroom: Broadcaster())
+status_hub = status_hubs(DEFAULT_CLASSROOM)
@@ -0,0 +1,33 @@
+import math
+
+EARTH_RADIUS_M = 6371008.8
+# metres per degree of latitude (close enough everywhere for bbox padding)
+M_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_around(lat: float, lon: float, radius_m: float) -> tuple[float, float, float, float]:
+    """Return (min_lat, min_lon, max_lat, max_lon) enclosing a circle."""
+    dlat = radius_m / M_PER_DEG_LAT
+    coslat = max(math.cos(math.radians(lat)), 1e-6)
+    dlon = min(radius_m / (M_PER_DEG_LAT * coslat), 180.0)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+def parse_bbox(value: str) -> tuple[float, float, float, float]:
+    """Parse Leaflet's ``west,south,east,north`` into (min_lat, min_lon, max_lat, max_lon)."""
+    parts = [float(p) for p in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must be west,south,east,north")
+    west, south, east, north = parts
+    if south > north or west > east:
+        raise ValueError("bbox corners are out of order")
+    return south, west, north, east
@@ -0,0 +1,292 @@
+import hashlib
+import math
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from app.geo import EARTH_RADIUS_M, haversine_m
+
+# Douglas-Peucker tolerances precomputed per course (metres)
+LOD_TOLERANCES_M = (2.0, 8.0, 32.0, 128.0)
+# Web Mercator ground resolution at zoom 0 on the equator (metres per pixel)
+M_PER_PX_Z0 = 156543.03392
+# parse_gpx feeds text in slices this long, so pending parser events stay bounded
+PARSE_CHUNK_CHARS = 1 << 16
+
+
+class GPXError(ValueError):
+    """The uploaded content is not a usable GPX track."""
+
+
+def _local(tag: str) -> str:
+    # strip "{http://www.topografix.com/GPX/1/1}" style namespaces
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_time(value: str | None) -> float:
+    if not value:
+        return math.nan
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return math.nan
+
+
+class CourseGeometry:
+    """Compact, pre-parsed form of a GPX course.
+
+    Coordinates are kept as typed arrays (float64) so they can be stored as
+    BLOBs and re-served without touching the XML again.
+    """
+
+    __slots__ = ("lats", "lons", "eles", "times", "distance_m", "bbox", "etag", "lods", "_polyline", "_lod_polylines")
+
+    def __init__(self, lats: array, lons: array, eles: array, times: array, etag: str, distance_m: float | None = None):
+        self.lats = lats
+        self.lons = lons
+        self.eles = eles
+        self.times = times
+        self.etag = etag
+        self._polyline: str | None = None
+        # tolerance_m -> indices of the points kept at that level of detail
+        self.lods: dict[float, array] = {}
+        self._lod_polylines: dict[float, str] = {}
+        if lats:
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        else:
+            self.bbox = None
+        if distance_m is None:
+            distance_m = sum(haversine_m(lats[i - 1], lons[i - 1], lats[i], lons[i]) for i in range(1, len(lats)))
+        self.distance_m = distance_m
+
+    @property
+    def point_count(self) -> int:
+        return len(self.lats)
+
+    def summary(self) -> dict:
+        bbox = None
+        if self.bbox:
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            bbox = [min_lon, min_lat, max_lon, max_lat]
+        return {"point_count": self.point_count, "distance_m": round(self.distance_m, 1), "bbox": bbox}
+
+    def polyline(self) -> str:
+        if self._polyline is None:
+            self._polyline = encode_polyline(self.lats, self.lons)
+        return self._polyline
+
+    def build_lods(self, tolerances=LOD_TOLERANCES_M) -> None:
+        for tol in tolerances:
+            self.lods[tol] = simplify_indices(self.lats, self.lons, tol)
+        self._lod_polylines.clear()
+
+    def tolerance_for_zoom(self, zoom: int) -> float:
+        """Coarsest precomputed tolerance below one screen pixel at ``zoom`` (0 = full detail)."""
+        mid_lat = (self.bbox[0] + self.bbox[2]) / 2 if self.bbox else 0.0
+        m_per_px = M_PER_PX_Z0 * math.cos(math.radians(mid_lat)) / (2 ** zoom)
+        usable = [tol for tol in self.lods if tol <= m_per_px]
+        return max(usable) if usable else 0.0
+
+    def lod_polyline(self, tolerance_m: float) -> tuple[str, int]:
+        if not tolerance_m:
+            return self.polyline(), self.point_count
+        idx = self.lods[tolerance_m]
+        if tolerance_m not in self._lod_polylines:
+            self._lod_polylines[tolerance_m] = encode_polyline([self.lats[i] for i in idx], [self.lons[i] for i in idx])
+        return self._lod_polylines[tolerance_m], len(idx)
+
+    def float32_coords(self) -> bytes:
+        # interleaved little-endian [lat, lon, lat, lon, ...] for a JS Float32Array
+        packed = array("f", (v for pair in zip(self.lats, self.lons) for v in pair))
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed.tobytes()
+
+    def elevations(self) -> list[float | None]:
+        return [None if math.isnan(e) else round(e, 1) for e in self.eles]
+
+    def to_row(self) -> dict:
+        coords = array("d", (v for pair in zip(self.lats, self.lons) for v in pair))
+        min_lat, min_lon, max_lat, max_lon = self.bbox or (None, None, None, None)
+        return {
+            "point_count": self.point_count,
+            "distance_m": self.distance_m,
+            "min_lat": min_lat,
+            "min_lon": min_lon,
+            "max_lat": max_lat,
+            "max_lon": max_lon,
+            "coords": coords.tobytes(),
+            "ele": self.eles.tobytes(),
+            "times": self.times.tobytes(),
+            "etag": self.etag,
+        }
+
+    @classmethod
+    def from_row(cls, row) -> "CourseGeometry":
+        coords = array("d")
+        coords.frombytes(row["coords"])
+        eles = array("d")
+        eles.frombytes(row["ele"])
+        times = array("d")
+        times.frombytes(row["times"])
+        return cls(coords[0::2], coords[1::2], eles, times, row["etag"], row["distance_m"])
+
+
+class GPXLimitError(GPXError):
+    """The GPX exceeds a configured size or point limit."""
+
+
+class GPXStreamParser:
+    """Incremental GPX parser: feed() chunks as they arrive, then close().
+
+    Built on XMLPullParser, so malformed XML or a non-<gpx> root fails on
+    the chunk that reveals it. Each point is reduced to four floats and its
+    element dropped from the tree, so memory grows with the point count
+    (capped by ``max_points``) and not with the size of the XML.
+    """
+
+    def __init__(self, max_points: int | None = None):
+        self.max_points = max_points
+        self.bytes_fed = 0
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._hash = hashlib.sha256()
+        self._stack: list[ET.Element] = []
+        self._root_checked = False
+        # track points win; route points are the fallback for files without a track
+        self._points = {"trkpt": tuple(array("d") for _ in range(4)), "rtept": tuple(array("d") for _ in range(4))}
+
+    def feed(self, chunk: bytes | str) -> None:
+        data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        self._hash.update(data)
+        self.bytes_fed += len(data)
+        try:
+            self._parser.feed(chunk)
+            self._drain()
+        except ET.ParseError as exc:
+            raise GPXError(f"invalid GPX XML: {exc}")
+
+    def close(self) -> CourseGeometry:
+        try:
+            self._parser.close()
+            self._drain()
+        except ET.ParseError as exc:
+            raise GPXError(f"invalid GPX XML: {exc}")
+        if not self._root_checked:
+            raise GPXError("invalid GPX XML: no root element")
+        lats, lons, eles, times = self._points["trkpt"] if self._points["trkpt"][0] else self._points["rtept"]
+        if not lats:
+            raise GPXError("GPX contains no track or route points")
+        return CourseGeometry(lats, lons, eles, times, self._hash.hexdigest()[:20])
+
+    def _drain(self) -> None:
+        for event, el in self._parser.read_events():
+            if event == "start":
+                if not self._root_checked:
+                    if _local(el.tag) != "gpx":
+                        raise GPXError("root element is not <gpx>")
+                    self._root_checked = True
+                self._stack.append(el)
+                continue
+            self._stack.pop()
+            name = _local(el.tag)
+            if name in self._points:
+                self._add_point(self._points[name], el)
+                # every child of the parent has ended by now; dropping them all
+                # is O(1) per point, where remove(el) would scan the siblings
+                if self._stack:
+                    del self._stack[-1][:]
+
+    def _add_point(self, target: tuple[array, ...], pt: ET.Element) -> None:
+        try:
+            lat = float(pt.attrib["lat"])
+            lon = float(pt.attrib["lon"])
+        except (KeyError, ValueError):
+            raise GPXError("track point without valid lat/lon")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise GPXError(f"track point out of range: {lat},{lon}")
+        if self.max_points is not None and len(target[0]) >= self.max_points:
+            raise GPXLimitError(f"GPX has more than {self.max_points} points")
+        ele = math.nan
+        ts = math.nan
+        for child in pt:
+            name = _local(child.tag)
+            if name == "ele" and child.text:
+                try:
+                    ele = float(child.text)
+                except ValueError:
+                    pass
+            elif name == "time":
+                ts = _parse_time(child.text)
+        for values, value in zip(target, (lat, lon, ele, ts)):
+            values.append(value)
+
+
+def parse_gpx(text: str, max_points: int | None = None) -> CourseGeometry:
+    """Parse track points (or route points if there is no track) from GPX text."""
+    parser = GPXStreamParser(max_points=max_points)
+    for start in range(0, len(text), PARSE_CHUNK_CHARS):
+        parser.feed(text[start:start + PARSE_CHUNK_CHARS])
+    return parser.close()
+
+
+def simplify_indices(lats, lons, tolerance_m: float) -> array:
+    """Douglas-Peucker simplification; returns the indices of kept points.
+
+    Points are projected to a local equirectangular plane in metres and each
+    segment's perpendicular distances are computed in one NumPy pass, so the
+    Python loop runs once per kept point rather than once per input point.
+    """
+    n = len(lats)
+    if n <= 2:
+        return array("I", range(n))
+    lat = np.frombuffer(lats, dtype=np.float64) if isinstance(lats, array) else np.asarray(lats, dtype=np.float64)
+    lon = np.frombuffer(lons, dtype=np.float64) if isinstance(lons, array) else np.asarray(lons, dtype=np.float64)
+    lat_r = np.radians(lat)
+    y = lat_r * EARTH_RADIUS_M
+    x = np.radians(lon) * math.cos(float(lat_r.mean())) * EARTH_RADIUS_M
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        xs = x[start + 1:end]
+        ys = y[start + 1:end]
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        seg_len = math.hypot(dx, dy)
+        if seg_len == 0.0:
+            # closed loop (GPS art often starts and ends at the same spot)
+            dists = np.hypot(xs - x[start], ys - y[start])
+        else:
+            dists = np.abs(dy * (xs - x[start]) - dx * (ys - y[start])) / seg_len
+        i = int(dists.argmax())
+        if dists[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return array("I", np.flatnonzero(keep).astype(np.uint32).tolist())
+
+
+def encode_polyline(lats, lons, precision: int = 5) -> str:
+    """Google encoded polyline algorithm (Leaflet plugins and most map SDKs decode it)."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in zip(lats, lons):
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        for delta in (ilat - prev_lat, ilon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
@@ -1,21 +1,143 @@
+import asyncio
 import os
-from typing import Optional
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+# point at a local stub server in tests / offline development
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL") or None
+# per-request upstream timeout (seconds)
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", "30"))
+# concurrent upstream calls allowed, and how many more may queue behind them
+GROQ_MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", "8"))
+GROQ_MAX_WAITING = int(os.environ.get("GROQ_MAX_WAITING", "32"))
+# how long a queued request waits for a slot before giving up
+GROQ_QUEUE_TIMEOUT = float(os.environ.get("GROQ_QUEUE_TIMEOUT", "10"))
+
+_client_lock = threading.Lock()
+_client: Optional[object] = None
+# AsyncGroq wraps an httpx.AsyncClient, which is bound to the loop it was used on
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+
+
+def configure(api_key: str | None = None, base_url: str | None = None) -> None:
+    """Swap credentials/endpoint at runtime and drop the cached clients."""
+    global GROQ_API_KEY, GROQ_BASE_URL, _client
+    with _client_lock:
+        GROQ_API_KEY = api_key
+        GROQ_BASE_URL = base_url
+        _client = None
+        _async_clients.clear()
 
 
 def get_groq_client() -> Optional[object]:
+    global _client
     if not GROQ_API_KEY:
         return None
-    try:
-        from groq import Groq
+    with _client_lock:
+        if _client is None:
+            try:
+                from groq import Groq
 
-        client = Groq(api_key=GROQ_API_KEY)
-        return client
-    except Exception:
-        # if groq package not installed or import fails, return None
+                _client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=GROQ_TIMEOUT)
+            except Exception:
+                # if groq package not installed or import fails, return None
+                return None
+        return _client
+
+
+def get_async_groq_client() -> Optional[object]:
+    """Reused AsyncGroq client (one pooled HTTP connection set per event loop)."""
+    if not GROQ_API_KEY:
         return None
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            try:
+                from groq import AsyncGroq
+
+                client = AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=GROQ_TIMEOUT, max_retries=0)
+            except Exception:
+                return None
+            _async_clients[loop] = client
+        return client
+
+
+class GroqSaturated(Exception):
+    """Too many Groq calls in flight; the caller should retry later."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class GroqLimiter:
+    """Bounded concurrency for upstream Groq calls.
+
+    At most ``max_concurrency`` calls run at once and at most ``max_waiting``
+    more queue behind them. Anything beyond that is rejected immediately
+    (429); queued calls that do not get a slot within ``queue_timeout`` are
+    rejected with 503.
+    """
+
+    def __init__(self, max_concurrency: int, max_waiting: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        sem = self._semaphores.get(loop)
+        if sem is None:
+            sem = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return sem
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        sem = self._semaphore()
+        if sem.locked():
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise GroqSaturated(429, "too many voice/AI requests, please retry")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(sem.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise GroqSaturated(503, "AI service busy, please retry")
+            finally:
+                self.waiting -= 1
+        else:
+            await sem.acquire()
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "queue_timeouts": self.timeouts,
+        }
+
+
+limiter = GroqLimiter(GROQ_MAX_CONCURRENCY, GROQ_MAX_WAITING, GROQ_QUEUE_TIMEOUT)
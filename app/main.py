@@ -1,12 +1,24 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from app.routers import frontend, backend
-from app.routers import users, courses, class_course, status, comments_new as comments, groq, students
-from app.db import init_db
+from app.routers import users, courses, class_course, status, comments_new as comments, groq, students, tracks, dashboard, results
+from app.routers import profiling as profiling_router
+from app import course_cache, metrics, profiling
+from app.db import init_db, pool, PoolTimeout
+from app.groq_client import limiter
+from app.reply_cache import reply_cache
+from app.write_behind import write_behind
 
 app = FastAPI(title="Machi_tan", version="0.1.0")
 
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware, routes=lambda: app.routes)
+if profiling.enabled():
+    # opt-in: MACHI_PROFILE_TOKEN (per-request header) and/or MACHI_PROFILE_ROUTES
+    app.add_middleware(profiling.ProfilingMiddleware, routes=lambda: app.routes)
+
 # Mount static files
 STATIC_DIR = Path(__file__).resolve().parent / 'static'
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
@@ -24,15 +36,62 @@ app.include_router(class_course.router, prefix="/api", tags=["class_course"])
 app.include_router(status.router, prefix="/api", tags=["status"])
 app.include_router(comments.router, prefix="/api", tags=["comments"])
 app.include_router(students.router, prefix="/api", tags=["students"])
+app.include_router(tracks.router, prefix="/api", tags=["tracks"])
+app.include_router(dashboard.router, prefix="/api", tags=["dashboard"])
+app.include_router(results.router, prefix="/api", tags=["results"])
 app.include_router(groq.router, prefix="/api", tags=["groq"])
+app.include_router(profiling_router.router, prefix="/api", tags=["profiling"])
 app.include_router(__import__("app.routers.control", fromlist=["router"]).router, prefix="/api", tags=["control"])
 
 
 @app.on_event("startup")
 def on_startup():
-    # ensure database/tables exist
+    # apply pending schema migrations (a no-op on an up-to-date database)
     init_db()
 
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # drain buffered audit/status rows before the connections go away
+    write_behind.stop()
+    pool.close()
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok"}
+
+
+@app.get("/healthz/db")
+async def healthz_db():
+    # connection pool usage (checked-out connections, caller wait times), write-behind backlog, course cache
+    return {**pool.stats(), "write_behind": write_behind.stats(), "course_cache": course_cache.stats()}
+
+
+def _gauges(prefix: str, stats: dict) -> list:
+    # numeric entries of a stats() dict as unlabelled gauges; nested dicts become name parts
+    out = []
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            out.extend(_gauges(f"{prefix}_{key}", value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out.append((f"{prefix}_{key}", f"{prefix.replace('_', ' ')} {key}", "gauge", [({}, value)]))
+    return out
+
+
+metrics.registry.add_collector(lambda: _gauges("machi_db_pool", pool.stats()))
+metrics.registry.add_collector(lambda: _gauges("machi_write_behind", write_behind.stats()))
+metrics.registry.add_collector(lambda: _gauges("machi_course_cache", course_cache.stats()))
+metrics.registry.add_collector(lambda: _gauges("machi_groq_limiter", limiter.stats()))
+metrics.registry.add_collector(lambda: _gauges("machi_reply_cache", reply_cache.stats()))
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    # Prometheus text format: per-route latency, SQLite and Groq timings, pool/queue/cache gauges
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
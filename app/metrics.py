@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Iterable
+
+# MACHI_METRICS=0 removes the middleware and the database wrappers entirely
+METRICS_ENABLED = os.environ.get("MACHI_METRICS", "1") not in ("0", "false", "no")
+
+# seconds; SQLite statements live at the low end, Groq calls at the high end
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Starlette appends "; charset=utf-8" to text/* media types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter family with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Fixed-bucket histogram family with labels.
+
+    observe() is a bisect and two additions under a lock; buckets are
+    stored per bucket and only made cumulative when rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per series: [counts per bucket + overflow, sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, labels: tuple = ()) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1])) for labels, s in self._series.items())
+        for labels, (counts, total) in items:
+            running = 0
+            for bound, n in zip(self.buckets, counts):
+                running += n
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {running}"
+            running += counts[-1]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {running}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {running}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+        # callables returning [(name, help, type, [(labels dict, value)])] read at scrape time
+        self.collectors: list[Callable[[], list]] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], list]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, help, kind, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter("machi_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status"))
+)
+http_latency = registry.register(
+    Histogram("machi_http_request_duration_seconds", "Time from request start to the last response byte.", ("method", "route"))
+)
+http_db_time = registry.register(
+    Counter("machi_http_request_db_seconds_total", "SQLite time spent inside requests, by route.", ("method", "route"))
+)
+http_groq_time = registry.register(
+    Counter("machi_http_request_groq_seconds_total", "Groq upstream time spent inside requests, by route.", ("method", "route"))
+)
+db_latency = registry.register(
+    Histogram("machi_db_seconds", "SQLite calls: statements by verb, row fetches, commits and connection opens.", ("op",))
+)
+groq_latency = registry.register(
+    Histogram("machi_groq_seconds", "Groq upstream calls by kind and outcome.", ("call", "outcome"))
+)
+groq_errors = registry.register(
+    Counter("machi_groq_errors_total", "Failed Groq upstream calls by kind and exception type.", ("call", "error"))
+)
+
+# per-request accumulator [db seconds, groq seconds]; worker threads share the request's list
+_request_times: ContextVar[list | None] = ContextVar("machi_request_times", default=None)
+
+
+def observe_db(op: str, seconds: float) -> None:
+    db_latency.observe(seconds, (op,))
+    times = _request_times.get()
+    if times is not None:
+        times[0] += seconds
+
+
+@asynccontextmanager
+async def groq_call(call: str) -> AsyncIterator[None]:
+    """Time one upstream Groq call; errors are counted and re-raised."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception as exc:
+        outcome = "timeout" if isinstance(exc, TimeoutError) else "error"
+        groq_errors.inc((call, type(exc).__name__))
+        raise
+    except BaseException:
+        # the client went away mid-call
+        outcome = "cancelled"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        groq_latency.observe(seconds, (call, outcome))
+        times = _request_times.get()
+        if times is not None:
+            times[1] += seconds
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route request counts, latency and DB/Groq share.
+
+    The route label is the matched path template (``/api/students/{student_id}``),
+    looked up from the endpoint the router stored in the scope, so ids never
+    become label values; anything unrouted is counted as ``unmatched``.
+    """
+
+    def __init__(self, app, routes: Callable[[], list] | None = None):
+        self.app = app
+        self._routes = routes
+        self._templates: dict | None = None
+
+    def _template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self._templates is None:
+            templates = {}
+            for route in self._routes() if self._routes else []:
+                target = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                if target is not None:
+                    templates.setdefault(target, route.path if hasattr(route, "endpoint") else route.path + "/{path}")
+            self._templates = templates
+        return self._templates.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        times = [0.0, 0.0]
+        token = _request_times.set(times)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_times.reset(token)
+            labels = (scope["method"], self._template(scope))
+            http_latency.observe(time.perf_counter() - start, labels)
+            http_requests.inc((*labels, str(status)))
+            if times[0]:
+                http_db_time.inc(labels, times[0])
+            if times[1]:
+                http_groq_time.inc(labels, times[1])
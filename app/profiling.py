@@ -0,0 +1,294 @@
+import hmac
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+
+# requests carrying this value in X-Profile-Token are profiled, and it unlocks /api/profiles
+PROFILE_TOKEN = os.environ.get("MACHI_PROFILE_TOKEN") or None
+# route templates profiled on every request, e.g. "/api/comments,/api/groq/audio"
+PROFILE_ROUTES = frozenset(r.strip() for r in os.environ.get("MACHI_PROFILE_ROUTES", "").split(",") if r.strip())
+# sampling period; the GIL switch interval (5 ms) bounds it for CPU-bound threads
+PROFILE_INTERVAL_S = float(os.environ.get("MACHI_PROFILE_INTERVAL_MS", "1")) / 1000
+PROFILE_DIR = Path(os.environ.get("MACHI_PROFILE_DIR") or Path(__file__).resolve().parent.parent / "data" / "profiles")
+# newest profiles kept on disk; older files are deleted
+PROFILE_KEEP = int(os.environ.get("MACHI_PROFILE_KEEP", "50"))
+PROFILE_HEADER = "x-profile-token"
+
+PROFILE_ID = re.compile(r"[0-9A-Za-z-]{1,64}")
+
+# innermost frames of a thread that is parked rather than working (event loop select, queue/lock waits)
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+_REPO_ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+
+
+def enabled() -> bool:
+    return bool(PROFILE_TOKEN or PROFILE_ROUTES)
+
+
+def token_ok(value: str | None) -> bool:
+    return bool(PROFILE_TOKEN and value and hmac.compare_digest(value, PROFILE_TOKEN))
+
+
+_labels: dict = {}
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(_REPO_ROOT):
+            path = path[len(_REPO_ROOT):]
+        else:
+            for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+                if path.startswith(prefix + os.sep):
+                    path = path[len(prefix) + 1:]
+                    break
+        label = _labels[code] = f"{code.co_qualname} ({path}:{code.co_firstlineno})"
+    return label
+
+
+class ProfileSession:
+    """Stack samples collected while a request, route call or time window runs.
+
+    Every non-idle thread is sampled, so work a request hands to the
+    threadpool (sync endpoints, audio decoding) is included; so is whatever
+    else the process was doing at the time, kept apart by the thread name
+    at the root of each stack.
+    """
+
+    def __init__(self, kind: str, label: str, interval: float = PROFILE_INTERVAL_S):
+        self.id = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.kind = kind
+        self.label = label
+        self.interval = interval
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self._start = time.perf_counter()
+        self.duration_s = 0.0
+        self.samples: Counter = Counter()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def add(self, key: tuple) -> None:
+        with self._lock:
+            if not self._closed:
+                self.samples[key] += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self.duration_s = time.perf_counter() - self._start
+
+    def folded(self) -> str:
+        """Collapsed stacks (``thread;outer;...;inner count``) for flamegraph.pl / speedscope."""
+        lines = []
+        for (thread, stack), n in sorted(self.samples.items(), key=lambda item: -item[1]):
+            lines.append(";".join([thread, *(_label(code) for code in stack)]) + f" {n}")
+        return "\n".join(lines) + "\n"
+
+    def pstats(self) -> dict:
+        """The samples as a pstats table; call counts are sample counts and times are samples x interval."""
+        stats: dict = {}
+        for (_, stack), n in self.samples.items():
+            seconds = n * self.interval
+            keys = [(code.co_filename, code.co_firstlineno, code.co_qualname) for code in stack]
+            for key in set(keys):
+                cc, nc, tt, ct, callers = stats.get(key) or (0, 0, 0.0, 0.0, {})
+                stats[key] = (cc + n, nc + n, tt, ct + seconds, callers)
+            leaf = keys[-1]
+            cc, nc, tt, ct, callers = stats[leaf]
+            stats[leaf] = (cc, nc, tt + seconds, ct, callers)
+            for caller, callee in set(zip(keys, keys[1:])):
+                callers = stats[callee][4]
+                pnc, pcc, ptt, pct = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (pnc + n, pcc + n, ptt + (seconds if callee == leaf else 0.0), pct + seconds)
+        return stats
+
+    def meta(self) -> dict:
+        return {
+            "profile_id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_s * 1000, 1),
+            "samples": sum(self.samples.values()),
+            "interval_ms": self.interval * 1000,
+        }
+
+
+class Sampler:
+    """One background thread sampling every thread's stack while any session is open.
+
+    Started on first use and parked on a condition between sessions, so a
+    new session gets its first sample immediately.
+    """
+
+    def __init__(self):
+        self._sessions: set[ProfileSession] = set()
+        self._lock = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def start(self, session: ProfileSession) -> ProfileSession:
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+            self._lock.notify()
+        return session
+
+    def stop(self, session: ProfileSession) -> ProfileSession:
+        with self._lock:
+            self._sessions.discard(session)
+        session.close()
+        return session
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._sessions:
+                    self._lock.wait()
+                sessions = list(self._sessions)
+                interval = min(s.interval for s in sessions)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                code = frame.f_code
+                if ident == me or (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                key = (names.get(ident, str(ident)), tuple(reversed(stack)))
+                for session in sessions:
+                    session.add(key)
+            time.sleep(interval)
+
+
+sampler = Sampler()
+
+
+class ProfileStore:
+    """Finished profiles on disk as ``<id>.folded`` and ``<id>.pstats``, newest ``keep`` only."""
+
+    FORMATS = ("folded", "pstats")
+
+    def __init__(self, directory: Path = PROFILE_DIR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        self._index: deque[dict] = deque()
+        self._lock = threading.Lock()
+
+    def path(self, profile_id: str, fmt: str) -> Path:
+        return Path(self.directory) / f"{profile_id}.{fmt}"
+
+    def save(self, session: ProfileSession, **extra) -> dict:
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        self.path(session.id, "folded").write_text(session.folded(), encoding="utf-8")
+        # the layout pstats.Stats.dump_stats writes, so pstats / snakeviz can load it
+        self.path(session.id, "pstats").write_bytes(marshal.dumps(session.pstats()))
+        meta = {**session.meta(), **extra}
+        with self._lock:
+            self._index.appendleft(meta)
+            while len(self._index) > self.keep:
+                old = self._index.pop()
+                for fmt in self.FORMATS:
+                    self.path(old["profile_id"], fmt).unlink(missing_ok=True)
+        return meta
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            return list(self._index)
+
+    def get(self, profile_id: str) -> dict | None:
+        with self._lock:
+            return next((m for m in self._index if m["profile_id"] == profile_id), None)
+
+
+store = ProfileStore()
+
+
+def profile_window(seconds: float) -> ProfileSession:
+    """Sample the whole process for ``seconds``; saved to the store when the window closes."""
+    session = sampler.start(ProfileSession("window", f"{seconds:g}s"))
+
+    def finish():
+        store.save(sampler.stop(session))
+
+    timer = threading.Timer(seconds, finish)
+    timer.daemon = True
+    timer.start()
+    return session
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests.
+
+    A request is profiled when it carries ``X-Profile-Token: <MACHI_PROFILE_TOKEN>``
+    or its route template is listed in ``MACHI_PROFILE_ROUTES``. The response
+    gets an ``X-Profile-Id`` header; the profile is stored once the response
+    has been sent. Other requests only pay for a header lookup (and a route
+    match when routes are configured).
+    """
+
+    def __init__(self, app, routes: Callable[[], list] | None = None):
+        self.app = app
+        self._routes = routes
+
+    def _route(self, scope) -> str | None:
+        for route in self._routes() if self._routes else []:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", None)
+        return None
+
+    def _wanted(self, scope) -> str | None:
+        if scope["path"].startswith("/api/profiles"):
+            return None
+        if PROFILE_TOKEN:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER.encode() and token_ok(value.decode("latin-1")):
+                    return self._route(scope) or "unmatched"
+        if PROFILE_ROUTES:
+            route = self._route(scope)
+            if route in PROFILE_ROUTES:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        route = self._wanted(scope) if scope["type"] == "http" else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+        session = sampler.start(ProfileSession("request", f"{scope['method']} {route}"))
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", session.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop(session)
+            await run_in_threadpool(store.save, session, method=scope["method"], path=scope["path"], status=status)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+
+from app.cache import LRUCache
+from app.db import read_connection
+from app.write_behind import write_behind
+
+REPLY_CACHE_SIZE = int(os.environ.get("GROQ_CACHE_SIZE", "1024"))
+REPLY_CACHE_TTL = float(os.environ.get("GROQ_CACHE_TTL", str(6 * 3600)))
+# keep a copy in SQLite so a warm cache survives restarts
+REPLY_CACHE_PERSIST = os.environ.get("GROQ_CACHE_PERSIST", "1") not in ("0", "false", "no")
+
+# the long-vowel mark ー is spelling, not punctuation (ビル / ビール), so it is kept
+_IGNORED = re.compile(r"[\s　、。，．,.!！?？…〜~\-・「」『』（）()\"']+")
+
+
+def normalise_prompt(text: str) -> str:
+    """Fold trivially different reports onto one key.
+
+    NFKC (full/half width), lower case, katakana -> hiragana, and drop
+    whitespace and punctuation, so "ハナがいっぱい！" and "はな が いっぱい"
+    share a cache entry.
+    """
+    s = unicodedata.normalize("NFKC", text).lower()
+    s = "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+    return _IGNORED.sub("", s)
+
+
+class ReplyCache:
+    """TTL + LRU cache of captain replies with an optional SQLite tier."""
+
+    def __init__(self, size: int = REPLY_CACHE_SIZE, ttl: float = REPLY_CACHE_TTL, persist: bool = REPLY_CACHE_PERSIST):
+        self.memory = LRUCache(maxsize=size, ttl=ttl)
+        self.ttl = ttl
+        self.persist = persist
+        self.persistent_hits = 0
+
+    def key(self, text: str, system_prompt: str, model: str) -> str | None:
+        norm = normalise_prompt(text)
+        if not norm:
+            return None
+        h = hashlib.sha256()
+        for part in (model, system_prompt, norm):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        # blocking when the SQLite tier is consulted; call from a worker thread
+        value = self.memory.get(key)
+        if value is not None or not self.persist:
+            return value
+        with read_connection() as conn:
+            row = conn.execute("SELECT output, expires_at FROM groq_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row["expires_at"] <= time.time():
+            return None
+        self.persistent_hits += 1
+        self.memory.set(key, row["output"], ttl=row["expires_at"] - time.time())
+        return row["output"]
+
+    def set(self, key: str, output: str) -> None:
+        self.memory.set(key, output)
+        if self.persist:
+            write_behind.enqueue(
+                "INSERT OR REPLACE INTO groq_cache (key, output, expires_at) VALUES (?, ?, ?)",
+                (key, output, time.time() + self.ttl),
+            )
+
+    def stats(self) -> dict:
+        return {**self.memory.stats(), "ttl": self.ttl, "persist": self.persist, "persistent_hits": self.persistent_hits}
+
+
+reply_cache = ReplyCache()
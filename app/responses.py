@@ -0,0 +1,35 @@
+import json
+from typing import Any
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional; falls back to the stdlib encoder
+    orjson = None
+
+
+class FastJSONResponse(Response):
+    """JSON response for plain dict/list content that skips jsonable_encoder.
+
+    Uses orjson when installed. Content must already be JSON-native (the
+    dicts built from sqlite3.Row are: str, int, float, None).
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def rows_response(rows, response: Response | None = None) -> FastJSONResponse:
+    """Serialise sqlite3.Row results directly.
+
+    Returning a Response bypasses FastAPI's header merge, so headers set by
+    dependencies on the injected ``response`` (ETag, Cache-Control) are
+    copied over here.
+    """
+    headers = dict(response.headers) if response is not None else None
+    return FastJSONResponse([dict(r) for r in rows], headers=headers)
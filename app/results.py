@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from app import course_cache
+from app.cache import LRUCache, SingleFlight
+from app.classrooms import DEFAULT_CLASSROOM, PerClassroom
+from app.dashboard import _to_ms
+from app.events import status_hubs
+from app.db import read_connection, write_connection
+from app.routers.courses import load_geometry
+from app.scoring import VISIT_RADIUS_M, CourseIndex, score_walk
+from app.write_behind import write_behind
+
+# entering either status freezes the lesson and triggers scoring
+RESULT_STATUSES = ("終了", "結果")
+# scores for a lesson still running are reused for this long (seconds)
+RESULTS_PROVISIONAL_TTL = float(os.environ.get("MACHI_RESULTS_PROVISIONAL_TTL", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class ResultEngine:
+    """Route-completion results for a classroom's current lesson, computed once.
+
+    A lesson is the class course together with the time it was set; only
+    track points and comments from after that time count. Results are
+    computed in a background thread when the status enters 終了/結果,
+    kept in memory and in course_results, and concurrent requests for a
+    lesson that has not been scored yet share one computation. Asked for
+    while the lesson is still running, the scores are marked provisional
+    and only reused for RESULTS_PROVISIONAL_TTL seconds.
+    """
+
+    def __init__(self, classroom: str = DEFAULT_CLASSROOM):
+        self.classroom = classroom
+        self.cache = LRUCache(maxsize=8)
+        self.provisional = LRUCache(maxsize=8, ttl=RESULTS_PROVISIONAL_TTL)
+        self.flights = SingleFlight()
+        self.computations = 0
+        self._previous_status: str | None = None
+        self._status_lock = threading.Lock()
+        self.worker: threading.Thread | None = None
+
+    def _lesson(self) -> tuple[str, str] | None:
+        with read_connection() as conn:
+            pointer = course_cache.get_class_course(conn, self.classroom)
+        if pointer is None:
+            return None
+        return pointer["course_id"], pointer["set_at"] or ""
+
+    def results(self) -> dict | None:
+        lesson = self._lesson()
+        if lesson is None:
+            return None
+        cached = self.cache.get(lesson)
+        if cached is not None:
+            return cached
+        if not _lesson_ended(self.classroom):
+            cached = self.provisional.get(lesson)
+            if cached is not None:
+                return cached
+            return self.flights.do(("provisional", lesson), lambda: self._compute(lesson, final=False))
+        return self.flights.do(lesson, lambda: self._load_or_compute(lesson))
+
+    def refresh(self) -> dict | None:
+        lesson = self._lesson()
+        if lesson is None:
+            return None
+        return self.flights.do(lesson, lambda: self._compute(lesson))
+
+    def on_status(self, status: str) -> None:
+        with self._status_lock:
+            previous, self._previous_status = self._previous_status, status
+        if status in RESULT_STATUSES and previous not in RESULT_STATUSES:
+            self.worker = threading.Thread(target=self._refresh_quietly, name="results", daemon=True)
+            self.worker.start()
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as exc:
+            logger.exception("scoring failed: %s", exc)
+
+    def _load_or_compute(self, lesson: tuple[str, str]) -> dict:
+        with read_connection() as conn:
+            row = conn.execute(
+                "SELECT payload FROM course_results WHERE classroom_id = ? AND course_id = ? AND set_at = ?",
+                (self.classroom, *lesson),
+            ).fetchone()
+        if row is not None:
+            payload = json.loads(row["payload"])
+            self.cache.set(lesson, payload)
+            return payload
+        return self._compute(lesson)
+
+    def _compute(self, lesson: tuple[str, str], final: bool = True) -> dict:
+        course_id, set_at = lesson
+        # fixes and status rows may still be buffered
+        write_behind.flush()
+        since_ms = _to_ms(set_at) or 0
+        with read_connection() as conn:
+            geometry = load_geometry(conn, course_id)
+            tracks: dict[str, tuple[list[float], list[float], list[int]]] = {}
+            for row in conn.execute(
+                "SELECT student_id, ts, lat_e7, lon_e7 FROM track_points WHERE classroom_id = ? AND ts >= ? ORDER BY student_id, ts",
+                (self.classroom, since_ms),
+            ):
+                lats, lons, times = tracks.setdefault(row["student_id"], ([], [], []))
+                lats.append(row["lat_e7"] / 1e7)
+                lons.append(row["lon_e7"] / 1e7)
+                times.append(row["ts"])
+            comments: dict[str, list[tuple[float, float] | None]] = {}
+            for row in conn.execute(
+                "SELECT student_id, lat, lon FROM comments WHERE classroom_id = ? AND created_at >= ? AND student_id IS NOT NULL",
+                (self.classroom, set_at),
+            ):
+                point = (row["lat"], row["lon"]) if row["lat"] is not None and row["lon"] is not None else None
+                comments.setdefault(row["student_id"], []).append(point)
+            student_ids = sorted(set(tracks) | set(comments))
+            names = {}
+            if student_ids:
+                placeholders = ", ".join("?" * len(student_ids))
+                names = {
+                    r["student_id"]: r["name"]
+                    for r in conn.execute(f"SELECT student_id, name FROM students WHERE student_id IN ({placeholders})", student_ids)
+                }
+
+        course = CourseIndex(geometry.lats, geometry.lons)
+        students = []
+        for sid in student_ids:
+            lats, lons, times = tracks.get(sid, ([], [], []))
+            said = comments.get(sid, [])
+            score = score_walk(geometry.lats, geometry.lons, lats, lons, [p for p in said if p is not None], course=course)
+            students.append({
+                "student_id": sid,
+                "name": names.get(sid),
+                "comment_count": len(said),
+                "track_points": len(times),
+                "duration_s": round((times[-1] - times[0]) / 1000) if times else 0,
+                **score,
+            })
+        students.sort(key=lambda s: (-s["coverage_pct"], s["name"] or ""))
+        payload = {
+            "classroom_id": self.classroom,
+            "course_id": course_id,
+            "set_at": set_at,
+            "computed_at": datetime.utcnow().isoformat() + "Z",
+            "final": final,
+            "radius_m": VISIT_RADIUS_M,
+            "course": geometry.summary(),
+            "students": students,
+        }
+        if not final:
+            self.provisional.set(lesson, payload)
+            return payload
+        with write_connection() as conn:
+            conn.execute(
+                "REPLACE INTO course_results (classroom_id, course_id, set_at, computed_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (self.classroom, course_id, set_at, payload["computed_at"], json.dumps(payload, ensure_ascii=False)),
+            )
+            conn.commit()
+        self.cache.set(lesson, payload)
+        self.computations += 1
+        return payload
+
+
+def _lesson_ended(classroom: str) -> bool:
+    latest = status_hubs(classroom).latest
+    if latest is None:
+        with read_connection() as conn:
+            row = conn.execute(
+                "SELECT status FROM statuses WHERE classroom_id = ? ORDER BY id DESC LIMIT 1", (classroom,)
+            ).fetchone()
+        latest = {"status": row["status"]} if row else {}
+    return latest.get("status") in RESULT_STATUSES
+
+
+engines: PerClassroom[ResultEngine] = PerClassroom(ResultEngine)
+engine = engines(DEFAULT_CLASSROOM)
+
+
+def student_result(payload: dict, student_id: str) -> dict:
+    for entry in payload["students"]:
+        if entry["student_id"] == student_id:
+            return entry
+    raise HTTPException(status_code=404, detail="no result for this student")
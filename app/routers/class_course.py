@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException
 from datetime import datetime
 from pydantic import BaseModel
-from app.db import get_connection
+from app import course_cache
+from app.classrooms import classroom_id
+from app.conditional import conditional
+from app.dashboard import dashboards
+from app.db import iter_conn, iter_write_conn
+from app.routers.courses import load_geometry
 
 router = APIRouter()
 
@@ -10,38 +16,50 @@ class CourseSetRequest(BaseModel):
     course_id: str
 
 
-@router.post("/class_course/set")
-def set_class_course_json(payload: CourseSetRequest):
-    course_id = payload.course_id
+def set_class_course(conn: sqlite3.Connection, classroom: str, course_id: str) -> dict:
+    """Point a classroom at a course (writer connection); returns the new pointer."""
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    # ensure row exists with id=1
-    cur.execute("INSERT OR REPLACE INTO class_course (id, course_id, set_at) VALUES (1, ?, ?)", (course_id, now))
+    # one row per classroom
+    conn.execute("INSERT OR REPLACE INTO class_course (classroom_id, course_id, set_at) VALUES (?, ?, ?)", (classroom, course_id, now))
     conn.commit()
-    conn.close()
+    course_cache.invalidate_class_course(classroom)
+    dashboards(classroom).on_course(conn, course_id, now)
     return {"course_id": course_id, "set_at": now}
 
 
+@router.post("/class_course/set")
+def set_class_course_json(payload: CourseSetRequest, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
+    return set_class_course(conn, classroom, payload.course_id)
+
+
 @router.post("/class_course/{course_id}")
-def set_class_course_path(course_id: str):
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    # ensure row exists with id=1
-    cur.execute("INSERT OR REPLACE INTO class_course (id, course_id, set_at) VALUES (1, ?, ?)", (course_id, now))
-    conn.commit()
-    conn.close()
-    return {"course_id": course_id, "set_at": now}
+def set_class_course_path(course_id: str, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
+    return set_class_course(conn, classroom, course_id)
+
+
+@router.get("/class_course", dependencies=[Depends(conditional("class_course"))])
+def get_class_course(conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
+    pointer = course_cache.get_class_course(conn, classroom)
+    if pointer is None:
+        raise HTTPException(status_code=404, detail="no class course set")
+    return pointer
 
 
-@router.get("/class_course")
-def get_class_course():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT course_id, set_at FROM class_course WHERE id = 1")
-    row = cur.fetchone()
-    conn.close()
-    if not row or not row["course_id"]:
+@router.get("/class_course/full", dependencies=[Depends(conditional("class_course", "courses"))])
+def get_class_course_full(conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
+    """Pointer plus course in one round trip (what every student loads on entering the map)."""
+    pointer = course_cache.get_class_course(conn, classroom)
+    if pointer is None:
         raise HTTPException(status_code=404, detail="no class course set")
-    return {"course_id": row["course_id"], "set_at": row["set_at"]}
+    course = course_cache.get_course(conn, pointer["course_id"])
+    if course is None:
+        raise HTTPException(status_code=404, detail="course not found")
+    out = {**pointer, "course": course}
+    try:
+        geometry = load_geometry(conn, pointer["course_id"])
+    except HTTPException:
+        # unparseable GPX: the raw course is still returned
+        geometry = None
+    if geometry is not None:
+        out["geometry"] = {**geometry.summary(), "precision": 5, "polyline": geometry.polyline()}
+    return out
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from datetime import datetime
-from app.db import get_connection, init_db
+from app.db import iter_conn, iter_write_conn
 
 router = APIRouter()
 
@@ -20,19 +21,16 @@ class CommentOut(BaseModel):
 
 
 @router.get("/comments")
-def list_comments():
-    conn = get_connection()
+def list_comments(conn: sqlite3.Connection = Depends(iter_conn)):
     cur = conn.cursor()
     cur.execute("SELECT id, author, text, created_at FROM comments ORDER BY id DESC LIMIT 100")
     rows = cur.fetchall()
-    conn.close()
     return [dict(row) for row in rows]
 
 
 @router.post("/comments", response_model=CommentOut)
-def create_comment(payload: CommentIn):
+def create_comment(payload: CommentIn, conn: sqlite3.Connection = Depends(iter_write_conn)):
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         "INSERT INTO comments (author, text, created_at) VALUES (?, ?, ?)",
@@ -40,5 +38,4 @@ def create_comment(payload: CommentIn):
     )
     conn.commit()
     new_id = cur.lastrowid
-    conn.close()
     return {"id": new_id, "author": payload.author, "text": payload.text, "created_at": now}
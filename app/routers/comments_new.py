@@ -1,34 +1,20 @@
-from fastapi import APIRouter, HTTPException
+import math
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
-from app.db import get_connection
+from app.classrooms import DEFAULT_CLASSROOM, classroom_id
+from app.conditional import conditional
+from app.dashboard import dashboards
+from app.db import iter_conn, iter_write_conn
+from app.geo import bbox_around, haversine_m, parse_bbox
+from app.responses import rows_response
+from app.text import TEXT_NORM_VERSION, normalise_text
 
 router = APIRouter()
 
 
-def fix_mojibake(s: str) -> str:
-    """Attempt to repair common mojibake where UTF-8 bytes were
-    interpreted as single-byte chars (latin1/cp1252). If repair yields
-    plausible CJK characters, return repaired string; otherwise return
-    original."""
-    if not s or not isinstance(s, str):
-        return s
-    # quick heuristic: if string looks ok (contains Japanese), skip
-    import re
-    if re.search(r'[\u3040-\u30ff\u4e00-\u9fff]', s):
-        return s
-    try:
-        # re-encode as latin1 bytes, then decode as utf-8
-        b = s.encode('latin1', errors='replace')
-        decoded = b.decode('utf-8', errors='replace')
-        if re.search(r'[\u3040-\u30ff\u4e00-\u9fff]', decoded):
-            return decoded
-    except Exception:
-        pass
-    return s
-
-
 class CommentIn(BaseModel):
     user_id: str
     text: str
@@ -51,63 +37,172 @@ class CommentOut(BaseModel):
     lon: float | None = None
 
 
-@router.post("/comments", response_model=CommentOut)
-def create_comment(payload: CommentIn):
+def insert_comment(conn: sqlite3.Connection, payload: CommentIn, now: str, classroom: str = DEFAULT_CLASSROOM) -> tuple[str, str]:
+    """Insert a comment without committing; returns (comment_id, stored text)."""
     cid = str(uuid4())
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    # try to repair mojibake in incoming text before storing
-    safe_text = fix_mojibake(payload.text)
-    cur.execute(
-        "INSERT INTO comments (comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (cid, payload.user_id, safe_text, payload.reply_to, payload.genre, payload.student_id, now, payload.lat, payload.lon),
+    # repair/normalise once here so readers can serve the stored text as is
+    safe_text = normalise_text(payload.text)
+    conn.execute(
+        "INSERT INTO comments (comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon, text_norm_version, classroom_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (cid, payload.user_id, safe_text, payload.reply_to, payload.genre, payload.student_id, now, payload.lat, payload.lon, TEXT_NORM_VERSION, classroom),
     )
+    return cid, safe_text
+
+
+@router.post("/comments", response_model=CommentOut)
+def create_comment(payload: CommentIn, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
+    now = datetime.utcnow().isoformat() + "Z"
+    cid, safe_text = insert_comment(conn, payload, now, classroom)
     conn.commit()
+    cur = conn.cursor()
     # fetch the inserted row to return canonical stored values
     cur.execute("SELECT comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon FROM comments WHERE comment_id = ?", (cid,))
     row = cur.fetchone()
-    conn.close()
+    if row:
+        dashboards(classroom).on_comment(dict(row))
     return dict(row) if row else {"comment_id": cid, "user_id": payload.user_id, "text": safe_text, "reply_to": payload.reply_to, "genre": payload.genre, "student_id": payload.student_id, "created_at": now, "lat": payload.lat, "lon": payload.lon}
 
 
-@router.get("/comments")
-def list_comments():
-    conn = get_connection()
+@router.get("/comments", dependencies=[Depends(conditional("comments"))])
+def list_comments(response: Response, conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
     cur = conn.cursor()
-    cur.execute("SELECT comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon FROM comments ORDER BY created_at DESC LIMIT 500")
-    rows = cur.fetchall()
-    conn.close()
+    cur.execute(
+        "SELECT comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon FROM comments WHERE classroom_id = ? ORDER BY created_at DESC LIMIT 500",
+        (classroom,),
+    )
+    return rows_response(cur.fetchall(), response)
+
+
+FEED_MAX_LIMIT = 500
+
+
+@router.get("/comments/feed", dependencies=[Depends(conditional("comments"))])
+def comments_feed(
+    since: str | None = None,
+    limit: int = Query(100, ge=1, le=FEED_MAX_LIMIT),
+    conn: sqlite3.Connection = Depends(iter_conn),
+    classroom: str = Depends(classroom_id),
+):
+    """Incremental comment feed of one classroom.
+
+    ``since`` is the ``next_cursor`` of a previous call (a comment seq) or
+    an ISO created_at timestamp. Without it the latest ``limit`` comments are
+    returned. Items are in insertion order; ``has_more`` means another call
+    with the returned cursor will yield more rows.
+    """
+    cols = "seq, comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon"
+    cur = conn.cursor()
+    if since is None or since == "":
+        cur.execute(f"SELECT {cols} FROM comments WHERE classroom_id = ? ORDER BY seq DESC LIMIT ?", (classroom, limit))
+        rows = cur.fetchall()[::-1]
+        has_more = False
+    else:
+        if since.isdigit():
+            cur.execute(
+                f"SELECT {cols} FROM comments WHERE classroom_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (classroom, int(since), limit + 1),
+            )
+        else:
+            cur.execute(
+                f"SELECT {cols} FROM comments WHERE classroom_id = ? AND created_at > ? ORDER BY created_at, seq LIMIT ?",
+                (classroom, since, limit + 1),
+            )
+        rows = cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    items = [dict(r) for r in rows]
+    if items:
+        next_cursor = str(max(d["seq"] for d in items))
+    elif since is not None and since.isdigit():
+        next_cursor = since
+    else:
+        # empty result: hand back the current high-water mark so the client can switch to seq cursors
+        row = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM comments WHERE classroom_id = ?", (classroom,)).fetchone()
+        next_cursor = str(row[0])
+    return {"comments": items, "next_cursor": next_cursor, "has_more": has_more}
+
+
+# The R*Tree must drive this query: CROSS JOIN fixes the loop order, otherwise SQLite prefers
+# the classroom index and probes the R*Tree once per comment of the classroom. The R*Tree stores
+# float32 boxes, so the exact coordinates are re-checked on the row.
+_NEAR_SELECT = """
+    SELECT c.comment_id, c.user_id, c.text, c.reply_to, c.genre, c.student_id, c.created_at, c.lat, c.lon
+    FROM comments_rtree r CROSS JOIN comments c ON c.seq = r.id
+    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+      AND c.lat BETWEEN ? AND ? AND c.lon BETWEEN ? AND ?
+      AND c.classroom_id = ?
+"""
+# viewport: newest first
+NEAR_SQL = _NEAR_SELECT + "ORDER BY c.created_at DESC LIMIT ?"
+# radius: nearest first by squared equirectangular distance (lat, lat, lon, lon, cos^2 lat), so the
+# LIMIT keeps the nearest hits of the whole box rather than the newest ones
+NEAR_RADIUS_SQL = _NEAR_SELECT + "ORDER BY (c.lat - ?) * (c.lat - ?) + (c.lon - ?) * (c.lon - ?) * ? LIMIT ?"
+
+
+@router.get("/comments/near", dependencies=[Depends(conditional("comments"))])
+def comments_near(
+    lat: float | None = Query(None, ge=-90, le=90),
+    lon: float | None = Query(None, ge=-180, le=180),
+    radius_m: float = Query(500, gt=0, le=50000),
+    bbox: str | None = None,
+    limit: int = Query(200, ge=1, le=FEED_MAX_LIMIT),
+    conn: sqlite3.Connection = Depends(iter_conn),
+    classroom: str = Depends(classroom_id),
+):
+    """Geotagged comments inside a viewport (``bbox=west,south,east,north``)
+    or within ``radius_m`` of ``lat``/``lon``, via the comments_rtree index."""
+    if bbox:
+        try:
+            min_lat, min_lon, max_lat, max_lon = parse_bbox(bbox)
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+    elif lat is not None and lon is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox_around(lat, lon, radius_m)
+    else:
+        raise HTTPException(status_code=422, detail="bbox or lat/lon required")
+
+    box = (min_lat, max_lat, min_lon, max_lon, min_lat, max_lat, min_lon, max_lon, classroom)
+    cur = conn.cursor()
+    if bbox:
+        cur.execute(NEAR_SQL, (*box, limit))
+    else:
+        # the approximate order can differ from haversine at the tail; fetch a margin, then trim exactly
+        coslat2 = math.cos(math.radians(lat)) ** 2
+        cur.execute(NEAR_RADIUS_SQL, (*box, lat, lat, lon, lon, coslat2, limit * 2))
     out = []
-    for r in rows:
+    for r in cur.fetchall():
         d = dict(r)
-        d["text"] = fix_mojibake(d.get("text"))
-        # lat/lon will be present from SELECT
+        if not bbox:
+            d["distance_m"] = round(haversine_m(lat, lon, d["lat"], d["lon"]), 1)
+            if d["distance_m"] > radius_m:
+                continue
         out.append(d)
-    return out
+    if not bbox:
+        out.sort(key=lambda d: d["distance_m"])
+    return out[:limit]
 
 
 @router.post("/comments_v2/")
-def create_comment_v2(payload: CommentIn):
-    return create_comment(payload)
+def create_comment_v2(payload: CommentIn, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
+    return create_comment(payload, conn, classroom)
 
 
-@router.get("/comments_v2/{comment_id}")
-def get_comment_v2(comment_id: str):
-    conn = get_connection()
+@router.get("/comments_v2/{comment_id}", dependencies=[Depends(conditional("comments"))])
+def get_comment_v2(comment_id: str, conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
     cur = conn.cursor()
-    cur.execute("SELECT comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon FROM comments WHERE comment_id = ?", (comment_id,))
+    cur.execute(
+        "SELECT comment_id, user_id, text, reply_to, genre, student_id, created_at, lat, lon FROM comments WHERE comment_id = ? AND classroom_id = ?",
+        (comment_id, classroom),
+    )
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="comment not found")
     return dict(row)
 
 
-@router.get("/comments/with_students")
-def list_comments_with_students():
+@router.get("/comments/with_students", dependencies=[Depends(conditional("comments", "students"))])
+def list_comments_with_students(response: Response, conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
     """List comments with student names joined"""
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute("""
         SELECT 
@@ -123,17 +218,8 @@ def list_comments_with_students():
             s.name as student_name
         FROM comments c
         LEFT JOIN students s ON c.student_id = s.student_id
+        WHERE c.classroom_id = ?
         ORDER BY c.created_at DESC 
         LIMIT 500
-    """)
-    rows = cur.fetchall()
-    conn.close()
-    out = []
-    for r in rows:
-        d = dict(r)
-        d["text"] = fix_mojibake(d.get("text"))
-        # also try to fix student_name if present
-        if "student_name" in d and d["student_name"]:
-            d["student_name"] = fix_mojibake(d["student_name"]) or d["student_name"]
-        out.append(d)
-    return out
+    """, (classroom,))
+    return rows_response(cur.fetchall(), response)
@@ -1,7 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from datetime import datetime
-from app.db import get_connection
+from app import course_cache
+from app.classrooms import classroom_id
+from app.conditional import conditional
+from app.db import iter_conn, iter_write_conn
+from app.events import status_hubs
+from app.routers.class_course import set_class_course
+from app.routers.status import latest_status, publish_status, status_stream_response
 
 router = APIRouter()
 
@@ -15,47 +21,30 @@ class StatusIn(BaseModel):
 
 
 @router.post("/control/course_of_day")
-def set_course_of_day(payload: CourseOfDayIn):
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO class_course (id, course_id, set_at) VALUES (1, ?, ?)", (payload.course_id, now))
-    conn.commit()
-    conn.close()
-    return {"course_of_day": payload.course_id, "set_at": now}
-
-
-@router.get("/control/course_of_day")
-def get_course_of_day():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT course_id FROM class_course WHERE id = 1")
-    row = cur.fetchone()
-    conn.close()
-    if not row or not row["course_id"]:
+def set_course_of_day(payload: CourseOfDayIn, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
+    pointer = set_class_course(conn, classroom, payload.course_id)
+    return {"course_of_day": payload.course_id, "set_at": pointer["set_at"]}
+
+
+@router.get("/control/course_of_day", dependencies=[Depends(conditional("class_course"))])
+def get_course_of_day(conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
+    pointer = course_cache.get_class_course(conn, classroom)
+    if pointer is None:
         raise HTTPException(status_code=404, detail="no course of day set")
-    return {"course_of_day": row["course_id"]}
+    return {"course_of_day": pointer["course_id"]}
 
 
 @router.post("/control/status")
-def set_status(payload: StatusIn):
+def set_status(payload: StatusIn, classroom: str = Depends(classroom_id)):
     # delegate to statuses table (no validation here)
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO statuses (status, created_at) VALUES (?, ?)", (payload.status, now))
-    conn.commit()
-    conn.close()
-    return {"status": payload.status, "created_at": now}
-
-
-@router.get("/control/status")
-def get_status():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT status, created_at FROM statuses ORDER BY id DESC LIMIT 1")
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        raise HTTPException(status_code=404, detail="no status set")
-    return {"status": row["status"], "created_at": row["created_at"]}
+    return publish_status(classroom, payload.status)
+
+
+@router.get("/control/status", dependencies=[Depends(conditional("statuses", hub=status_hubs))])
+def get_status(conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
+    return latest_status(conn, classroom)
+
+
+@router.get("/control/status/stream")
+async def stream_status(classroom: str = Depends(classroom_id)):
+    return await status_stream_response(classroom)
@@ -1,7 +1,18 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Body, Request
+import os
+import sqlite3
+import tempfile
+from array import array
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from datetime import datetime
-from app.db import get_connection
+from app import course_cache
+from app.cache import LRUCache
+from app.conditional import conditional, etag_matches
+from app.responses import rows_response
+from app.db import iter_conn, iter_write_conn, write_connection
+from app.gpx import CourseGeometry, GPXError, GPXLimitError, GPXStreamParser, parse_gpx
 import uuid
 
 
@@ -11,16 +22,157 @@ class CourseBody(BaseModel):
 
 router = APIRouter()
 
+# upload limits: raw GPX size and number of track points
+GPX_MAX_BYTES = int(os.environ.get("GPX_MAX_BYTES", str(10 * 1024 * 1024)))
+GPX_MAX_POINTS = int(os.environ.get("GPX_MAX_POINTS", "200000"))
+UPLOAD_CHUNK = 64 * 1024
+# the raw file is kept in memory up to this size, then spooled to disk
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+
+# parsed geometry keyed by course_id; invalidated by create/delete
+geometry_cache = LRUCache(maxsize=32)
+
+GEOMETRY_COLUMNS = ("point_count", "distance_m", "min_lat", "min_lon", "max_lat", "max_lon", "coords", "ele", "times", "etag")
+
 
 class CourseIn(BaseModel):
     course_id: str | None = None
 
 
+def save_geometry(conn: sqlite3.Connection, course_id: str, geometry: CourseGeometry) -> None:
+    row = geometry.to_row()
+    conn.execute(
+        f"REPLACE INTO course_geometry (course_id, {', '.join(GEOMETRY_COLUMNS)}) VALUES (?{', ?' * len(GEOMETRY_COLUMNS)})",
+        (course_id, *(row[c] for c in GEOMETRY_COLUMNS)),
+    )
+    conn.execute("DELETE FROM course_lod WHERE course_id = ?", (course_id,))
+    conn.executemany(
+        "INSERT INTO course_lod (course_id, tolerance_m, indices) VALUES (?, ?, ?)",
+        [(course_id, tol, idx.tobytes()) for tol, idx in geometry.lods.items()],
+    )
+
+
+def _load_lods(cur: sqlite3.Cursor, course_id: str, geometry: CourseGeometry) -> bool:
+    cur.execute("SELECT tolerance_m, indices FROM course_lod WHERE course_id = ?", (course_id,))
+    for row in cur.fetchall():
+        idx = array("I")
+        idx.frombytes(row["indices"])
+        geometry.lods[row["tolerance_m"]] = idx
+    return bool(geometry.lods)
+
+
+def load_geometry(conn: sqlite3.Connection, course_id: str) -> CourseGeometry:
+    # blocking (may parse the raw GPX): only call it from sync endpoints or worker threads
+    geometry = geometry_cache.get(course_id)
+    if geometry is not None:
+        return geometry
+    # a class opening the map at once triggers one parse, not thirty
+    return course_cache.flights.do(("geometry", course_id), lambda: _load_geometry(conn, course_id))
+
+
+def _load_geometry(conn: sqlite3.Connection, course_id: str) -> CourseGeometry:
+    cur = conn.cursor()
+    cur.execute(f"SELECT {', '.join(GEOMETRY_COLUMNS)} FROM course_geometry WHERE course_id = ?", (course_id,))
+    row = cur.fetchone()
+    if row:
+        geometry = CourseGeometry.from_row(row)
+        if not _load_lods(cur, course_id, geometry):
+            # stored before levels of detail existed
+            geometry.build_lods()
+            with write_connection() as wconn:
+                save_geometry(wconn, course_id, geometry)
+                wconn.commit()
+    else:
+        # courses uploaded before geometry was stored: parse once and persist
+        cur.execute("SELECT gpx_content FROM courses WHERE course_id = ?", (course_id,))
+        raw = cur.fetchone()
+        if not raw:
+            raise HTTPException(status_code=404, detail="course not found")
+        try:
+            geometry = parse_gpx(raw["gpx_content"])
+        except GPXError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        geometry.build_lods()
+        with write_connection() as wconn:
+            save_geometry(wconn, course_id, geometry)
+            wconn.commit()
+    geometry_cache.set(course_id, geometry)
+    return geometry
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail=f"GPX larger than {GPX_MAX_BYTES} bytes")
+
+
+def _check_content_length(request: Request) -> None:
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > GPX_MAX_BYTES:
+        raise _too_large()
+
+
+class _GPXUpload:
+    """Feeds an upload through GPXStreamParser while spooling the raw bytes."""
+
+    def __init__(self):
+        self.parser = GPXStreamParser(max_points=GPX_MAX_POINTS)
+        self.raw = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+    def feed(self, chunk: bytes) -> None:
+        if self.parser.bytes_fed + len(chunk) > GPX_MAX_BYTES:
+            raise _too_large()
+        try:
+            self.parser.feed(chunk)
+        except GPXLimitError as exc:
+            raise HTTPException(status_code=413, detail=str(exc))
+        except GPXError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        self.raw.write(chunk)
+
+    def finish(self) -> tuple[str, CourseGeometry]:
+        # the raw file is stored as one TEXT value, so it is read back whole here:
+        # peak memory per upload is bounded by GPX_MAX_BYTES, not by the chunk size
+        try:
+            geometry = self.parser.close()
+        except GPXError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        self.raw.seek(0)
+        try:
+            text = self.raw.read().decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=422, detail="GPX must be UTF-8 encoded")
+        finally:
+            self.raw.close()
+        return text, geometry
+
+
+def _parse_text(text: str) -> CourseGeometry:
+    try:
+        return parse_gpx(text, max_points=GPX_MAX_POINTS)
+    except GPXLimitError as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except GPXError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+
+def _store_course(cid: str, text: str, geometry: CourseGeometry) -> dict:
+    # levels of detail are built here, in the worker thread, not on the event loop
+    geometry.build_lods()
+    now = datetime.utcnow().isoformat() + "Z"
+    with write_connection() as conn:
+        conn.execute("REPLACE INTO courses (course_id, gpx_content, created_at) VALUES (?, ?, ?)", (cid, text, now))
+        save_geometry(conn, cid, geometry)
+        conn.commit()
+    geometry_cache.pop(cid)
+    course_cache.invalidate_course(cid)
+    return {"course_id": cid, "created_at": now, **geometry.summary()}
+
+
 @router.post("/courses")
 async def create_course(request: Request, file: UploadFile = File(None), course_id: str | None = None):
     """
     Create or replace a course. Accepts either JSON body {id, content} or multipart upload (file).
     """
+    _check_content_length(request)
     # Try to read JSON body first
     json_body = None
     try:
@@ -31,49 +183,117 @@ async def create_course(request: Request, file: UploadFile = File(None), course_
     if json_body and isinstance(json_body, dict) and json_body.get("content"):
         cid = json_body.get("id") or course_id or str(uuid.uuid4())
         text = json_body.get("content")
+        if not isinstance(text, str) or not isinstance(cid, str):
+            raise HTTPException(status_code=422, detail="id and content must be strings")
+        if len(text.encode("utf-8")) > GPX_MAX_BYTES:
+            raise _too_large()
+        geometry = await run_in_threadpool(_parse_text, text)
     elif file is not None:
-        content = await file.read()
-        text = content.decode("utf-8")
+        upload = _GPXUpload()
+        while chunk := await file.read(UPLOAD_CHUNK):
+            upload.feed(chunk)
+        text, geometry = upload.finish()
         cid = course_id or str(uuid.uuid4())
     else:
         raise HTTPException(status_code=422, detail="no course content provided")
 
-    now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("REPLACE INTO courses (course_id, gpx_content, created_at) VALUES (?, ?, ?)", (cid, text, now))
-    conn.commit()
-    conn.close()
-    return {"course_id": cid, "created_at": now}
+    # geometry is stored with the raw file so readers never have to touch the XML again
+    return await run_in_threadpool(_store_course, cid, text, geometry)
+
+
+@router.post("/courses/upload")
+async def upload_course(request: Request, course_id: str | None = None):
+    """Streaming upload: the request body is the raw GPX file.
+
+    Chunks are parsed as they arrive, so oversized, malformed or point-heavy
+    files are rejected (413/422) without reading the rest of the body.
+    """
+    _check_content_length(request)
+    upload = _GPXUpload()
+    async for chunk in request.stream():
+        if chunk:
+            upload.feed(chunk)
+    text, geometry = upload.finish()
+    return await run_in_threadpool(_store_course, course_id or str(uuid.uuid4()), text, geometry)
 
 
-@router.get("/courses")
-def list_courses():
-    conn = get_connection()
+@router.get("/courses", dependencies=[Depends(conditional("courses"))])
+def list_courses(response: Response, conn: sqlite3.Connection = Depends(iter_conn)):
     cur = conn.cursor()
     cur.execute("SELECT course_id, created_at FROM courses ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    return rows_response(cur.fetchall(), response)
 
 
-@router.get("/courses/{course_id}")
-def get_course(course_id: str):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT course_id, gpx_content, created_at FROM courses WHERE course_id = ?", (course_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
+@router.get("/courses/{course_id}", dependencies=[Depends(conditional("courses"))])
+def get_course(course_id: str, conn: sqlite3.Connection = Depends(iter_conn)):
+    course = course_cache.get_course(conn, course_id)
+    if course is None:
         raise HTTPException(status_code=404, detail="course not found")
-    return {"course_id": row["course_id"], "gpx": row["gpx_content"], "created_at": row["created_at"]}
+    return course
+
+
+@router.get("/courses/{course_id}/compact")
+def get_course_compact(course_id: str, request: Request, format: str = "polyline", elevation: bool = False, conn: sqlite3.Connection = Depends(iter_conn)):
+    """Pre-parsed course geometry.
+
+    ``format=polyline`` returns JSON with a Google encoded polyline (1e-5
+    precision); ``format=f32`` returns interleaved little-endian float32
+    lat/lon pairs with the summary in X-Course-* headers.
+    """
+    if format not in ("polyline", "f32"):
+        raise HTTPException(status_code=422, detail="format must be polyline or f32")
+    geometry = load_geometry(conn, course_id)
+    etag = f'"{geometry.etag}-{format}{"-ele" if elevation else ""}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    summary = geometry.summary()
+    if format == "f32":
+        headers["X-Course-Point-Count"] = str(summary["point_count"])
+        headers["X-Course-Distance-M"] = str(summary["distance_m"])
+        headers["X-Course-BBox"] = ",".join(str(v) for v in summary["bbox"])
+        return Response(content=geometry.float32_coords(), media_type="application/octet-stream", headers=headers)
+
+    body = {"course_id": course_id, "format": "polyline", "precision": 5, **summary, "polyline": geometry.polyline()}
+    if elevation:
+        body["elevation"] = geometry.elevations()
+    return JSONResponse(body, headers=headers)
+
+
+@router.get("/courses/{course_id}/geometry")
+def get_course_geometry(course_id: str, request: Request, zoom: int = Query(18, ge=0, le=22), conn: sqlite3.Connection = Depends(iter_conn)):
+    """Course polyline simplified for a Leaflet zoom level.
+
+    Picks the coarsest precomputed Douglas-Peucker level whose tolerance is
+    still under one screen pixel at ``zoom``; high zooms get full detail.
+    """
+    geometry = load_geometry(conn, course_id)
+    tolerance = geometry.tolerance_for_zoom(zoom)
+    etag = f'"{geometry.etag}-lod{tolerance:g}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    polyline, count = geometry.lod_polyline(tolerance)
+    body = {
+        "course_id": course_id,
+        "zoom": zoom,
+        "tolerance_m": tolerance,
+        "point_count": count,
+        "total_point_count": geometry.point_count,
+        "precision": 5,
+        "polyline": polyline,
+    }
+    return JSONResponse(body, headers=headers)
 
 
 @router.delete("/courses/{course_id}")
-def delete_course(course_id: str):
-    conn = get_connection()
+def delete_course(course_id: str, conn: sqlite3.Connection = Depends(iter_write_conn)):
     cur = conn.cursor()
     cur.execute("DELETE FROM courses WHERE course_id = ?", (course_id,))
+    cur.execute("DELETE FROM course_geometry WHERE course_id = ?", (course_id,))
+    cur.execute("DELETE FROM course_lod WHERE course_id = ?", (course_id,))
     conn.commit()
-    conn.close()
+    geometry_cache.pop(course_id)
+    course_cache.invalidate_course(course_id)
     return {"deleted": True}
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from app.classrooms import classroom_id
+from app.conditional import BOOT_ID, etag_matches
+from app.dashboard import DASHBOARD_RECENT, dashboards
+from app.events import SSE_HEADERS, sse_stream
+from app.responses import FastJSONResponse
+
+router = APIRouter()
+
+
+@router.get("/dashboard")
+def get_dashboard(request: Request, recent: int = Query(20, ge=0, le=DASHBOARD_RECENT), classroom: str = Depends(classroom_id)):
+    """Teacher dashboard in one request: status, course summary, per-student
+    comment counts and last-seen times, and the newest ``recent`` comments."""
+    dashboard = dashboards(classroom)
+    dashboard.ensure_loaded()
+    etag = f'"dash.{BOOT_ID}.{classroom}.{dashboard.version}-r{recent}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(dashboard.snapshot(recent), headers=headers)
+
+
+@router.get("/dashboard/stream")
+async def stream_dashboard(recent: int = Query(20, ge=0, le=DASHBOARD_RECENT), classroom: str = Depends(classroom_id)):
+    """Server-Sent Events: a ``snapshot`` first, then deltas (``comment``,
+    ``student``, ``presence``, ``status``, ``course``) as they happen. Every
+    event carries ``version``; deltas at or below the snapshot's are already
+    included in it."""
+    dashboard = dashboards(classroom)
+    await run_in_threadpool(dashboard.ensure_loaded)
+    return StreamingResponse(
+        sse_stream(dashboard.hub, "dashboard", initial=lambda: dashboard.snapshot(recent)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
@@ -1,54 +1,261 @@
-from fastapi import APIRouter, File, UploadFile
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from app.db import get_connection
-from app.groq_client import get_groq_client
+from app import metrics
+from app.audio import preprocess
+from app.classrooms import DEFAULT_CLASSROOM, classroom_id
+from app.dashboard import dashboards
+from app.db import write_connection
+from app.events import SSE_HEADERS, sse_event
+from app.reply_cache import reply_cache
+from app.write_behind import write_behind
+from typing import AsyncIterator
+from app.groq_client import GroqSaturated, get_async_groq_client, limiter, GROQ_TIMEOUT
+from app.routers.comments_new import CommentIn, insert_comment
 import uuid
 import os
 import traceback
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "あなたは「まち探検隊」の 隊長 です。\n小学生の子どもたち（対象は小学3年生程度）が、街を歩きながら新しい発見を “トランシーバー” で報告してきます。\nあなたの役割は、その報告に対して 短く・親しみやすく・探究心をくすぐる返答を行うことです。\n\n## プロジェクトの目的\n\n子どもたちがルートを歩きながら、街の新しい一面を発見する。\n発見を報告することで、**「街＝学びの場」**であることを体験的に理解する。\n\n## 応答のルール\n\n- 児童の報告を必ず肯定する\n    - 「報告ありがとう。いい発見だ！」\n    - 「お、そこに気づくとは鋭いな！」\n\n- 具体的な問い返しにヒントを混ぜて提示する（考えるきっかけを作る）\n    - 「どうしてここに花がたくさん植えられているんだろう？元は何があったのかな？」\n    - 「なぜ新しい道がつくられたのかな？」\n    - 「ほかにも似たものはあるかな？」\n\n- 発見を自然・街の探検、地理、社会的学習に関連づけ、話題についてもっと知りたいという好奇心を煽る。\n    - 「なんのための建物なんだろう？近くの隊員と考えてみるか？」\n    - 「この公園の花は誰が育てているんだろう。町の人に聞いてみよう。」\n\n- **難しい言葉、漢字は避け**、小学3年生が理解できる表現を使う。\n\n- **倫理的に配慮**する。「昆虫がなぜ死んだのか」ではなく、「昆虫が住みづらかった理由を考える」と言い換えるなど\n\n- 返答は2文程度で短く。長い説明はしない。\n\n- **最後に「次の行動につながる一言」**を添える。\n\n- 倫理的によくない言葉が入力された場合、それ以上そのことに言及することは避ける。\n\n## 応答形式\n本文のみを回答。重要部分はアスタリスクで囲い太字に。\n鍵括弧・名前などは不要。口調は男性のキャラクターを想定し、例文に合わせる。"
+CHAT_MODEL = "llama-3.3-70b-versatile"
+TRANSCRIBE_MODEL = "whisper-large-v3-turbo"
+# local VAD / trim / resample before upload (set AUDIO_PREPROCESS=0 to send raw uploads)
+AUDIO_PREPROCESS = os.environ.get("AUDIO_PREPROCESS", "1") not in ("0", "false", "no")
 
 
 class GroqIn(BaseModel):
     text: str
     user_id: str | None = None
+    # skip the reply cache for this request (always ask the model)
+    no_cache: bool = False
 
 
-@router.post("/groq/text")
-def groq_text(payload: GroqIn):
-    client = get_groq_client()
-    now = datetime.utcnow().isoformat() + "Z"
+# groq transcription object may vary; try to extract text robustly
+def extract_text(obj):
+    # direct attribute
+    try:
+        t = getattr(obj, 'text', None)
+        if t and isinstance(t, str) and t.strip():
+            return t.strip()
+    except Exception:
+        pass
+    # dict-like
+    if isinstance(obj, dict):
+        # common shapes: {'text': '...'}
+        if 'text' in obj and isinstance(obj['text'], str) and obj['text'].strip():
+            return obj['text'].strip()
+        # verbose_json style: {'results': [{'alternatives': [{'text': '...'}]}]}
+        if 'results' in obj and isinstance(obj['results'], list):
+            parts = []
+            for r in obj['results']:
+                if isinstance(r, dict):
+                    if 'alternatives' in r and isinstance(r['alternatives'], list):
+                        alt = r['alternatives'][0]
+                        if isinstance(alt, dict):
+                            for k in ('text', 'transcript'):
+                                if k in alt and isinstance(alt[k], str) and alt[k].strip():
+                                    parts.append(alt[k].strip())
+                    # some formats may put 'text' directly in result
+                    if 'text' in r and isinstance(r['text'], str) and r['text'].strip():
+                        parts.append(r['text'].strip())
+            if parts:
+                return ' '.join(parts)
+    # fallback to string
+    try:
+        s = str(obj)
+        if s and s.strip() and s.strip() != '{}':
+            return s.strip()
+    except Exception:
+        pass
+    return None
+
+
+def _messages(text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ]
+
+
+async def _cached_reply(text: str, use_cache: bool) -> tuple[str | None, str | None]:
+    """Return (cache key, cached reply); the key is None when caching is off for this call."""
+    if not use_cache:
+        return None, None
+    key = reply_cache.key(text, SYSTEM_PROMPT, CHAT_MODEL)
+    if key is None:
+        return None, None
+    return key, await run_in_threadpool(reply_cache.get, key)
+
+
+async def complete_text(text: str, use_cache: bool = True) -> str:
+    """Captain reply for a report; falls back to a placeholder on any upstream failure."""
+    client = get_async_groq_client()
     if client is None:
         # fallback dummy
-        output = f"GroqOutput for: {payload.text}"
-    else:
-        # call groq chat completion with a system prompt
-        system_prompt = "あなたは「まち探検隊」の 隊長 です。\n小学生の子どもたち（対象は小学3年生程度）が、街を歩きながら新しい発見を “トランシーバー” で報告してきます。\nあなたの役割は、その報告に対して 短く・親しみやすく・探究心をくすぐる返答を行うことです。\n\n## プロジェクトの目的\n\n子どもたちがルートを歩きながら、街の新しい一面を発見する。\n発見を報告することで、**「街＝学びの場」**であることを体験的に理解する。\n\n## 応答のルール\n\n- 児童の報告を必ず肯定する\n    - 「報告ありがとう。いい発見だ！」\n    - 「お、そこに気づくとは鋭いな！」\n\n- 具体的な問い返しにヒントを混ぜて提示する（考えるきっかけを作る）\n    - 「どうしてここに花がたくさん植えられているんだろう？元は何があったのかな？」\n    - 「なぜ新しい道がつくられたのかな？」\n    - 「ほかにも似たものはあるかな？」\n\n- 発見を自然・街の探検、地理、社会的学習に関連づけ、話題についてもっと知りたいという好奇心を煽る。\n    - 「なんのための建物なんだろう？近くの隊員と考えてみるか？」\n    - 「この公園の花は誰が育てているんだろう。町の人に聞いてみよう。」\n\n- **難しい言葉、漢字は避け**、小学3年生が理解できる表現を使う。\n\n- **倫理的に配慮**する。「昆虫がなぜ死んだのか」ではなく、「昆虫が住みづらかった理由を考える」と言い換えるなど\n\n- 返答は2文程度で短く。長い説明はしない。\n\n- **最後に「次の行動につながる一言」**を添える。\n\n- 倫理的によくない言葉が入力された場合、それ以上そのことに言及することは避ける。\n\n## 応答形式\n本文のみを回答。重要部分はアスタリスクで囲い太字に。\n鍵括弧・名前などは不要。口調は男性のキャラクターを想定し、例文に合わせる。"
+        return f"GroqOutput for: {text}"
+    key, cached = await _cached_reply(text, use_cache)
+    if cached is not None:
+        return cached
+    async with limiter.slot():
         try:
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": payload.text},
-                ],
-                model="llama-3.3-70b-versatile",
-            )
+            async with metrics.groq_call("chat"):
+                chat_completion = await asyncio.wait_for(
+                    client.chat.completions.create(messages=_messages(text), model=CHAT_MODEL),
+                    GROQ_TIMEOUT,
+                )
             output = chat_completion.choices[0].message.content
         except Exception:
-            output = f"GroqError fallback for: {payload.text}"
+            return f"GroqError fallback for: {text}"
+    if key is not None and output:
+        reply_cache.set(key, output)
+    return output
+
+
+async def stream_text(text: str, use_cache: bool = True) -> AsyncIterator[str]:
+    """Captain reply as it is generated (content deltas).
+
+    Raises GroqSaturated before the first delta if no slot is free. Upstream
+    failures before the first token yield the usual fallback text; a failure
+    mid-stream just ends the reply early. A cached reply is yielded whole,
+    and only a stream that finished cleanly is cached.
+    """
+    client = get_async_groq_client()
+    if client is None:
+        yield f"GroqOutput for: {text}"
+        return
+    key, cached = await _cached_reply(text, use_cache)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    async with limiter.slot():
+        try:
+            # timed up to the last chunk, so the figure includes the time spent relaying deltas
+            async with metrics.groq_call("chat_stream"):
+                stream = await asyncio.wait_for(
+                    client.chat.completions.create(messages=_messages(text), model=CHAT_MODEL, stream=True),
+                    GROQ_TIMEOUT,
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), GROQ_TIMEOUT)
+                    except StopAsyncIteration:
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except Exception:
+            if not parts:
+                yield f"GroqError fallback for: {text}"
+            return
+    if key is not None and parts:
+        reply_cache.set(key, "".join(parts))
+
+
+async def transcribe(filename: str, content: bytes) -> str:
+    if AUDIO_PREPROCESS:
+        # decode locally: silent clips never reach Whisper, the rest go up trimmed as 16 kHz mono when that is smaller
+        prepared = await run_in_threadpool(preprocess, content, filename)
+        if prepared.status == "silent":
+            logger.debug("no speech detected in %s (%s ms), skipping transcription", filename, prepared.duration_ms)
+            return ''
+        if prepared.status == "ok":
+            logger.debug(
+                "preprocessed %s: %d -> %d bytes, voiced %s/%s ms",
+                filename, len(content), len(prepared.content), prepared.voiced_ms, prepared.duration_ms,
+            )
+            filename, content = prepared.filename, prepared.content
+    client = get_async_groq_client()
+    if client is None:
+        # Groq が設定されていない場合は明示的なフォールバックを返す
+        return f"(groq not configured - uploaded {len(content)} bytes as {filename})"
+    async with limiter.slot():
+        try:
+            async with metrics.groq_call("transcribe"):
+                transcription = await asyncio.wait_for(
+                    client.audio.transcriptions.create(
+                        file=(filename, content),
+                        model=TRANSCRIBE_MODEL,
+                        language="ja",
+                        response_format="verbose_json",
+                    ),
+                    GROQ_TIMEOUT,
+                )
+        except Exception as exc:
+            # サーバーログに詳細を出力して障害原因追跡を容易にする
+            print(f"groq audio transcription error: {exc!r}")
+            traceback.print_exc()
+            return f"(groq transcription failed - uploaded {filename})"
+    transcript = extract_text(transcription) or ''
+    # if transcript is only punctuation or single dot, treat as empty
+    if transcript.strip() in ('.', ',', '。', '') or len(transcript.strip()) <= 1:
+        print(f"[groq_audio] transcription appears empty or too short: '{transcript}'")
+        transcript = ''
+    return transcript
+
+
+LOG_SQL = "INSERT INTO groq_logs (type, input, output, user_id, created_at, classroom_id) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def _log(kind: str, input_text: str, output: str | None, user_id: str | None, now: str, classroom: str = DEFAULT_CLASSROOM) -> None:
+    # diagnostic only: buffered and committed in batches off the request path
+    write_behind.enqueue(LOG_SQL, (kind, input_text, output, user_id, now, classroom))
+
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO groq_logs (type, input, output, user_id, created_at) VALUES (?, ?, ?, ?, ?)", ("text", payload.text, output, payload.user_id, now))
-    conn.commit()
-    conn.close()
+def _saturated(exc: GroqSaturated) -> HTTPException:
+    return HTTPException(status_code=exc.status_code, detail=exc.detail, headers={"Retry-After": "2"})
+
+
+@router.post("/groq/text")
+async def groq_text(payload: GroqIn, classroom: str = Depends(classroom_id)):
+    now = datetime.utcnow().isoformat() + "Z"
+    try:
+        output = await complete_text(payload.text, use_cache=not payload.no_cache)
+    except GroqSaturated as exc:
+        raise _saturated(exc)
+    _log("text", payload.text, output, payload.user_id, now, classroom)
     return {"output": output}
 
 
+@router.post("/groq/text/stream")
+async def groq_text_stream(payload: GroqIn, classroom: str = Depends(classroom_id)):
+    """Server-Sent Events variant of /groq/text.
+
+    Emits ``token`` events with content deltas and a final ``done`` event
+    with the full output; the groq_logs row is written only after the stream
+    completes. Saturation is reported as an ``error`` event with the HTTP
+    status the non-streaming endpoint would have returned.
+    """
+    now = datetime.utcnow().isoformat() + "Z"
+
+    async def events():
+        parts = []
+        try:
+            async for delta in stream_text(payload.text, use_cache=not payload.no_cache):
+                parts.append(delta)
+                yield sse_event("token", delta)
+        except GroqSaturated as exc:
+            yield sse_event("error", {"status": exc.status_code, "detail": exc.detail})
+            return
+        output = "".join(parts)
+        _log("text", payload.text, output, payload.user_id, now, classroom)
+        yield sse_event("done", {"output": output})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.post("/groq/audio")
-async def groq_audio(file: UploadFile = File(...), user_id: str | None = None):
+async def groq_audio(file: UploadFile = File(...), user_id: str | None = None, classroom: str = Depends(classroom_id)):
     content = await file.read()
-    client = get_groq_client()
     now = datetime.utcnow().isoformat() + "Z"
     # Debug: log upload size
     try:
@@ -56,72 +263,95 @@ async def groq_audio(file: UploadFile = File(...), user_id: str | None = None):
     except Exception:
         pass
 
-    # (Debug dump removed) - debug dumping was temporary
+    try:
+        transcript = await transcribe(file.filename, content)
+    except GroqSaturated as exc:
+        raise _saturated(exc)
+    _log("audio", f"{file.filename}", transcript, user_id, now, classroom)
+    return {"transcript": transcript}
 
-    if client is None:
-        # Groq が設定されていない場合は明示的なフォールバックを返す
-        transcript = f"(groq not configured - uploaded {len(content)} bytes as {file.filename})"
-    else:
-        try:
-            transcription = client.audio.transcriptions.create(
-                file=(file.filename, content),
-                model="whisper-large-v3-turbo",
-                language="ja",
-                response_format="verbose_json",
-            )
-            # groq transcription object may vary; try to extract text robustly
-            def extract_text(obj):
-                # direct attribute
-                try:
-                    t = getattr(obj, 'text', None)
-                    if t and isinstance(t, str) and t.strip():
-                        return t.strip()
-                except Exception:
-                    pass
-                # dict-like
-                if isinstance(obj, dict):
-                    # common shapes: {'text': '...'}
-                    if 'text' in obj and isinstance(obj['text'], str) and obj['text'].strip():
-                        return obj['text'].strip()
-                    # verbose_json style: {'results': [{'alternatives': [{'text': '...'}]}]}
-                    if 'results' in obj and isinstance(obj['results'], list):
-                        parts = []
-                        for r in obj['results']:
-                            if isinstance(r, dict):
-                                if 'alternatives' in r and isinstance(r['alternatives'], list):
-                                    alt = r['alternatives'][0]
-                                    if isinstance(alt, dict):
-                                        for k in ('text', 'transcript'):
-                                            if k in alt and isinstance(alt[k], str) and alt[k].strip():
-                                                parts.append(alt[k].strip())
-                                # some formats may put 'text' directly in result
-                                if 'text' in r and isinstance(r['text'], str) and r['text'].strip():
-                                    parts.append(r['text'].strip())
-                        if parts:
-                            return ' '.join(parts)
-                # fallback to string
-                try:
-                    s = str(obj)
-                    if s and s.strip() and s.strip() != '{}':
-                        return s.strip()
-                except Exception:
-                    pass
-                return None
-
-            transcript = extract_text(transcription) or ''
-            # if transcript is only punctuation or single dot, treat as empty
-            if transcript.strip() in ('.', ',', '。', '') or len(transcript.strip()) <= 1:
-                print(f"[groq_audio] transcription appears empty or too short: '{transcript}'")
-                transcript = ''
-        except Exception as exc:
-            # サーバーログに詳細を出力して障害原因追跡を容易にする
-            print(f"groq audio transcription error: {exc}")
-            traceback.print_exc()
-            transcript = f"(groq transcription failed - uploaded {file.filename})"
 
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO groq_logs (type, input, output, user_id, created_at) VALUES (?, ?, ?, ?, ?)", ("audio", f"{file.filename}", transcript, user_id, now))
-    conn.commit()
-    conn.close()
-    return {"transcript": transcript}
+def _save_report(
+    filename: str, user_id: str, transcript: str, reply: str | None, comment: CommentIn | None, now: str, classroom: str = DEFAULT_CLASSROOM
+) -> str | None:
+    # the comment is committed before responding; the two log rows go write-behind
+    _log("audio", filename, transcript, user_id, now, classroom)
+    if comment is None:
+        return None
+    _log("text", transcript, reply, user_id, now, classroom)
+    with write_connection() as conn:
+        comment_id, text = insert_comment(conn, comment, now, classroom)
+        conn.commit()
+        dashboards(classroom).on_comment({**comment.dict(), "comment_id": comment_id, "text": text, "created_at": now})
+    return comment_id
+
+
+@router.post("/groq/report")
+async def groq_report(
+    file: UploadFile = File(...),
+    user_id: str = Form(...),
+    student_id: str | None = Form(None),
+    lat: float | None = Form(None),
+    lon: float | None = Form(None),
+    stream: bool = Form(False),
+    classroom: str = Depends(classroom_id),
+):
+    """Transceiver report in one round-trip: transcribe, captain reply, save comment.
+
+    An empty transcript is returned as ``transcript: ""`` with no reply and
+    no comment, so the client can ask the student to try again. With
+    ``stream=true`` the response is SSE: ``transcript``, then ``token``
+    events, then ``done`` with the comment_id once everything is saved.
+    """
+    content = await file.read()
+    now = datetime.utcnow().isoformat() + "Z"
+    if stream:
+        return StreamingResponse(
+            _report_events(file.filename, content, user_id, student_id, lat, lon, now, classroom),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+    try:
+        transcript = await transcribe(file.filename, content)
+        if not transcript:
+            _save_report(file.filename, user_id, transcript, None, None, now, classroom)
+            return {"transcript": "", "output": None, "comment_id": None}
+        reply = await complete_text(transcript)
+    except GroqSaturated as exc:
+        raise _saturated(exc)
+    comment = CommentIn(user_id=user_id, text=transcript, student_id=student_id, lat=lat, lon=lon)
+    comment_id = await run_in_threadpool(_save_report, file.filename, user_id, transcript, reply, comment, now, classroom)
+    return {"transcript": transcript, "output": reply, "comment_id": comment_id}
+
+
+async def _report_events(
+    filename: str, content: bytes, user_id: str, student_id: str | None, lat: float | None, lon: float | None, now: str, classroom: str
+):
+    try:
+        transcript = await transcribe(filename, content)
+        yield sse_event("transcript", transcript)
+        if not transcript:
+            _save_report(filename, user_id, transcript, None, None, now, classroom)
+            yield sse_event("done", {"transcript": "", "output": None, "comment_id": None})
+            return
+        parts = []
+        async for delta in stream_text(transcript):
+            parts.append(delta)
+            yield sse_event("token", delta)
+    except GroqSaturated as exc:
+        yield sse_event("error", {"status": exc.status_code, "detail": exc.detail})
+        return
+    reply = "".join(parts)
+    comment = CommentIn(user_id=user_id, text=transcript, student_id=student_id, lat=lat, lon=lon)
+    comment_id = await run_in_threadpool(_save_report, filename, user_id, transcript, reply, comment, now, classroom)
+    yield sse_event("done", {"transcript": transcript, "output": reply, "comment_id": comment_id})
+
+
+@router.get("/groq/limiter")
+def groq_limiter_stats():
+    return limiter.stats()
+
+
+@router.get("/groq/cache")
+def groq_cache_stats():
+    return reply_cache.stats()
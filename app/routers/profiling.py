@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+
+from app import profiling
+
+router = APIRouter()
+
+_LOOPBACK = ("127.0.0.1", "::1", "localhost")
+
+
+def require_profiler_admin(request: Request, x_profile_token: str | None = Header(None)) -> None:
+    """Profiles are only served with the profiling token, or to loopback clients when only routes are configured."""
+    if not profiling.enabled():
+        raise HTTPException(status_code=404, detail="profiling is disabled")
+    if profiling.PROFILE_TOKEN:
+        if not profiling.token_ok(x_profile_token):
+            raise HTTPException(status_code=403, detail="invalid profiling token")
+    elif not request.client or request.client.host not in _LOOPBACK:
+        raise HTTPException(status_code=403, detail="profiles are only served locally without MACHI_PROFILE_TOKEN")
+
+
+@router.get("/profiles", dependencies=[Depends(require_profiler_admin)])
+def list_profiles():
+    return profiling.store.list()
+
+
+@router.post("/profiles/window", status_code=202, dependencies=[Depends(require_profiler_admin)])
+def start_window(seconds: float = Query(30, gt=0, le=600)):
+    """Sample the whole process for ``seconds``; the profile appears in the list once the window ends."""
+    session = profiling.profile_window(seconds)
+    return {"profile_id": session.id, "started_at": session.started_at, "seconds": seconds}
+
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_profiler_admin)])
+def download_profile(profile_id: str, format: str = Query("folded", regex="^(folded|pstats)$")):
+    if not profiling.PROFILE_ID.fullmatch(profile_id) or profiling.store.get(profile_id) is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    path = profiling.store.path(profile_id, format)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="profile not found")
+    media_type = "text/plain; charset=utf-8" if format == "folded" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=path.name)
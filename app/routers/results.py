@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from app.classrooms import classroom_id
+from app.conditional import etag_matches
+from app.responses import FastJSONResponse
+from app.results import engines, student_result
+
+router = APIRouter()
+
+
+def _results(request: Request, classroom: str, select=None):
+    payload = engines(classroom).results()
+    if payload is None:
+        raise HTTPException(status_code=404, detail="no class course set")
+    etag = f'"res-{classroom}-{payload["computed_at"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = payload if select is None else select(payload)
+    return FastJSONResponse(body, headers=headers)
+
+
+@router.get("/results")
+def get_results(request: Request, classroom: str = Depends(classroom_id)):
+    """Route-completion scores for every student in the current lesson.
+
+    Computed once when the status enters 終了/結果 (or on the first request)
+    and then served from cache.
+    """
+    return _results(request, classroom)
+
+
+@router.get("/results/{student_id}")
+def get_student_results(student_id: str, request: Request, classroom: str = Depends(classroom_id)):
+    def select(payload: dict) -> dict:
+        keys = ("classroom_id", "course_id", "set_at", "computed_at", "final", "radius_m", "course")
+        return {**{k: payload[k] for k in keys}, "student": student_result(payload, student_id)}
+
+    return _results(request, classroom, select)
@@ -1,37 +1,102 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+import threading
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from app.db import get_connection
+from app.classrooms import classroom_id
+from app.conditional import conditional
+from app.dashboard import dashboards
+from app.db import iter_conn, read_connection
+from app.results import engines
+from app.events import SSE_HEADERS, status_hubs, sse_stream
+from app.write_behind import write_behind
 
 router = APIRouter()
 
 ALLOWED = {"デバッグ", "チュートリアル", "実行中", "終了", "結果"}
+# every classroom starts here, as the single-class database was seeded
+DEFAULT_STATUS = "デバッグ"
 
 
 class StatusIn(BaseModel):
     status: str
 
 
-@router.post("/status")
-def set_status(payload: StatusIn):
-    if payload.status not in ALLOWED:
-        raise HTTPException(status_code=400, detail="invalid status")
+STATUS_SQL = "INSERT INTO statuses (status, created_at, classroom_id) VALUES (?, ?, ?)"
+LATEST_STATUS_SQL = "SELECT status, created_at FROM statuses WHERE classroom_id = ? ORDER BY id DESC LIMIT 1"
+
+
+def publish_status(classroom: str, status: str) -> dict:
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO statuses (status, created_at) VALUES (?, ?)", (payload.status, now))
-    conn.commit()
-    conn.close()
-    return {"status": payload.status, "created_at": now}
-
-
-@router.get("/status")
-def get_latest_status():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT status, created_at FROM statuses ORDER BY id DESC LIMIT 1")
-    row = cur.fetchone()
-    conn.close()
+    event = {"status": status, "created_at": now}
+    # subscribers see the change immediately; the log row is committed write-behind
+    write_behind.enqueue(STATUS_SQL, (status, now, classroom))
+    status_hubs(classroom).publish(event)
+    dashboards(classroom).on_status(event)
+    engines(classroom).on_status(status)
+    return event
+
+
+_seed_lock = threading.Lock()
+
+
+def _seed_default_status(classroom: str) -> dict:
+    # a classroom without any status row is being used for the first time
+    with _seed_lock:
+        status_hub = status_hubs(classroom)
+        if status_hub.latest is not None:
+            return status_hub.latest
+        return publish_status(classroom, DEFAULT_STATUS)
+
+
+def latest_status(conn: sqlite3.Connection, classroom: str) -> dict:
+    # the hub holds the newest status, including writes not yet flushed to the table
+    status_hub = status_hubs(classroom)
+    if status_hub.latest is not None:
+        return status_hub.latest
+    row = conn.execute(LATEST_STATUS_SQL, (classroom,)).fetchone()
     if not row:
-        raise HTTPException(status_code=404, detail="no status set")
+        return _seed_default_status(classroom)
+    status_hub.seed({"status": row["status"], "created_at": row["created_at"]})
     return {"status": row["status"], "created_at": row["created_at"]}
+
+
+@router.post("/status")
+def set_status(payload: StatusIn, classroom: str = Depends(classroom_id)):
+    if payload.status not in ALLOWED:
+        raise HTTPException(status_code=400, detail="invalid status")
+    return publish_status(classroom, payload.status)
+
+
+@router.get("/status", dependencies=[Depends(conditional("statuses", hub=status_hubs))])
+def get_latest_status(conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
+    return latest_status(conn, classroom)
+
+
+def _load_latest_status(classroom: str) -> None:
+    with read_connection() as conn:
+        row = conn.execute(LATEST_STATUS_SQL, (classroom,)).fetchone()
+    if row:
+        status_hubs(classroom).seed({"status": row["status"], "created_at": row["created_at"]})
+    else:
+        _seed_default_status(classroom)
+
+
+async def status_stream_response(classroom: str) -> StreamingResponse:
+    # only the first subscriber after startup reads the table; afterwards the hub holds the value
+    status_hub = status_hubs(classroom)
+    if status_hub.latest is None:
+        await run_in_threadpool(_load_latest_status, classroom)
+    return StreamingResponse(
+        sse_stream(status_hub, "status"),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@router.get("/status/stream")
+async def stream_status(classroom: str = Depends(classroom_id)):
+    """Server-Sent Events: the current status on connect, then every change."""
+    return await status_stream_response(classroom)
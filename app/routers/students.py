@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
-from app.db import get_connection
+from app.classrooms import classroom_id
+from app.conditional import conditional
+from app.dashboard import dashboards
+from app.db import iter_conn, iter_write_conn
+from app.responses import rows_response
+from app.text import TEXT_NORM_VERSION, normalise_text
 
 router = APIRouter()
 
@@ -18,37 +24,32 @@ class StudentOut(BaseModel):
 
 
 @router.post("/students", response_model=StudentOut)
-def create_student(payload: StudentIn):
+def create_student(payload: StudentIn, conn: sqlite3.Connection = Depends(iter_write_conn), classroom: str = Depends(classroom_id)):
     student_id = str(uuid4())
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
+    name = normalise_text(payload.name)
     cur = conn.cursor()
     cur.execute(
-        "INSERT INTO students (student_id, name, created_at) VALUES (?, ?, ?)",
-        (student_id, payload.name, now),
+        "INSERT INTO students (student_id, name, created_at, name_norm_version, classroom_id) VALUES (?, ?, ?, ?, ?)",
+        (student_id, name, now, TEXT_NORM_VERSION, classroom),
     )
     conn.commit()
-    conn.close()
-    return {"student_id": student_id, "name": payload.name, "created_at": now}
+    dashboards(classroom).on_student(student_id, name)
+    return {"student_id": student_id, "name": name, "created_at": now}
 
 
-@router.get("/students")
-def list_students():
-    conn = get_connection()
+@router.get("/students", dependencies=[Depends(conditional("students"))])
+def list_students(response: Response, conn: sqlite3.Connection = Depends(iter_conn), classroom: str = Depends(classroom_id)):
     cur = conn.cursor()
-    cur.execute("SELECT student_id, name, created_at FROM students ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    cur.execute("SELECT student_id, name, created_at FROM students WHERE classroom_id = ? ORDER BY created_at DESC", (classroom,))
+    return rows_response(cur.fetchall(), response)
 
 
-@router.get("/students/{student_id}")
-def get_student(student_id: str):
-    conn = get_connection()
+@router.get("/students/{student_id}", dependencies=[Depends(conditional("students"))])
+def get_student(student_id: str, conn: sqlite3.Connection = Depends(iter_conn)):
     cur = conn.cursor()
     cur.execute("SELECT student_id, name, created_at FROM students WHERE student_id = ?", (student_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="student not found")
     return dict(row)
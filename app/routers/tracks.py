@@ -0,0 +1,62 @@
+import sqlite3
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel, Field
+from app.classrooms import classroom_id
+from app.dashboard import dashboards
+from app.db import iter_conn
+from app.tracks import INSERT_SQL, Fix, decode_e7, thinner, track_rows
+from app.write_behind import write_behind
+
+router = APIRouter()
+
+TRACK_BATCH_MAX = 500
+
+
+class TrackPointIn(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+    # epoch milliseconds, as in GeolocationPosition.timestamp
+    ts: int = Field(..., gt=0)
+    accuracy: float | None = Field(None, ge=0)
+
+
+class TrackBatchIn(BaseModel):
+    points: list[TrackPointIn] = Field(..., max_items=TRACK_BATCH_MAX)
+
+
+@router.post("/students/{student_id}/track")
+def upload_track(student_id: str, payload: TrackBatchIn, classroom: str = Depends(classroom_id)):
+    """Batch of watchPosition fixes from one phone.
+
+    Duplicates, inaccurate fixes, GPS jumps and stationary jitter are dropped
+    here; the rest are committed write-behind, so uploads from a whole class
+    never wait on the writer lock.
+    """
+    fixes = [Fix(p.ts, p.lat, p.lon, p.accuracy) for p in payload.points]
+    kept, dropped = thinner.thin(student_id, fixes)
+    for row in track_rows(student_id, kept, classroom):
+        write_behind.enqueue(INSERT_SQL, row)
+    if kept:
+        dashboards(classroom).on_track(student_id, kept[-1].ts)
+    return {
+        "received": len(fixes),
+        "accepted": len(kept),
+        "dropped": dropped,
+        "last_ts": kept[-1].ts if kept else None,
+    }
+
+
+@router.get("/students/{student_id}/track")
+def get_track(
+    student_id: str,
+    since: int = Query(0, ge=0),
+    limit: int = Query(5000, ge=1, le=20000),
+    conn: sqlite3.Connection = Depends(iter_conn),
+):
+    """Stored fixes after ``since`` (epoch ms) as compact [ts, lat, lon] triples."""
+    rows = conn.execute(
+        "SELECT ts, lat_e7, lon_e7 FROM track_points WHERE student_id = ? AND ts > ? ORDER BY ts LIMIT ?",
+        (student_id, since, limit),
+    ).fetchall()
+    points = [[r["ts"], decode_e7(r["lat_e7"]), decode_e7(r["lon_e7"])] for r in rows]
+    return {"student_id": student_id, "points": points, "next_since": points[-1][0] if points else since}
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException
+import sqlite3
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from uuid import uuid4
 from datetime import datetime
-from app.db import get_connection
+from app.conditional import conditional
+from app.db import iter_conn, iter_write_conn
 
 router = APIRouter()
 
@@ -18,30 +20,26 @@ class UserOut(BaseModel):
 
 
 @router.post("/users", response_model=UserOut)
-def create_user(payload: UserIn):
+def create_user(payload: UserIn, conn: sqlite3.Connection = Depends(iter_write_conn)):
     user_id = str(uuid4())
     now = datetime.utcnow().isoformat() + "Z"
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute("INSERT INTO users (user_id, name, created_at) VALUES (?, ?, ?)", (user_id, payload.name, now))
     conn.commit()
-    conn.close()
     return {"user_id": user_id, "name": payload.name, "created_at": now}
 
 
 @router.post("/users/register", response_model=UserOut)
-def register_user(payload: UserIn):
+def register_user(payload: UserIn, conn: sqlite3.Connection = Depends(iter_write_conn)):
     # compatibility alias
-    return create_user(payload)
+    return create_user(payload, conn)
 
 
-@router.get("/users/{user_id}", response_model=UserOut)
-def get_user(user_id: str):
-    conn = get_connection()
+@router.get("/users/{user_id}", response_model=UserOut, dependencies=[Depends(conditional("users"))])
+def get_user(user_id: str, conn: sqlite3.Connection = Depends(iter_conn)):
     cur = conn.cursor()
     cur.execute("SELECT user_id, name, created_at FROM users WHERE user_id = ?", (user_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="user not found")
     return dict(row)
@@ -0,0 +1,179 @@
+import math
+
+import numpy as np
+
+from app.geo import EARTH_RADIUS_M
+
+# a course point counts as reached when the walked path passes within this distance (metres)
+VISIT_RADIUS_M = 30.0
+# course length is sampled this often for the coverage percentage (metres)
+COVERAGE_STEP_M = 10.0
+# grid cell edge for the segment index (metres)
+GRID_CELL_M = 50.0
+
+
+class LocalProjection:
+    """Equirectangular projection to metres around a reference latitude.
+
+    Good to well under a metre over a town-sized area, which is all a
+    walking course covers, and it keeps every distance a plain hypot.
+    """
+
+    def __init__(self, ref_lat: float):
+        self.kx = math.cos(math.radians(ref_lat)) * EARTH_RADIUS_M
+        self.ky = EARTH_RADIUS_M
+
+    def __call__(self, lats, lons) -> tuple[np.ndarray, np.ndarray]:
+        lat = np.radians(np.asarray(lats, dtype=np.float64))
+        lon = np.radians(np.asarray(lons, dtype=np.float64))
+        return lon * self.kx, lat * self.ky
+
+
+def _point_segment_distances(px: np.ndarray, py: np.ndarray, seg: np.ndarray) -> np.ndarray:
+    """Distance matrix (points x segments); ``seg`` rows are x0, y0, x1, y1."""
+    x0, y0, x1, y1 = (seg[:, i][None, :] for i in range(4))
+    dx = x1 - x0
+    dy = y1 - y0
+    len2 = dx * dx + dy * dy
+    px = px[:, None]
+    py = py[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = ((px - x0) * dx + (py - y0) * dy) / len2
+    # zero-length segments (repeated points) degrade to point distance
+    t = np.clip(np.nan_to_num(t, nan=0.0), 0.0, 1.0)
+    return np.hypot(px - (x0 + t * dx), py - (y0 + t * dy))
+
+
+class SegmentGrid:
+    """Uniform grid over a polyline's segments for nearest-segment queries.
+
+    Each segment is registered in every cell its bounding box, grown by one
+    cell, touches, so a cell's list holds every segment within ``cell_m`` of
+    any point inside it. Queries group points by cell and compute each
+    group's distances against that cell's few segments in one NumPy call.
+    That answer is exact whenever it is within ``cell_m``; points further
+    from the line than that (or in empty cells) fall back to a brute-force
+    pass over all segments.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_m: float = GRID_CELL_M):
+        self.cell_m = cell_m
+        if len(x) == 1:
+            x = np.repeat(x, 2)
+            y = np.repeat(y, 2)
+        self.segments = np.column_stack((x[:-1], y[:-1], x[1:], y[1:]))
+        self.cells: dict[tuple[int, int], np.ndarray] = {}
+        lo_x = np.floor((np.minimum(x[:-1], x[1:]) - cell_m) / cell_m).astype(np.int64)
+        hi_x = np.floor((np.maximum(x[:-1], x[1:]) + cell_m) / cell_m).astype(np.int64)
+        lo_y = np.floor((np.minimum(y[:-1], y[1:]) - cell_m) / cell_m).astype(np.int64)
+        hi_y = np.floor((np.maximum(y[:-1], y[1:]) + cell_m) / cell_m).astype(np.int64)
+        buckets: dict[tuple[int, int], list[int]] = {}
+        for s in range(len(self.segments)):
+            for cx in range(lo_x[s], hi_x[s] + 1):
+                for cy in range(lo_y[s], hi_y[s] + 1):
+                    buckets.setdefault((cx, cy), []).append(s)
+        self.cells = {k: np.asarray(v, dtype=np.int64) for k, v in buckets.items()}
+
+    def distances(self, px: np.ndarray, py: np.ndarray) -> np.ndarray:
+        """Distance from each point to the nearest segment (metres)."""
+        out = np.full(len(px), np.inf)
+        if len(px) == 0:
+            return out
+        cx = np.floor(px / self.cell_m).astype(np.int64)
+        cy = np.floor(py / self.cell_m).astype(np.int64)
+        keys, inverse = np.unique(np.column_stack((cx, cy)), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        # one sort puts each cell's points next to each other; split at the cell boundaries
+        order = np.argsort(inverse, kind="stable")
+        groups = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(keys)))[:-1])
+        far = []
+        for (kx, ky), members in zip(keys, groups):
+            candidates = self.cells.get((int(kx), int(ky)))
+            if candidates is None:
+                far.append(members)
+                continue
+            near = _point_segment_distances(px[members], py[members], self.segments[candidates]).min(axis=1)
+            out[members] = near
+            far.append(members[near > self.cell_m])
+        members = np.concatenate(far)
+        if len(members):
+            # off the map: chunked so the matrix stays small
+            for start in range(0, len(members), 256):
+                chunk = members[start:start + 256]
+                out[chunk] = _point_segment_distances(px[chunk], py[chunk], self.segments).min(axis=1)
+        return out
+
+
+def resample(x: np.ndarray, y: np.ndarray, step_m: float) -> tuple[np.ndarray, np.ndarray]:
+    """Points every ``step_m`` along a polyline (ends included)."""
+    if len(x) < 2:
+        return x.copy(), y.copy()
+    cum = np.concatenate(([0.0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    if cum[-1] == 0:
+        return x[:1].copy(), y[:1].copy()
+    at = np.append(np.arange(0.0, cum[-1], step_m), cum[-1])
+    return np.interp(at, cum, x), np.interp(at, cum, y)
+
+
+class CourseIndex:
+    """What score_walk needs from a course, built once and shared by every walk scored against it."""
+
+    def __init__(self, course_lats, course_lons):
+        course_lats = np.asarray(course_lats, dtype=np.float64)
+        course_lons = np.asarray(course_lons, dtype=np.float64)
+        self.project = LocalProjection(float(course_lats.mean()))
+        self.x, self.y = self.project(course_lats, course_lons)
+        self.grid = SegmentGrid(self.x, self.y)
+        self.samples = resample(self.x, self.y, COVERAGE_STEP_M)
+
+
+def score_walk(
+    course_lats,
+    course_lons,
+    walk_lats,
+    walk_lons,
+    discoveries: list[tuple[float, float]] = (),
+    radius_m: float = VISIT_RADIUS_M,
+    course: CourseIndex | None = None,
+) -> dict:
+    """Compare one walked path with the course.
+
+    ``coverage_pct`` is the share of the course length that the walk came
+    within ``radius_m`` of; ``visited_points`` counts course vertices
+    reached; deviation figures are the walk's distances from the course;
+    ``discoveries`` counts geotagged comments made within ``radius_m`` of it.
+    Pass a prebuilt ``course`` when scoring many walks against one course.
+    """
+    if course is None:
+        course = CourseIndex(course_lats, course_lons)
+    project = course.project
+    cx, cy = course.x, course.y
+    result = {
+        "coverage_pct": 0.0,
+        "visited_points": 0,
+        "total_points": int(len(cx)),
+        "walked_distance_m": 0.0,
+        "mean_deviation_m": None,
+        "max_deviation_m": None,
+        "off_route_pct": None,
+        "discoveries": 0,
+    }
+    course_grid = course.grid
+    if discoveries:
+        dx, dy = project([d[0] for d in discoveries], [d[1] for d in discoveries])
+        result["discoveries"] = int((course_grid.distances(dx, dy) <= radius_m).sum())
+    if len(walk_lats) == 0:
+        return result
+
+    wx, wy = project(walk_lats, walk_lons)
+    result["walked_distance_m"] = round(float(np.hypot(np.diff(wx), np.diff(wy)).sum()), 1)
+    deviation = course_grid.distances(wx, wy)
+    result["mean_deviation_m"] = round(float(deviation.mean()), 1)
+    result["max_deviation_m"] = round(float(deviation.max()), 1)
+    result["off_route_pct"] = round(float((deviation > radius_m).mean() * 100), 1)
+
+    walk_grid = SegmentGrid(wx, wy)
+    sx, sy = course.samples
+    result["coverage_pct"] = round(float((walk_grid.distances(sx, sy) <= radius_m).mean() * 100), 1)
+    result["visited_points"] = int((walk_grid.distances(cx, cy) <= radius_m).sum())
+    return result
@@ -0,0 +1,73 @@
+import re
+import sqlite3
+import unicodedata
+
+# bump when normalise_text changes; rows below this are picked up by scripts/normalise_text.py
+TEXT_NORM_VERSION = 1
+
+_JAPANESE = re.compile(r"[぀-ヿ一-鿿]")
+
+# (table, key column, text column, version column)
+NORMALISED_COLUMNS = (
+    ("comments", "comment_id", "text", "text_norm_version"),
+    ("students", "student_id", "name", "name_norm_version"),
+)
+
+
+def fix_mojibake(s: str) -> str:
+    """Attempt to repair common mojibake where UTF-8 bytes were
+    interpreted as single-byte chars (latin1/cp1252). If repair yields
+    plausible CJK characters, return repaired string; otherwise return
+    original."""
+    if not s or not isinstance(s, str):
+        return s
+    # quick heuristic: if string looks ok (contains Japanese), skip
+    if _JAPANESE.search(s):
+        return s
+    try:
+        # re-encode as latin1 bytes, then decode as utf-8
+        b = s.encode('latin1', errors='replace')
+        decoded = b.decode('utf-8', errors='replace')
+        if _JAPANESE.search(decoded):
+            return decoded
+    except Exception:
+        pass
+    return s
+
+
+def normalise_text(s: str) -> str:
+    """Canonical stored form of user text: mojibake repaired, then NFC."""
+    if not s or not isinstance(s, str):
+        return s
+    return unicodedata.normalize("NFC", fix_mojibake(s))
+
+
+def normalise_existing_rows(conn: sqlite3.Connection, batch_size: int = 500, dry_run: bool = False) -> dict[str, int]:
+    """Rewrite rows stored before (or under an older) normalisation, in place.
+
+    Returns the number of rows whose text actually changed, per table. Every
+    visited row is stamped with TEXT_NORM_VERSION so a re-run skips it.
+    """
+    changed: dict[str, int] = {}
+    for table, key_col, text_col, version_col in NORMALISED_COLUMNS:
+        changed[table] = 0
+        last_rowid = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT rowid, {key_col}, {text_col} FROM {table} "
+                f"WHERE rowid > ? AND ({version_col} IS NULL OR {version_col} < ?) ORDER BY rowid LIMIT ?",
+                (last_rowid, TEXT_NORM_VERSION, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            updates = []
+            for rowid, _, value in rows:
+                fixed = normalise_text(value)
+                if fixed != value:
+                    changed[table] += 1
+                updates.append((fixed, TEXT_NORM_VERSION, rowid))
+            if not dry_run:
+                conn.executemany(f"UPDATE {table} SET {text_col} = ?, {version_col} = ? WHERE rowid = ?", updates)
+                conn.commit()
+    return changed
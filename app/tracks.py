@@ -0,0 +1,104 @@
+import os
+import threading
+from typing import Iterable, NamedTuple
+
+from app.cache import LRUCache
+from app.classrooms import DEFAULT_CLASSROOM
+from app.db import read_connection
+from app.geo import haversine_m
+
+# fixes worse than this are dropped outright (metres)
+TRACK_MAX_ACCURACY_M = float(os.environ.get("TRACK_MAX_ACCURACY_M", "50"))
+# a fix must move at least this far (or half its accuracy radius) from the last kept one
+TRACK_MIN_MOVE_M = float(os.environ.get("TRACK_MIN_MOVE_M", "5"))
+# ...unless this long has passed, so a standing student still shows up (ms)
+TRACK_KEEPALIVE_MS = int(os.environ.get("TRACK_KEEPALIVE_MS", "30000"))
+# faster than this between two fixes is a GPS jump, not walking (m/s)
+TRACK_MAX_SPEED_MPS = float(os.environ.get("TRACK_MAX_SPEED_MPS", "15"))
+# the speed check only applies to close fixes; after a gap the next fix is trusted
+TRACK_SPEED_WINDOW_MS = 60000
+
+E7 = 10_000_000
+
+INSERT_SQL = "INSERT OR IGNORE INTO track_points (student_id, ts, lat_e7, lon_e7, accuracy_m, classroom_id) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+class Fix(NamedTuple):
+    ts: int
+    lat: float
+    lon: float
+    accuracy: float | None = None
+
+
+def encode_e7(value: float) -> int:
+    return int(round(value * E7))
+
+
+def decode_e7(value: int) -> float:
+    return value / E7
+
+
+class TrackThinner:
+    """Dedup and jitter filter for uploaded fixes, one state per student.
+
+    Keeps the last accepted fix per student in memory (falling back to the
+    table after eviction or a restart), so thinning continues across batches.
+    """
+
+    def __init__(self, size: int = 2048):
+        self.last = LRUCache(maxsize=size)
+        self._lock = threading.Lock()
+
+    def _last_fix(self, student_id: str) -> Fix | None:
+        fix = self.last.get(student_id)
+        if fix is not None:
+            return fix
+        with read_connection() as conn:
+            row = conn.execute(
+                "SELECT ts, lat_e7, lon_e7, accuracy_m FROM track_points WHERE student_id = ? ORDER BY ts DESC LIMIT 1",
+                (student_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Fix(row["ts"], decode_e7(row["lat_e7"]), decode_e7(row["lon_e7"]), row["accuracy_m"])
+
+    def thin(self, student_id: str, fixes: Iterable[Fix]) -> tuple[list[Fix], dict[str, int]]:
+        """Return the fixes worth storing and how many were dropped, by reason."""
+        dropped = {"duplicate": 0, "inaccurate": 0, "jitter": 0, "jump": 0}
+        kept: list[Fix] = []
+        with self._lock:
+            last = self._last_fix(student_id)
+            for fix in sorted(fixes, key=lambda f: f.ts):
+                if last is not None and fix.ts <= last.ts:
+                    dropped["duplicate"] += 1
+                    continue
+                if fix.accuracy is not None and fix.accuracy > TRACK_MAX_ACCURACY_M:
+                    dropped["inaccurate"] += 1
+                    continue
+                if last is not None:
+                    dt_ms = fix.ts - last.ts
+                    dist = haversine_m(last.lat, last.lon, fix.lat, fix.lon)
+                    if dt_ms < TRACK_SPEED_WINDOW_MS and dist > TRACK_MAX_SPEED_MPS * dt_ms / 1000:
+                        dropped["jump"] += 1
+                        continue
+                    if dist < max(TRACK_MIN_MOVE_M, (fix.accuracy or 0) / 2) and dt_ms < TRACK_KEEPALIVE_MS:
+                        dropped["jitter"] += 1
+                        continue
+                kept.append(fix)
+                last = fix
+            if last is not None:
+                self.last.set(student_id, last)
+        return kept, dropped
+
+    def forget(self, student_id: str) -> None:
+        self.last.pop(student_id)
+
+
+thinner = TrackThinner()
+
+
+def track_rows(student_id: str, fixes: list[Fix], classroom: str = DEFAULT_CLASSROOM) -> list[tuple]:
+    return [
+        (student_id, f.ts, encode_e7(f.lat), encode_e7(f.lon), None if f.accuracy is None else int(round(f.accuracy)), classroom)
+        for f in fixes
+    ]
@@ -0,0 +1,157 @@
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from app.db import pool
+
+# flush when this many rows are buffered, or after this many seconds
+WRITE_BEHIND_BATCH = 200
+WRITE_BEHIND_INTERVAL = 0.5
+# hard cap on buffered rows; the oldest are dropped if the database is unavailable for long
+WRITE_BEHIND_MAX_BACKLOG = 20000
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Buffers fire-and-forget INSERTs and flushes them in batched transactions.
+
+    Used for rows nobody reads back in the same request (groq_logs audit rows,
+    the statuses log), so the request path never waits on a commit. A daemon
+    thread flushes on a size or time threshold; stop() drains what is left.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BEHIND_BATCH, interval: float = WRITE_BEHIND_INTERVAL, max_backlog: int = WRITE_BEHIND_MAX_BACKLOG):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backlog = max_backlog
+        self._buffer: deque[tuple[str, tuple]] = deque()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._flush_lock = threading.Lock()
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer)
+
+    def enqueue(self, sql: str, params: tuple) -> None:
+        with self._cond:
+            if len(self._buffer) >= self.max_backlog:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append((sql, params))
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        self._ensure_started()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self) -> int:
+        """Write everything buffered so far in one transaction; returns the row count."""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self._buffer)
+                self._buffer.clear()
+            if not batch:
+                return 0
+            rejected = 0
+            try:
+                try:
+                    self._write_batch(batch)
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as exc:
+                    # one bad row fails its whole executemany; write row by row so only that row is lost
+                    logger.warning("write-behind batch of %d rows failed (%s); retrying row by row", len(batch), exc)
+                    rejected = self._write_rows(batch)
+            except Exception as exc:
+                # the database itself is unavailable: keep the rows for the next attempt (ahead of anything newer)
+                self.failures += 1
+                logger.warning("write-behind flush of %d rows failed: %s", len(batch), exc)
+                with self._cond:
+                    self._buffer.extendleft(reversed(batch))
+                time.sleep(min(self.interval, 1.0))
+                return 0
+            self.flushed += len(batch) - rejected
+            self.rejected += rejected
+            self.batches += 1
+            return len(batch) - rejected
+
+    def _write_batch(self, batch: list[tuple[str, tuple]]) -> None:
+        with pool.writer() as conn:
+            # group consecutive rows with the same statement so executemany can batch them
+            start = 0
+            for i in range(1, len(batch) + 1):
+                if i == len(batch) or batch[i][0] != batch[start][0]:
+                    conn.executemany(batch[start][0], [params for _, params in batch[start:i]])
+                    start = i
+            conn.commit()
+
+    def _write_rows(self, batch: list[tuple[str, tuple]]) -> int:
+        """Write ``batch`` one statement at a time, dropping rows the database rejects; returns how many were dropped."""
+        rejected = 0
+        with pool.writer() as conn:
+            for sql, params in batch:
+                try:
+                    conn.execute(sql, params)
+                except sqlite3.OperationalError:
+                    raise
+                except sqlite3.Error as exc:
+                    # a failed statement is undone on its own; the rest of the transaction stands
+                    rejected += 1
+                    logger.error("write-behind dropped a row the database rejects (%s): %s %r", exc, sql, params)
+            conn.commit()
+        return rejected
+
+    def stop(self, drain: bool = True) -> None:
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            thread.join(timeout=10)
+        self._thread = None
+        if drain:
+            self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+write_behind = WriteBehindQueue()
+# scripts and tests never run the FastAPI shutdown hook; still drain on interpreter exit
+atexit.register(write_behind.stop)
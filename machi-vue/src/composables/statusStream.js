@@ -0,0 +1,82 @@
+// ステータスのサーバープッシュ購読（端末ごとに EventSource を1本だけ共有）
+// EventSource が使えない・切断が続く場合は 5 秒ポーリングにフォールバック
+
+import { withClassroom } from '../utils/classroom'
+
+const listeners = new Set()
+let eventSource = null
+let pollTimer = null
+let lastData = null
+let errorCount = 0
+
+const notify = (data) => {
+  lastData = data
+  listeners.forEach((cb) => {
+    try {
+      cb(data)
+    } catch (error) {
+      console.warn('ステータス購読コールバックエラー:', error)
+    }
+  })
+}
+
+const poll = async () => {
+  try {
+    const res = await fetch('/api/status')
+    if (!res.ok) return
+    notify(await res.json())
+  } catch (error) {
+    console.warn('ステータス取得エラー:', error)
+  }
+}
+
+const startPolling = () => {
+  if (pollTimer) return
+  poll()
+  pollTimer = setInterval(poll, 5000)
+}
+
+const stopPolling = () => {
+  if (pollTimer) {
+    clearInterval(pollTimer)
+    pollTimer = null
+  }
+}
+
+const open = () => {
+  if (typeof EventSource === 'undefined') {
+    startPolling()
+    return
+  }
+  eventSource = new EventSource(withClassroom('/api/status/stream'))
+  eventSource.addEventListener('status', (e) => {
+    errorCount = 0
+    stopPolling()
+    notify(JSON.parse(e.data))
+  })
+  eventSource.onerror = () => {
+    // EventSource は自動再接続するが、失敗が続く間はポーリングで補う
+    errorCount += 1
+    if (errorCount >= 3) startPolling()
+  }
+}
+
+const close = () => {
+  if (eventSource) {
+    eventSource.close()
+    eventSource = null
+  }
+  stopPolling()
+  errorCount = 0
+}
+
+// 購読を開始し、解除関数を返す
+export function subscribeStatus(callback) {
+  listeners.add(callback)
+  if (lastData) callback(lastData)
+  if (!eventSource && !pollTimer) open()
+  return () => {
+    listeners.delete(callback)
+    if (listeners.size === 0) close()
+  }
+}
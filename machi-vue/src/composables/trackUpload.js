@@ -0,0 +1,52 @@
+// 位置情報（watchPosition の結果）を端末内に貯めて、数秒ごとにまとめてアップロード
+// 送信に失敗した点は次回に持ち越す（上限を超えた古い点から捨てる）
+
+const FLUSH_INTERVAL_MS = 10000
+const MAX_BATCH = 500
+const MAX_BUFFER = 2000
+
+export function createTrackUploader(studentId) {
+  let buffer = []
+  let timer = null
+  let sending = false
+
+  const push = (position) => {
+    const { latitude, longitude, accuracy } = position.coords
+    buffer.push({ lat: latitude, lon: longitude, accuracy, ts: Math.round(position.timestamp || Date.now()) })
+    if (buffer.length > MAX_BUFFER) buffer = buffer.slice(-MAX_BUFFER)
+  }
+
+  const flush = async () => {
+    if (sending || buffer.length === 0 || !studentId) return
+    sending = true
+    const batch = buffer.slice(0, MAX_BATCH)
+    try {
+      const res = await fetch(`/api/students/${encodeURIComponent(studentId)}/track`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ points: batch }),
+        keepalive: true
+      })
+      // 4xx は再送しても通らないので捨てる
+      if (res.ok || (res.status >= 400 && res.status < 500)) buffer = buffer.slice(batch.length)
+    } catch (error) {
+      console.warn('位置履歴の送信失敗（次回再送）:', error)
+    } finally {
+      sending = false
+    }
+  }
+
+  const start = () => {
+    if (!timer) timer = setInterval(flush, FLUSH_INTERVAL_MS)
+  }
+
+  const stop = () => {
+    if (timer) {
+      clearInterval(timer)
+      timer = null
+    }
+    flush()
+  }
+
+  return { push, flush, start, stop }
+}
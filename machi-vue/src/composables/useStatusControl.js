@@ -1,4 +1,5 @@
 import { ref, computed, onMounted, onUnmounted, watch } from 'vue'
+import { subscribeStatus } from './statusStream'
 
 export function useStatusControl() {
   // 状態管理
@@ -6,8 +7,8 @@ export function useStatusControl() {
   const isLoading = ref(true)
   const lastStatus = ref('')
   
-  // ステータス監視用インターバル
-  let statusInterval = null
+  // ステータス購読の解除関数
+  let unsubscribe = null
   
   // 計算プロパティ（バックエンドAPIの正しいステータス値に対応）
   const isPreparation = computed(() => currentStatus.value === 'チュートリアル')
@@ -30,35 +31,37 @@ export function useStatusControl() {
         return
       }
       
-      const data = await res.json()
-      const newStatus = data.status || ''
-      
-      // ステータス変更を検出
-      if (currentStatus.value !== newStatus) {
-        lastStatus.value = currentStatus.value
-        currentStatus.value = newStatus
-        console.log('ステータス変更:', lastStatus.value, '->', currentStatus.value)
-      }
-      
-      isLoading.value = false
+      applyStatus(await res.json())
     } catch (error) {
       console.warn('ステータス取得エラー:', error)
     }
   }
   
-  // 初期化
-  const initialize = async () => {
-    await fetchStatus()
+  // 受信したステータスを反映
+  const applyStatus = (data) => {
+    const newStatus = data.status || ''
     
-    // 5秒間隔でステータスをポーリング
-    statusInterval = setInterval(fetchStatus, 5000)
+    // ステータス変更を検出
+    if (currentStatus.value !== newStatus) {
+      lastStatus.value = currentStatus.value
+      currentStatus.value = newStatus
+      console.log('ステータス変更:', lastStatus.value, '->', currentStatus.value)
+    }
+    
+    isLoading.value = false
+  }
+  
+  // 初期化
+  const initialize = () => {
+    // サーバープッシュで接続時の値と変更のみを受信（ポーリング不要）
+    unsubscribe = subscribeStatus(applyStatus)
   }
   
   // クリーンアップ
   const cleanup = () => {
-    if (statusInterval) {
-      clearInterval(statusInterval)
-      statusInterval = null
+    if (unsubscribe) {
+      unsubscribe()
+      unsubscribe = null
     }
   }
   
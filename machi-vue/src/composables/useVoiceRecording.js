@@ -197,7 +197,45 @@ export function useVoiceRecording() {
   }
 
   // 録音停止と送信
-  const stopRecording = async () => {
+  // SSE 形式の応答を読み、transcript / token を逐次コールバックに渡す
+  const readReportStream = async (res, handlers) => {
+    const reader = res.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    let result = null
+    
+    const handleFrame = (frame) => {
+      let event = 'message'
+      let data = ''
+      frame.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7)
+        else if (line.startsWith('data: ')) data += line.slice(6)
+      })
+      if (!data) return
+      const payload = JSON.parse(data)
+      if (event === 'transcript') handlers.onTranscript?.(payload)
+      else if (event === 'token') handlers.onToken?.(payload)
+      else if (event === 'error') throw new Error(payload.detail || '音声送信失敗')
+      else if (event === 'done') result = payload
+    }
+    
+    while (true) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      let sep
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        handleFrame(buffer.slice(0, sep))
+        buffer = buffer.slice(sep + 2)
+      }
+    }
+    if (buffer.trim()) handleFrame(buffer)
+    if (!result) throw new Error('返信取得失敗')
+    return result
+  }
+
+  // handlers.onTranscript(text) / handlers.onToken(delta) で途中経過を受け取れる
+  const stopRecording = async (handlers = {}) => {
     return new Promise((resolve, reject) => {
       if (!recorder || !isRecording.value) {
         console.log('No active recording to stop')
@@ -236,41 +274,35 @@ export function useVoiceRecording() {
             throw new Error('音声が検出されませんでした。もう一度大きな声で話してください。')
           }
           
-          // Groq APIに音声を送信
+          // 音声・位置情報をまとめて送信（文字起こし→隊長の返信→コメント保存を1リクエストで）
+          const studentUuid = localStorage.getItem('studentUuid')
+          const position = await getCurrentPosition()
+          
           const fd = new FormData()
           fd.append('file', blob, 'voice.webm')
+          fd.append('user_id', studentUuid || 'anonymous')
+          if (studentUuid) fd.append('student_id', studentUuid)
+          if (position.latitude !== null && position.longitude !== null) {
+            fd.append('lat', String(position.latitude))
+            fd.append('lon', String(position.longitude))
+          }
+          
+          // 隊長の返信はストリーミングで受信（最初の言葉が届くまでの待ち時間を短縮）
+          fd.append('stream', 'true')
           
-          const res = await fetch('/api/groq/audio', { method: 'POST', body: fd })
+          const res = await fetch('/api/groq/report', { method: 'POST', body: fd })
           if (!res.ok) throw new Error('音声送信失敗')
           
-          const j = await res.json()
+          const j = await readReportStream(res, handlers)
           const transcript = (j.transcript || '').trim()
           
           if (!transcript) {
             throw new Error('音声認識できませんでした。もう一度ゆっくり話してみてください。')
           }
           
-          // テキスト解析APIに送信
-          const r2 = await fetch('/api/groq/text', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ text: transcript })
-          })
-          
-          if (!r2.ok) throw new Error('返信取得失敗')
-          
-          const jr = await r2.json()
-          
-          // コメントとして保存（位置情報付き）
-          try {
-            await saveCommentWithLocation(transcript)
-          } catch (commentErr) {
-            console.warn('コメント保存に失敗しましたが、音声認識は成功しました:', commentErr)
-          }
-          
           resolve({
             transcript,
-            response: jr.output || '応答がありません'
+            response: j.output || '応答がありません'
           })
           
         } catch (err) {
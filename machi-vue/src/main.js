@@ -1,5 +1,8 @@
 import { createApp } from 'vue'
 import App from './App.vue'
 import './style.css'
+import { installClassroomFetch } from './utils/classroom'
+
+installClassroomFetch()
 
 createApp(App).mount('#app')
\ No newline at end of file
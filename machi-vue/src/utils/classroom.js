@@ -0,0 +1,33 @@
+// クラス（授業）ID。URL の ?classroom= で指定し、以降は端末に保存して使い続ける
+// 指定がなければサーバー側の既定クラス（default）になる
+
+const STORAGE_KEY = 'classroom'
+
+export const classroomId = () => {
+  const fromUrl = new URLSearchParams(window.location.search).get('classroom')
+  if (fromUrl) {
+    localStorage.setItem(STORAGE_KEY, fromUrl)
+    return fromUrl
+  }
+  return localStorage.getItem(STORAGE_KEY)
+}
+
+// EventSource はヘッダーを付けられないのでクエリで渡す
+export const withClassroom = (url) => {
+  const id = classroomId()
+  if (!id) return url
+  return `${url}${url.includes('?') ? '&' : '?'}classroom=${encodeURIComponent(id)}`
+}
+
+// /api への fetch すべてに X-Classroom ヘッダーを付ける
+export const installClassroomFetch = () => {
+  const originalFetch = window.fetch.bind(window)
+  window.fetch = (input, init = {}) => {
+    const url = typeof input === 'string' ? input : (input.url || String(input))
+    const id = classroomId()
+    if (!id || !url.startsWith('/api/')) return originalFetch(input, init)
+    const headers = new Headers(init.headers || (typeof input === 'string' ? undefined : input.headers))
+    headers.set('X-Classroom', id)
+    return originalFetch(input, { ...init, headers })
+  }
+}
@@ -0,0 +1,66 @@
+// コース座標の取得（サーバー側で解析済みのエンコード済みポリラインを使用）
+
+// Google encoded polyline をデコードして [[lat, lon], ...] を返す
+export function decodePolyline(encoded, precision = 5) {
+  const factor = Math.pow(10, precision)
+  const coords = []
+  let index = 0
+  let lat = 0
+  let lon = 0
+  while (index < encoded.length) {
+    for (const axis of [0, 1]) {
+      let result = 0
+      let shift = 0
+      let byte
+      do {
+        byte = encoded.charCodeAt(index++) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+      } while (byte >= 0x20)
+      const delta = result & 1 ? ~(result >> 1) : result >> 1
+      if (axis === 0) lat += delta
+      else lon += delta
+    }
+    coords.push([lat / factor, lon / factor])
+  }
+  return coords
+}
+
+// 旧形式: 生の GPX を DOMParser で解析
+const parseGpxCoords = (gpxContent) => {
+  const parser = new DOMParser()
+  const gpxDoc = parser.parseFromString(gpxContent, 'text/xml')
+  const coords = []
+  gpxDoc.querySelectorAll('trkpt').forEach(pt => {
+    const lat = parseFloat(pt.getAttribute('lat'))
+    const lon = parseFloat(pt.getAttribute('lon'))
+    if (!isNaN(lat) && !isNaN(lon)) coords.push([lat, lon])
+  })
+  return coords
+}
+
+// コース座標を取得（圧縮形式が使えない場合は GPX にフォールバック）
+export async function fetchCourseCoords(courseId) {
+  const res = await fetch(`/api/courses/${encodeURIComponent(courseId)}/compact`)
+  if (res.ok) {
+    const data = await res.json()
+    return { coords: decodePolyline(data.polyline, data.precision), distanceM: data.distance_m }
+  }
+  const rawRes = await fetch(`/api/courses/${encodeURIComponent(courseId)}`)
+  if (!rawRes.ok) return { coords: [], distanceM: null }
+  const courseData = await rawRes.json()
+  const gpxContent = courseData.gpx || courseData.content || courseData.gpx_content
+  return { coords: gpxContent ? parseGpxCoords(gpxContent) : [], distanceM: null }
+}
+
+// 今日のコース（ポインタ＋座標）を 1 回のリクエストで取得
+export async function fetchTodayCourse() {
+  const res = await fetch('/api/class_course/full')
+  if (!res.ok) return null
+  const data = await res.json()
+  if (data.geometry) {
+    return { courseId: data.course_id, coords: decodePolyline(data.geometry.polyline, data.geometry.precision), distanceM: data.geometry.distance_m }
+  }
+  const gpxContent = data.course && data.course.gpx
+  return { courseId: data.course_id, coords: gpxContent ? parseGpxCoords(gpxContent) : [], distanceM: null }
+}
@@ -0,0 +1,84 @@
+"""Per-request CPU of serialising a 500-row comment list: default FastAPI path vs FastJSONResponse.
+
+Usage: python scripts/bench_json.py [--rows 500] [--iterations 300]
+
+The default path is what a handler returning a list of dicts goes through
+(jsonable_encoder, then JSONResponse/json.dumps); the fast path serialises
+the same sqlite3.Row results with rows_response().
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app.responses import orjson, rows_response  # noqa: E402
+
+
+def make_rows(n: int) -> list[sqlite3.Row]:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE comments (comment_id TEXT, user_id TEXT, text TEXT, reply_to TEXT, genre TEXT, "
+        "student_id TEXT, created_at TEXT, lat REAL, lon REAL)"
+    )
+    start = datetime(2025, 5, 1, 9, 0)
+    conn.executemany(
+        "INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                f"c-{i:05d}",
+                f"u-{i % 30:03d}",
+                f"交差点の角に大きな桜の木があります。花びらがたくさん落ちていてきれいです {i}",
+                None,
+                "発見",
+                f"s-{i % 30:03d}",
+                (start + timedelta(seconds=7 * i)).isoformat() + "Z",
+                35.68 + i * 1e-5,
+                139.76 + i * 1e-5,
+            )
+            for i in range(n)
+        ],
+    )
+    return conn.execute("SELECT * FROM comments ORDER BY created_at DESC").fetchall()
+
+
+def default_path(rows) -> bytes:
+    return JSONResponse(jsonable_encoder([dict(r) for r in rows])).body
+
+
+def fast_path(rows) -> bytes:
+    return rows_response(rows).body
+
+
+def cpu_per_call(fn, rows, iterations: int) -> float:
+    fn(rows)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn(rows)
+    return (time.process_time() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    default = cpu_per_call(default_path, rows, args.iterations)
+    fast = cpu_per_call(fast_path, rows, args.iterations)
+    print(f"rows={args.rows} iterations={args.iterations} encoder={'orjson' if orjson else 'json'}")
+    print(f"default  {default * 1000:8.3f} ms CPU/request  ({len(default_path(rows))} bytes)")
+    print(f"fast     {fast * 1000:8.3f} ms CPU/request  ({len(fast_path(rows))} bytes)")
+    print(f"saved    {(default - fast) * 1000:8.3f} ms CPU/request  ({default / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""Classroom load simulation: N phones and a teacher replaying the PWA's request pattern.
+
+Usage:
+  python scripts/loadsim.py [--students 30] [--duration 60] [--speed 1] [--out FILE] [--compare OLD.json]
+  python scripts/loadsim.py --url http://127.0.0.1:8000 --groq-stub-port 9000 ...
+
+Per student, with the intervals the Vue app uses:
+  on mount    POST /api/students, GET /api/class_course/full, GET /api/comments/feed?limit=1,
+              GET /api/comments/near?bbox=...
+  throughout  GET /api/status/stream, one SSE subscription (statusStream); its latency is
+              the time to the first status event. Only while it is down does the
+              student fall back to polling GET /api/status every 5 s
+  every 5 s   GET /api/comments/feed?since=... (MapScreen)
+  every 10 s  POST /api/students/{id}/track (trackUpload)
+  now and then POST /api/groq/report (a voice report; Groq is a local stub)
+and one teacher refreshing GET /api/dashboard every 30 s. GETs revalidate
+with If-None-Match like a browser, so 304s are part of the mix.
+
+Without --url the app is served in-process by uvicorn on a loopback port
+(TestClient cannot hold a stream open) with a scratch database
+(MACHI_DB_PATH) and an in-process Groq stub. With --url the
+server must already be running; start it with GROQ_BASE_URL pointing at
+--groq-stub-port (and any GROQ_API_KEY) so reports never leave the machine.
+Everything happens in its own classroom (--classroom), so a live
+database's lessons are not touched.
+
+Writes p50/p95/p99 latency, throughput and status counts per endpoint as
+JSON (default bench/loadsim-<commit>.json); --compare prints the change
+against an earlier run.
+"""
+import argparse
+import heapq
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# fallback polling while the status stream is down
+STATUS_POLL_S = 5
+COMMENT_POLL_S = 5
+TRACK_FLUSH_S = 10
+TEACHER_REFRESH_S = 30
+WALK_SPEED_MPS = 1.3
+
+
+class StubGroqHandler(BaseHTTPRequestHandler):
+    """Groq stand-in: fixed transcript, echoing captain reply, optional latency."""
+
+    latency_s = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        time.sleep(self.latency_s)
+        if self.path.endswith("/chat/completions"):
+            request = json.loads(body)
+            prompt = request["messages"][-1]["content"]
+            if request.get("stream"):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.end_headers()
+                for piece in ("隊長: ", prompt):
+                    chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                             "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+            data = {"id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"隊長: {prompt}"}}]}
+        else:
+            data = {"text": "おおきな じんじゃ が あります"}
+        out = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_groq(port: int, latency_ms: float) -> ThreadingHTTPServer:
+    StubGroqHandler.latency_s = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubGroqHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, name: str, seconds: float, status) -> None:
+        with self._lock:
+            self.latencies[name].append(seconds)
+            self.statuses[name][str(status)] += 1
+
+
+def summarise(recorder: Recorder, wall_s: float) -> dict:
+    endpoints = {}
+    for name in sorted(recorder.latencies):
+        ms = np.asarray(recorder.latencies[name]) * 1000
+        statuses = recorder.statuses[name]
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        endpoints[name] = {
+            "count": int(len(ms)),
+            "throughput_rps": round(len(ms) / wall_s, 2),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2),
+            "mean_ms": round(float(ms.mean()), 2),
+            "max_ms": round(float(ms.max()), 2),
+            "errors": sum(n for s, n in statuses.items() if not s.isdigit() or int(s) >= 400),
+            "statuses": dict(statuses),
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "wall_s": round(wall_s, 2),
+        "requests": total,
+        "throughput_rps": round(total / wall_s, 2),
+        "errors": sum(e["errors"] for e in endpoints.values()),
+        "endpoints": endpoints,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def voice_clip() -> bytes:
+    from app.audio import encode_wav
+
+    # quiet room, one second of "speech", quiet room: enough for the VAD to keep it
+    rate = 16000
+    rng = np.random.default_rng(0)
+    quiet = rng.normal(0, 0.002, rate // 2)
+    t = np.arange(rate) / rate
+    return encode_wav(np.concatenate((quiet, 0.3 * np.sin(2 * np.pi * 220 * t), quiet)).astype(np.float32), rate)
+
+
+def walk_path(gpx_text: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Course vertices with cumulative distance (m), for placing walkers."""
+    from app.geo import haversine_m
+    from app.gpx import parse_gpx
+
+    geometry = parse_gpx(gpx_text)
+    lats = np.asarray(geometry.lats)
+    lons = np.asarray(geometry.lons)
+    steps = [haversine_m(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(len(lats) - 1)]
+    return np.concatenate(([0.0], np.cumsum(steps))), lats, lons
+
+
+class Client:
+    """One simulated browser: shared HTTP session, per-URL ETags, timing."""
+
+    def __init__(self, http, recorder: Recorder, classroom: str):
+        self.http = http
+        self.recorder = recorder
+        self.headers = {"X-Classroom": classroom}
+        self.etags: dict[str, str] = {}
+
+    def call(self, name: str, method: str, url: str, **kwargs):
+        headers = {**self.headers, **kwargs.pop("headers", {})}
+        if method == "GET" and url in self.etags:
+            headers["If-None-Match"] = self.etags[url]
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, url, headers=headers, **kwargs)
+        except Exception as exc:
+            self.recorder.record(name, time.perf_counter() - start, type(exc).__name__)
+            return None
+        self.recorder.record(name, time.perf_counter() - start, response.status_code)
+        if method == "GET" and response.headers.get("etag"):
+            self.etags[url] = response.headers["etag"]
+        return response
+
+
+class StatusStream:
+    """A student's GET /api/status/stream, read on its own thread like the PWA's EventSource."""
+
+    NAME = "GET /api/status/stream"
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.live = False
+        self.events = 0
+        self._closing = False
+        self._response = None
+        self._thread = threading.Thread(target=self._run, name="status-stream", daemon=True)
+
+    def start(self) -> "StatusStream":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        start = time.perf_counter()
+        try:
+            with self.client.http.stream("GET", "/api/status/stream", headers=self.client.headers, timeout=httpx.Timeout(10, read=None)) as response:
+                self._response = response
+                if response.status_code != 200:
+                    self.client.recorder.record(self.NAME, time.perf_counter() - start, response.status_code)
+                    return
+                for line in response.iter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    if not self.live:
+                        self.client.recorder.record(self.NAME, time.perf_counter() - start, response.status_code)
+                        self.live = True
+                    self.events += 1
+        except Exception as exc:
+            if not self._closing:
+                self.client.recorder.record(self.NAME, time.perf_counter() - start, type(exc).__name__)
+        finally:
+            self.live = False
+
+    def close(self) -> None:
+        self._closing = True
+        if self._response is not None:
+            # the reader sits in recv() until the next event or heartbeat; shutting the socket down wakes it
+            sock = self._response.extensions["network_stream"].get_extra_info("socket")
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._thread.join(timeout=5)
+
+
+class Simulation:
+    def __init__(self, http, args, recorder: Recorder):
+        self.http = http
+        self.args = args
+        self.recorder = recorder
+        self.rng = random.Random(args.seed)
+        self.gpx = (ROOT / "sample_course.gpx").read_text(encoding="utf-8")
+        self.cum, self.lats, self.lons = walk_path(self.gpx)
+        self.clip = voice_clip()
+        self.stop = threading.Event()
+
+    def period(self, seconds: float) -> float:
+        return seconds / self.args.speed
+
+    def setup(self) -> None:
+        client = Client(self.http, self.recorder, self.args.classroom)
+        client.call("setup", "POST", "/api/courses", json={"id": "loadsim-course", "content": self.gpx})
+        client.call("setup", "POST", "/api/class_course/loadsim-course")
+        client.call("setup", "POST", "/api/status", json={"status": "実行中"})
+
+    def position(self, metres: float) -> tuple[float, float]:
+        # walkers loop the course
+        at = metres % self.cum[-1] if self.cum[-1] > 0 else 0.0
+        return float(np.interp(at, self.cum, self.lats)), float(np.interp(at, self.cum, self.lons))
+
+    def run_timers(self, timers: list[list], deadline: float) -> None:
+        # timers: [due, period, action]; each client is one thread working through its own schedule
+        heap = [(due, i) for i, (due, _, _) in enumerate(timers)]
+        heapq.heapify(heap)
+        while heap:
+            due, i = heapq.heappop(heap)
+            if due >= deadline or self.stop.wait(max(0.0, due - time.monotonic())):
+                return
+            _, period, action = timers[i]
+            action()
+            next_due = due + (period() if callable(period) else period)
+            timers[i][0] = next_due
+            heapq.heappush(heap, (next_due, i))
+
+    def student(self, index: int, deadline: float) -> None:
+        rng = random.Random(self.args.seed * 1000 + index)
+        client = Client(self.http, self.recorder, self.args.classroom)
+        r = client.call("POST /api/students", "POST", "/api/students", json={"name": f"生徒{index:03d}"})
+        student_id = r.json()["student_id"] if r is not None and r.status_code == 200 else f"loadsim-{index}"
+        client.call("GET /api/class_course/full", "GET", "/api/class_course/full")
+        r = client.call("GET /api/comments/feed", "GET", "/api/comments/feed?limit=1")
+        cursor = r.json()["next_cursor"] if r is not None and r.status_code == 200 else "0"
+        lat, lon = self.position(0)
+        bbox = f"{lon - 0.01:.5f},{lat - 0.01:.5f},{lon + 0.01:.5f},{lat + 0.01:.5f}"
+        client.call("GET /api/comments/near", "GET", f"/api/comments/near?bbox={bbox}&limit=500")
+        stream = StatusStream(client).start()
+
+        offset = rng.uniform(0, self.cum[-1])
+        started = time.monotonic()
+        # fixes carry simulated time, so compressed runs still look like walking to the thinning
+        epoch_ms = int(time.time() * 1000)
+        last_fix = [started]
+
+        def poll_status():
+            # fallback only: the stream pushes every change while it is up
+            if not stream.live:
+                client.call("GET /api/status", "GET", "/api/status")
+
+        def poll_comments():
+            nonlocal cursor
+            r = client.call("GET /api/comments/feed", "GET", f"/api/comments/feed?since={cursor}&limit=100")
+            if r is not None and r.status_code == 200:
+                cursor = r.json()["next_cursor"]
+
+        def upload_track():
+            # one fix per simulated second since the last flush
+            now = time.monotonic()
+            points = []
+            for k in range(max(1, int((now - last_fix[0]) * self.args.speed))):
+                t = last_fix[0] + (k + 1) / self.args.speed
+                sim_s = (t - started) * self.args.speed
+                plat, plon = self.position(offset + sim_s * WALK_SPEED_MPS)
+                points.append({"lat": plat, "lon": plon, "ts": epoch_ms + int(sim_s * 1000), "accuracy": 8})
+            last_fix[0] = now
+            client.call("POST /api/students/{id}/track", "POST", f"/api/students/{student_id}/track", json={"points": points[-500:]})
+
+        def voice_report():
+            plat, plon = self.position(offset + (time.monotonic() - started) * self.args.speed * WALK_SPEED_MPS)
+            client.call(
+                "POST /api/groq/report",
+                "POST",
+                "/api/groq/report",
+                files={"file": ("voice.wav", self.clip, "audio/wav")},
+                data={"user_id": student_id, "student_id": student_id, "lat": str(plat), "lon": str(plon)},
+            )
+
+        def report_gap():
+            return rng.expovariate(1 / self.period(self.args.report_every))
+
+        now = time.monotonic()
+        timers = [
+            [now + self.period(STATUS_POLL_S), self.period(STATUS_POLL_S), poll_status],
+            [now + rng.uniform(0, self.period(COMMENT_POLL_S)), self.period(COMMENT_POLL_S), poll_comments],
+            [now + rng.uniform(0, self.period(TRACK_FLUSH_S)), self.period(TRACK_FLUSH_S), upload_track],
+        ]
+        if self.args.report_every > 0:
+            timers.append([now + report_gap(), report_gap, voice_report])
+        try:
+            self.run_timers(timers, deadline)
+        finally:
+            stream.close()
+
+    def teacher(self, deadline: float) -> None:
+        client = Client(self.http, self.recorder, self.args.classroom)
+        refresh = lambda: client.call("GET /api/dashboard", "GET", "/api/dashboard?recent=20")  # noqa: E731
+        refresh()
+        self.run_timers([[time.monotonic() + self.period(TEACHER_REFRESH_S), self.period(TEACHER_REFRESH_S), refresh]], deadline)
+
+    def run(self) -> float:
+        self.setup()
+        start = time.monotonic()
+        deadline = start + self.args.duration
+        threads = [threading.Thread(target=self.teacher, args=(deadline,), daemon=True)]
+        for i in range(self.args.students):
+            threads.append(threading.Thread(target=self.student, args=(i, deadline), daemon=True))
+        for t in threads:
+            t.start()
+            # phones join over the first few seconds, not in the same millisecond
+            time.sleep(min(0.05, self.args.ramp / max(1, self.args.students)))
+        for t in threads:
+            t.join()
+        return time.monotonic() - start
+
+
+def print_table(summary: dict, previous: dict | None = None) -> None:
+    header = f"{'endpoint':34} {'count':>7} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'304':>5}"
+    if previous:
+        header += f" {'p95 Δ':>9}"
+    print(header)
+    for name, e in summary["endpoints"].items():
+        line = (
+            f"{name:34} {e['count']:7d} {e['throughput_rps']:7.2f} {e['p50_ms']:8.2f} {e['p95_ms']:8.2f} "
+            f"{e['p99_ms']:8.2f} {e['errors']:5d} {e['statuses'].get('304', 0):5d}"
+        )
+        old = (previous or {}).get("endpoints", {}).get(name)
+        if old and old["p95_ms"]:
+            line += f" {(e['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:+8.1f}%"
+        print(line)
+    print(f"total {summary['requests']} requests in {summary['wall_s']} s = {summary['throughput_rps']} req/s, {summary['errors']} errors")
+
+
+def serve_in_process(app):
+    """Run ``app`` under uvicorn on a free loopback port; returns the server, its thread and base URL."""
+    import uvicorn
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise SystemExit("in-process server failed to start")
+        time.sleep(0.01)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--duration", type=float, default=60, help="wall-clock seconds to run")
+    parser.add_argument("--speed", type=float, default=1.0, help="divide every client interval by this (compressed time)")
+    parser.add_argument("--report-every", type=float, default=120, help="mean seconds between voice reports per student (0 = none)")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which students join")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--classroom", default="loadsim")
+    parser.add_argument("--groq-stub-port", type=int, default=0, help="port for the Groq stub (0 = any, in-process only)")
+    parser.add_argument("--groq-latency-ms", type=float, default=300, help="simulated Groq upstream latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="result JSON path (default bench/loadsim-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result JSON to diff against")
+    args = parser.parse_args()
+
+    stub = start_stub_groq(args.groq_stub_port, args.groq_latency_ms)
+    scratch = server = None
+    if args.url:
+        base_url = args.url
+        target = args.url
+        print(f"Groq stub on http://127.0.0.1:{stub.server_port} (the server must use it as GROQ_BASE_URL)")
+    else:
+        scratch = tempfile.TemporaryDirectory(prefix="loadsim-")
+        os.environ["MACHI_DB_PATH"] = str(Path(scratch.name) / "loadsim.db")
+        from app import groq_client
+        from app.main import app
+
+        groq_client.configure(api_key="loadsim", base_url=f"http://127.0.0.1:{stub.server_port}")
+        # the startup hook applies the migrations to the scratch database
+        server, server_thread, base_url = serve_in_process(app)
+        target = "in-process"
+    # every student holds a status stream open next to its other requests
+    limits = httpx.Limits(max_connections=2 * args.students + 10, max_keepalive_connections=2 * args.students + 10)
+    http = httpx.Client(base_url=base_url, timeout=60, limits=limits)
+
+    recorder = Recorder()
+    print(f"{args.students} students + 1 teacher for {args.duration:g} s against {target} (speed x{args.speed:g})")
+    wall = Simulation(http, args, recorder).run()
+    recorder.latencies.pop("setup", None)
+    recorder.statuses.pop("setup", None)
+    summary = summarise(recorder, wall)
+    http.close()
+
+    if server is not None:
+        # the shutdown hook drains write-behind and closes the pool
+        server.should_exit = True
+        server_thread.join(timeout=30)
+        scratch.cleanup()
+    stub.shutdown()
+
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "target": target,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        **summary,
+    }
+    previous = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_table(summary, previous)
+    out = Path(args.out) if args.out else ROOT / "bench" / f"loadsim-{commit or 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    main()
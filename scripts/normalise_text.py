@@ -0,0 +1,40 @@
+"""One-off repair of comment texts and student names stored before write-time normalisation.
+
+Usage: python scripts/normalise_text.py [--db data/app.db] [--batch-size 500] [--dry-run]
+
+Safe to run against a live database (WAL) and to re-run: rows already at the
+current TEXT_NORM_VERSION are skipped.
+"""
+import argparse
+import sqlite3
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app import db  # noqa: E402
+from app.text import TEXT_NORM_VERSION, normalise_existing_rows  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=str(ROOT / "data" / "app.db"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+
+    # the *_norm_version columns come from the app's own migrations
+    db.DB_PATH = Path(args.db)
+    db.init_db()
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA busy_timeout=5000")
+    changed = normalise_existing_rows(conn, batch_size=args.batch_size, dry_run=args.dry_run)
+    conn.close()
+    verb = "would change" if args.dry_run else "changed"
+    for table, count in changed.items():
+        print(f"{table}: {verb} {count} rows (norm version {TEXT_NORM_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import pytest
+
+from app import db
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema(tmp_path_factory):
+    # a scratch database, so a test run never writes to the tracked data/app.db
+    db.DB_PATH = tmp_path_factory.mktemp("db") / "app.db"
+    # the app migrates on startup, which a TestClient used without `with` never runs
+    db.init_db()
@@ -0,0 +1,856 @@
+import asyncio
+import json
+import math
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app import groq_client
+from app.audio import decode_audio, encode_wav, preprocess
+from app.cache import SingleFlight
+from app.dashboard import dashboard
+from app import db, metrics, profiling
+from app.db import ConnectionPool, read_connection
+from app.events import Broadcaster, status_hub
+from app.gpx import encode_polyline, parse_gpx, simplify_indices
+from app.groq_client import GroqLimiter, GroqSaturated
+from app.reply_cache import ReplyCache, normalise_prompt
+from app.responses import FastJSONResponse
+from app.results import engine as results_engine
+from app.routers import comments_new, courses
+from app.scoring import CourseIndex, LocalProjection, SegmentGrid, _point_segment_distances, score_walk
+from app.text import normalise_existing_rows
+from app.write_behind import WriteBehindQueue, write_behind
+
+
+client = TestClient(app)
+
+
+def test_pool_reuses_connections():
+    p = ConnectionPool(size=2, timeout=0.1)
+    c1 = p.acquire()
+    p.release(c1)
+    c2 = p.acquire()
+    assert c2 is c1
+    assert p.stats()["checked_out"] == 1
+    p.release(c2)
+    assert p.stats()["open"] == 1
+    p.close()
+
+
+def test_pool_applies_pragmas():
+    p = ConnectionPool(size=1, timeout=0.1)
+    conn = p.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    p.release(conn)
+    p.close()
+
+
+def test_pool_stats_endpoint():
+    client.get("/api/status")
+    r = client.get("/healthz/db")
+    assert r.status_code == 200
+    stats = r.json()
+    assert stats["checked_out"] == 0
+    assert stats["acquires"] >= 1
+
+
+def test_broadcaster_sends_current_then_changes():
+    async def run():
+        hub = Broadcaster()
+        hub.publish({"status": "デバッグ"})
+        events = hub.subscribe()
+        first = await events.__anext__()
+        hub.publish({"status": "実行中"})
+        second = await asyncio.wait_for(events.__anext__(), 1)
+        await events.aclose()
+        return first, second, hub.subscriber_count
+
+    first, second, remaining = asyncio.run(run())
+    assert first == {"status": "デバッグ"}
+    assert second == {"status": "実行中"}
+    assert remaining == 0
+
+
+def test_status_post_publishes_to_hub():
+    r = client.post("/api/status", json={"status": "チュートリアル"})
+    assert r.status_code == 200
+    assert status_hub.latest == r.json()
+    r = client.post("/api/control/status", json={"status": "デバッグ"})
+    assert status_hub.latest == r.json()
+
+
+def test_comments_feed_since_cursor():
+    r = client.get("/api/comments/feed", params={"limit": 1})
+    assert r.status_code == 200
+    cursor = r.json()["next_cursor"]
+
+    created = [client.post("/api/comments", json={"user_id": "feed", "text": f"feed {i}"}).json() for i in range(3)]
+    r = client.get("/api/comments/feed", params={"since": cursor, "limit": 2})
+    body = r.json()
+    assert [c["comment_id"] for c in body["comments"]] == [c["comment_id"] for c in created[:2]]
+    assert body["has_more"] is True
+
+    r = client.get("/api/comments/feed", params={"since": body["next_cursor"]})
+    body = r.json()
+    assert [c["comment_id"] for c in body["comments"]] == [created[2]["comment_id"]]
+    assert body["has_more"] is False
+
+    r = client.get("/api/comments/feed", params={"since": body["next_cursor"]})
+    assert r.json()["comments"] == []
+    assert r.json()["next_cursor"] == body["next_cursor"]
+
+
+def test_comments_near_bbox_and_radius():
+    base = {"user_id": "geo", "text": "geo"}
+    near = client.post("/api/comments", json={**base, "lat": 35.0001, "lon": 139.0001}).json()
+    far = client.post("/api/comments", json={**base, "lat": 35.05, "lon": 139.05}).json()
+
+    r = client.get("/api/comments/near", params={"lat": 35.0, "lon": 139.0, "radius_m": 100})
+    assert r.status_code == 200
+    ids = [c["comment_id"] for c in r.json()]
+    assert near["comment_id"] in ids
+    assert far["comment_id"] not in ids
+    assert all(c["distance_m"] <= 100 for c in r.json())
+
+    r = client.get("/api/comments/near", params={"bbox": "139.04,35.04,139.06,35.06"})
+    ids = [c["comment_id"] for c in r.json()]
+    assert far["comment_id"] in ids
+    assert near["comment_id"] not in ids
+
+    assert client.get("/api/comments/near", params={"bbox": "1,2,3"}).status_code == 422
+
+    # more box hits than the old 500-row window: the nearest comment is the oldest one
+    room = f"near-{uuid4().hex[:8]}"
+    client.post("/api/comments", params={"classroom": room}, json={**base, "text": "closest", "lat": 35.20005, "lon": 139.2})
+    with db.write_connection() as conn:
+        conn.executemany(
+            "INSERT INTO comments (comment_id, user_id, text, created_at, lat, lon, classroom_id) VALUES (?, 'geo', 'ring', ?, ?, ?, ?)",
+            [(f"{room}-{i}", f"2999-01-01T00:{i // 60:02d}:{i % 60:02d}Z", 35.2 + 0.002 * math.cos(i), 139.2 + 0.002 * math.sin(i), room) for i in range(520)],
+        )
+        conn.commit()
+    r = client.get("/api/comments/near", params={"classroom": room, "lat": 35.2, "lon": 139.2, "radius_m": 1000, "limit": 3})
+    assert [c["text"] for c in r.json()][0] == "closest"
+
+    # the spatial index is keyed by the comment's stable seq
+    with read_connection() as conn:
+        row = conn.execute(
+            "SELECT c.seq, r.id FROM comments c LEFT JOIN comments_rtree r ON r.id = c.seq WHERE c.comment_id = ?",
+            (far["comment_id"],),
+        ).fetchone()
+    assert row[0] == row[1]
+
+
+SAMPLE_GPX = (Path(__file__).resolve().parent.parent / "sample_course.gpx").read_text(encoding="utf-8")
+
+
+def test_gpx_parse_and_polyline():
+    geom = parse_gpx(SAMPLE_GPX)
+    assert geom.point_count == 7
+    assert geom.bbox == (35.6762, 139.6503, 35.679, 139.655)
+    assert 500 < geom.distance_m < 700
+    # reference value from Google's polyline algorithm documentation
+    assert encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_course_compact_etag():
+    r = client.post("/api/courses", json={"id": "compact-test", "content": SAMPLE_GPX})
+    assert r.status_code == 200
+    assert r.json()["point_count"] == 7
+
+    r = client.get("/api/courses/compact-test/compact")
+    assert r.status_code == 200
+    assert r.json()["point_count"] == 7
+    etag = r.headers["etag"]
+
+    r = client.get("/api/courses/compact-test/compact", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+
+    r = client.get("/api/courses/compact-test/compact", params={"format": "f32"})
+    assert r.headers["content-type"] == "application/octet-stream"
+    assert len(r.content) == 7 * 2 * 4
+
+
+def test_course_streaming_upload_and_limits(monkeypatch):
+    def chunks(data, size=100):
+        for i in range(0, len(data), size):
+            yield data[i:i + size]
+
+    body = SAMPLE_GPX.encode("utf-8")
+    r = client.post("/api/courses/upload", params={"course_id": "stream-test"}, content=chunks(body))
+    assert r.status_code == 200
+    assert r.json()["point_count"] == parse_gpx(SAMPLE_GPX).point_count
+    assert client.get("/api/courses/stream-test").json()["gpx"] == SAMPLE_GPX
+
+    # rejected on the chunk that breaks the XML, not after reading everything
+    assert client.post("/api/courses/upload", content=b"<gpx><trk><trkpt lat='1' lon='2'></trk>").status_code == 422
+    assert client.post("/api/courses/upload", content=b"<kml></kml>").status_code == 422
+    assert client.post("/api/courses", json={"content": "not xml"}).status_code == 422
+    assert client.post("/api/courses", json={"id": "x", "content": 123}).status_code == 422
+    assert client.post("/api/courses", json={"id": 5, "content": SAMPLE_GPX}).status_code == 422
+
+    monkeypatch.setattr(courses, "GPX_MAX_POINTS", 3)
+    assert client.post("/api/courses/upload", content=body).status_code == 413
+    monkeypatch.setattr(courses, "GPX_MAX_POINTS", 100000)
+    monkeypatch.setattr(courses, "GPX_MAX_BYTES", 256)
+    assert client.post("/api/courses/upload", content=chunks(body)).status_code == 413
+    assert client.post("/api/courses", files={"file": ("big.gpx", body, "application/gpx+xml")}).status_code == 413
+
+
+def test_simplify_keeps_corners_only():
+    # a straight line with a little jitter and one sharp corner at index 50
+    lats = [35.0 + i * 1e-5 for i in range(51)] + [35.0005] * 50
+    lons = [139.0 + (1e-7 if i % 2 else 0) for i in range(51)] + [139.0 + i * 1e-5 for i in range(1, 51)]
+    idx = list(simplify_indices(lats, lons, 2.0))
+    assert idx == [0, 50, 100]
+    assert list(simplify_indices(lats, lons, 0.0))[:3] == [0, 1, 2]
+
+
+def test_course_geometry_zoom_levels():
+    pts = "".join(f'<trkpt lat="{35 + i * 1e-5}" lon="{139 + (i % 2) * 1e-6}"/>' for i in range(500))
+    gpx = f'<gpx version="1.1"><trk><trkseg>{pts}</trkseg></trk></gpx>'
+    client.post("/api/courses", json={"id": "lod-test", "content": gpx})
+
+    far = client.get("/api/courses/lod-test/geometry", params={"zoom": 12}).json()
+    near = client.get("/api/courses/lod-test/geometry", params={"zoom": 20}).json()
+    assert far["point_count"] < near["point_count"] == 500
+    assert far["total_point_count"] == 500
+    assert near["tolerance_m"] == 0
+
+
+def test_single_flight_coalesces_concurrent_misses():
+    flights = SingleFlight()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        release.wait(2)
+        return "course"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do("k", load))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for _ in range(200):
+        if flights.stats()["coalesced"] == 7:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+    assert loads == [1]
+    assert results == ["course"] * 8
+
+
+def test_class_course_full_and_invalidation():
+    client.post("/api/courses", json={"id": "full-a", "content": SAMPLE_GPX})
+    client.post("/api/class_course/set", json={"course_id": "full-a"})
+    r = client.get("/api/class_course/full")
+    assert r.status_code == 200
+    body = r.json()
+    assert body["course_id"] == "full-a"
+    assert body["course"]["gpx"] == SAMPLE_GPX
+    assert body["geometry"]["point_count"] == parse_gpx(SAMPLE_GPX).point_count
+
+    # each writer drops the cached pointer / body
+    client.post("/api/control/course_of_day", json={"course_id": "full-b"})
+    assert client.get("/api/class_course").json()["course_id"] == "full-b"
+    assert client.get("/api/class_course/full").status_code == 404
+    client.post("/api/courses", json={"id": "full-b", "content": SAMPLE_GPX.replace("Sample Route", "Route B")})
+    assert "Route B" in client.get("/api/class_course/full").json()["course"]["gpx"]
+    client.delete("/api/courses/full-b")
+    assert client.get("/api/courses/full-b").status_code == 404
+
+
+class _StubGroqHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Groq HTTP API."""
+
+    chat_calls = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        if self.path.endswith("/chat/completions"):
+            type(self).chat_calls += 1
+        if self.path.endswith("/chat/completions") and json.loads(body).get("stream"):
+            prompt = json.loads(body)["messages"][-1]["content"]
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.end_headers()
+            for piece in ("隊長: ", prompt):
+                chunk = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        if self.path.endswith("/chat/completions"):
+            prompt = json.loads(body)["messages"][-1]["content"]
+            data = {
+                "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"隊長: {prompt}"}}],
+            }
+        else:
+            data = {"text": "おおきな じんじゃ"}
+        out = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_groq():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubGroqHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    old = (groq_client.GROQ_API_KEY, groq_client.GROQ_BASE_URL)
+    groq_client.configure(api_key="test-key", base_url=f"http://127.0.0.1:{server.server_port}")
+    yield
+    groq_client.configure(*old)
+    server.shutdown()
+
+
+def test_groq_endpoints_against_stub(stub_groq):
+    r = client.post("/api/groq/text", json={"text": "花がいっぱい"})
+    assert r.status_code == 200
+    assert r.json()["output"] == "隊長: 花がいっぱい"
+
+    r = client.post("/api/groq/audio", files={"file": ("voice.webm", b"\x00" * 64, "audio/webm")})
+    assert r.status_code == 200
+    assert r.json()["transcript"] == "おおきな じんじゃ"
+
+
+def test_groq_limiter_rejects_when_saturated():
+    async def run():
+        limiter = GroqLimiter(max_concurrency=1, max_waiting=1, queue_timeout=0.05)
+        codes = []
+
+        async def call():
+            try:
+                async with limiter.slot():
+                    await asyncio.sleep(0.2)
+                codes.append(200)
+            except GroqSaturated as exc:
+                codes.append(exc.status_code)
+
+        await asyncio.gather(call(), call(), call())
+        return sorted(codes)
+
+    assert asyncio.run(run()) == [200, 429, 503]
+
+
+def test_groq_report_saves_comment_in_one_request(stub_groq):
+    r = client.post(
+        "/api/groq/report",
+        files={"file": ("voice.webm", b"\x00" * 64, "audio/webm")},
+        data={"user_id": "reporter", "student_id": "reporter", "lat": "35.1", "lon": "139.1"},
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["transcript"] == "おおきな じんじゃ"
+    assert body["output"] == "隊長: おおきな じんじゃ"
+
+    comment = client.get(f"/api/comments_v2/{body['comment_id']}").json()
+    assert comment["text"] == "おおきな じんじゃ"
+    assert (comment["lat"], comment["lon"]) == (35.1, 139.1)
+
+
+def _sse_events(text):
+    events = []
+    for frame in text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_groq_text_stream(stub_groq):
+    r = client.post("/api/groq/text/stream", json={"text": "鳥がいた", "no_cache": True})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(r.text)
+    assert events[:-1] == [("token", "隊長: "), ("token", "鳥がいた")]
+    assert events[-1] == ("done", {"output": "隊長: 鳥がいた"})
+
+
+def test_groq_report_stream(stub_groq):
+    r = client.post(
+        "/api/groq/report",
+        files={"file": ("voice.webm", b"\x00" * 64, "audio/webm")},
+        data={"user_id": "reporter", "stream": "true"},
+    )
+    events = _sse_events(r.text)
+    assert events[0] == ("transcript", "おおきな じんじゃ")
+    name, done = events[-1]
+    assert name == "done" and done["output"] == "隊長: おおきな じんじゃ" and done["comment_id"]
+
+
+def test_write_behind_batches_and_drains():
+    queue = WriteBehindQueue(batch_size=1000, interval=60)
+    for i in range(5):
+        queue.enqueue("INSERT INTO groq_logs (type, input, output, user_id, created_at) VALUES (?, ?, ?, ?, ?)", ("text", f"wb {i}", "", "write-behind", "2024"))
+    assert queue.depth == 5
+    queue.stop()
+    assert queue.depth == 0
+    assert queue.stats()["batches"] == 1
+    with read_connection() as conn:
+        n = conn.execute("SELECT COUNT(*) FROM groq_logs WHERE user_id = 'write-behind' AND input LIKE 'wb %'").fetchone()[0]
+    assert n >= 5
+
+
+def test_write_behind_drops_only_the_rejected_row():
+    queue = WriteBehindQueue(batch_size=1000, interval=60)
+    sql = "INSERT INTO groq_logs (type, input, output, user_id, created_at) VALUES (?, ?, ?, ?, ?)"
+    queue.enqueue(sql, ("text", "poison ok 1", "", "write-behind-poison", "2024"))
+    queue.enqueue(sql, (None, "poison bad", "", "write-behind-poison", "2024"))
+    queue.enqueue(sql, ("text", "poison ok 2", "", "write-behind-poison", "2024"))
+    assert queue.flush() == 2
+    assert queue.depth == 0
+    assert queue.stats()["rejected"] == 1
+    with read_connection() as conn:
+        n = conn.execute("SELECT COUNT(*) FROM groq_logs WHERE user_id = 'write-behind-poison'").fetchone()[0]
+    assert n == 2
+
+
+def test_text_normalised_on_insert_and_by_migration(tmp_path, monkeypatch):
+    mojibake = "こんにちは".encode("utf-8").decode("latin1")
+    r = client.post("/api/comments", json={"user_id": "norm-test", "text": mojibake})
+    assert r.json()["text"] == "こんにちは"
+
+    # a database from before the migrations existed
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    conn.execute("CREATE TABLE comments (comment_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, text TEXT NOT NULL, reply_to TEXT, genre TEXT, student_id TEXT, created_at TEXT NOT NULL)")
+    conn.execute("CREATE TABLE students (student_id TEXT PRIMARY KEY, name TEXT NOT NULL, created_at TEXT NOT NULL)")
+    conn.executemany("INSERT INTO comments (comment_id, user_id, text, created_at) VALUES (?, 'u', ?, '2024')", [("a", mojibake), ("b", "ok"), ("c", "ｶﾞ")])
+    conn.execute("INSERT INTO students VALUES ('s', ?, '2024')", ("たろう".encode("utf-8").decode("latin1"),))
+    conn.commit()
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "old.db")
+    db.init_db()
+    assert normalise_existing_rows(conn, batch_size=2) == {"comments": 1, "students": 1}
+    assert conn.execute("SELECT text FROM comments WHERE comment_id = 'a'").fetchone()[0] == "こんにちは"
+    assert conn.execute("SELECT name FROM students").fetchone()[0] == "たろう"
+    assert conn.execute("SELECT COUNT(*) FROM comments WHERE text_norm_version IS NULL").fetchone()[0] == 0
+    # already stamped rows are skipped on a re-run
+    assert normalise_existing_rows(conn) == {"comments": 0, "students": 0}
+    conn.close()
+
+
+def test_fast_json_lists_match_default_encoding():
+    for path in ("/api/comments", "/api/comments/with_students", "/api/students", "/api/courses"):
+        r = client.get(path)
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "application/json"
+        assert "etag" in r.headers
+        assert isinstance(r.json(), list)
+    rows = [{"text": "桜", "lat": 35.5, "reply_to": None}]
+    assert json.loads(FastJSONResponse(rows).body) == rows
+
+
+def test_conditional_get_returns_304_until_table_changes():
+    r = client.get("/api/comments")
+    etag = r.headers["etag"]
+    assert r.headers["cache-control"] == "no-cache"
+    again = client.get("/api/comments", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    # same tables, different query: different validator
+    assert client.get("/api/comments/feed?limit=1").headers["etag"] != etag
+
+    client.post("/api/comments", json={"user_id": "etag-test", "text": "new"})
+    changed = client.get("/api/comments", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+
+def test_conditional_status_follows_hub():
+    client.post("/api/status", json={"status": "実行中"})
+    etag = client.get("/api/status").headers["etag"]
+    assert client.get("/api/status", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/api/status", json={"status": "終了"})
+    r = client.get("/api/status", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.json()["status"] == "終了"
+
+
+def test_status_visible_before_flush():
+    r = client.post("/api/status", json={"status": "実行中"})
+    assert client.get("/api/status").json() == r.json()
+    write_behind.flush()
+    with read_connection() as conn:
+        row = conn.execute("SELECT status, created_at FROM statuses ORDER BY id DESC LIMIT 1").fetchone()
+    assert dict(row) == r.json()
+    assert "depth" in client.get("/healthz/db").json()["write_behind"]
+
+
+def test_reply_cache_normalises_and_can_be_bypassed(stub_groq):
+    text = f"カラスがいたよ {uuid4().hex[:8]}"
+    before = _StubGroqHandler.chat_calls
+    first = client.post("/api/groq/text", json={"text": text}).json()
+    # same report with different width, kana and punctuation hits the cache
+    variant = text.replace("カラス", "からす").replace(" ", "　") + "！"
+    again = client.post("/api/groq/text", json={"text": variant}).json()
+    assert again == first
+    assert _StubGroqHandler.chat_calls == before + 1
+
+    client.post("/api/groq/text", json={"text": text, "no_cache": True})
+    assert _StubGroqHandler.chat_calls == before + 2
+    assert client.get("/api/groq/cache").json()["hits"] >= 1
+
+
+def test_normalise_prompt_keeps_long_vowels():
+    assert normalise_prompt("ビル") != normalise_prompt("ビール")
+    assert normalise_prompt("ﾋﾞｰﾙ！") == normalise_prompt("びーる")
+
+
+def test_reply_cache_persistent_tier():
+    cache = ReplyCache(size=4, ttl=60, persist=True)
+    key = cache.key(f"じんじゃ {uuid4().hex}", "system", "model")
+    cache.set(key, "いい発見だ！")
+    write_behind.flush()
+    cache.memory.clear()
+    assert cache.get(key) == "いい発見だ！"
+    assert cache.persistent_hits == 1
+
+
+def _wav(segments, rate=48000):
+    # segments: (seconds, amplitude) of a 440 Hz tone over a little noise
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, amp in segments:
+        t = np.arange(int(seconds * rate)) / rate
+        parts.append(amp * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 0.001, len(t)))
+    return encode_wav(np.concatenate(parts).astype(np.float32), rate)
+
+
+def test_audio_preprocess_trims_and_resamples():
+    result = preprocess(_wav([(1.0, 0.0), (0.6, 0.3), (1.0, 0.0)]), "voice.webm")
+    assert result.status == "ok"
+    assert result.filename in ("voice.flac", "voice.wav")
+    samples, rate = decode_audio(result.content)
+    assert rate == 16000
+    # 0.6 s of speech plus up to 150 ms padding on each side, instead of 2.6 s
+    assert 0.55 < len(samples) / rate < 1.0
+
+    assert preprocess(_wav([(2.0, 0.0)]), "voice.wav").status == "silent"
+    # speech from end to end has no quiet lead-in to measure the noise floor against
+    assert preprocess(_wav([(2.0, 0.3)]), "voice.wav").status == "ok"
+    t = np.arange(2 * 16000) / 16000
+    modulated = 0.3 * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t)) * np.sin(2 * np.pi * 220 * t)
+    assert preprocess(encode_wav(modulated.astype(np.float32), 16000), "voice.wav").status in ("ok", "passthrough")
+    assert preprocess(b"\x1aE\xdf\xa3webm", "voice.webm").status in ("passthrough", "silent", "ok")
+
+    # a compact upload is sent as-is rather than grown into 16 kHz PCM
+    compact = _wav([(1.0, 0.3)], rate=8000)
+    result = preprocess(compact, "voice.wav")
+    assert result.status == "passthrough" and result.content == compact
+    assert result.voiced_ms > 0
+
+
+def test_silent_upload_skips_transcription(stub_groq):
+    r = client.post("/api/groq/audio", files={"file": ("voice.wav", _wav([(1.5, 0.0)]), "audio/wav")})
+    assert r.status_code == 200
+    assert r.json()["transcript"] == ""
+
+
+def test_track_batch_dedup_and_thinning():
+    sid = f"track-{uuid4()}"
+    t0 = 1_700_000_000_000
+    fixes = [
+        {"lat": 35.0, "lon": 139.0, "ts": t0, "accuracy": 5},
+        {"lat": 35.0, "lon": 139.0, "ts": t0, "accuracy": 5},  # duplicate
+        {"lat": 35.00001, "lon": 139.0, "ts": t0 + 1000, "accuracy": 5},  # 1 m: jitter
+        {"lat": 35.0001, "lon": 139.0, "ts": t0 + 5000, "accuracy": 5},  # 11 m in 5 s: kept
+        {"lat": 35.01, "lon": 139.0, "ts": t0 + 6000, "accuracy": 5},  # 1 km in 1 s: jump
+        {"lat": 35.0002, "lon": 139.0, "ts": t0 + 9000, "accuracy": 500},  # inaccurate
+        {"lat": 35.0002, "lon": 139.0, "ts": t0 + 10000, "accuracy": 5},
+    ]
+    r = client.post(f"/api/students/{sid}/track", json={"points": fixes})
+    body = r.json()
+    assert body["accepted"] == 3
+    assert body["dropped"] == {"duplicate": 1, "inaccurate": 1, "jitter": 1, "jump": 1}
+
+    # a re-sent batch is ignored entirely
+    assert client.post(f"/api/students/{sid}/track", json={"points": fixes}).json()["accepted"] == 0
+    write_behind.flush()
+    points = client.get(f"/api/students/{sid}/track").json()["points"]
+    assert [p[0] for p in points] == [t0, t0 + 5000, t0 + 10000]
+    assert points[1][1] == pytest.approx(35.0001, abs=1e-7)
+    assert client.get(f"/api/students/{sid}/track", params={"since": t0 + 5000}).json()["points"][0][0] == t0 + 10000
+
+
+def test_dashboard_snapshot_tracks_inserts_incrementally():
+    before = client.get("/api/dashboard", params={"recent": 5})
+    assert before.status_code == 200
+    base = before.json()
+    assert client.get("/api/dashboard", params={"recent": 5}, headers={"If-None-Match": before.headers["etag"]}).status_code == 304
+
+    student = client.post("/api/students", json={"name": "ダッシュ"}).json()
+    sid = student["student_id"]
+    client.post("/api/comments", json={"user_id": "u", "student_id": sid, "text": "見つけた"})
+    client.post("/api/students/" + sid + "/track", json={"points": [{"lat": 35.0, "lon": 139.0, "ts": 4_000_000_000_000}]})
+    client.post("/api/status", json={"status": "実行中"})
+
+    snap = client.get("/api/dashboard", params={"recent": 5}, headers={"If-None-Match": before.headers["etag"]}).json()
+    assert snap["version"] == base["version"] + 4
+    assert snap["totals"]["comments"] == base["totals"]["comments"] + 1
+    assert snap["totals"]["students"] == base["totals"]["students"] + 1
+    entry = next(s for s in snap["students"] if s["student_id"] == sid)
+    assert entry["comment_count"] == 1
+    assert entry["last_seen"].startswith("2096-")
+    assert snap["recent_comments"][0]["text"] == "見つけた"
+    assert snap["recent_comments"][0]["student_name"] == "ダッシュ"
+    assert snap["status"]["status"] == "実行中"
+
+
+def test_dashboard_stream_sends_snapshot_then_deltas():
+    dashboard.ensure_loaded()
+
+    async def run():
+        events = dashboard.hub.subscribe(initial=lambda: dashboard.snapshot(3))
+        first = await events.__anext__()
+        dashboard.on_status({"status": "終了", "created_at": "2025-01-01T00:00:00Z"})
+        second = await asyncio.wait_for(events.__anext__(), 1)
+        await events.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["type"] == "snapshot"
+    assert second["type"] == "status"
+    assert second["version"] == first["version"] + 1
+
+
+def test_segment_grid_matches_brute_force():
+    rng = np.random.default_rng(7)
+    x = np.cumsum(rng.normal(0, 40, 200))
+    y = np.cumsum(rng.normal(0, 40, 200))
+    px = rng.uniform(x.min() - 300, x.max() + 300, 2000)
+    py = rng.uniform(y.min() - 300, y.max() + 300, 2000)
+    grid = SegmentGrid(x, y, cell_m=50)
+    brute = _point_segment_distances(px, py, grid.segments).min(axis=1)
+    assert np.allclose(grid.distances(px, py), brute)
+
+
+def _straight_course(n=101, lat0=35.0, lon=139.0, step=0.0001):
+    pts = "".join(f'<trkpt lat="{lat0 + i * step:.7f}" lon="{lon}"></trkpt>' for i in range(n))
+    return f'<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>{pts}</trkseg></trk></gpx>'
+
+
+def test_score_walk_coverage_and_deviation():
+    lats = [35.0 + i * 0.0001 for i in range(101)]  # ~1.1 km due north
+    lons = [139.0] * 101
+    full = score_walk(lats, lons, lats, [139.0001] * 101)  # ~9 m east of the line
+    assert full["coverage_pct"] == pytest.approx(100.0)
+    assert full["visited_points"] == 101
+    assert full["mean_deviation_m"] == pytest.approx(9.1, abs=0.2)
+    half = score_walk(lats, lons, lats[:51], lons[:51], discoveries=[(35.002, 139.0), (35.002, 139.01)])
+    assert half["coverage_pct"] == pytest.approx(50, abs=3)
+    assert half["off_route_pct"] == 0
+    assert half["discoveries"] == 1
+    assert score_walk(lats, lons, [], [])["coverage_pct"] == 0
+    # a prebuilt course index gives the same scores
+    assert score_walk(lats, lons, lats, [139.0001] * 101, course=CourseIndex(lats, lons)) == full
+
+
+def test_results_scored_on_lesson_end():
+    cid = f"score-{uuid4()}"
+    client.post("/api/courses", json={"id": cid, "content": _straight_course()})
+    client.post("/api/status", json={"status": "実行中"})
+    client.post(f"/api/class_course/{cid}")
+    sid = client.post("/api/students", json={"name": "採点"}).json()["student_id"]
+    t0 = int(time.time() * 1000) + 1000
+    # walk the first half, 11 m every 5 s
+    points = [{"lat": 35.0 + i * 0.0001, "lon": 139.0, "ts": t0 + i * 5000, "accuracy": 5} for i in range(51)]
+    client.post(f"/api/students/{sid}/track", json={"points": points})
+
+    provisional = client.get(f"/api/results/{sid}").json()
+    assert provisional["final"] is False
+    # polled again within the TTL, the provisional scores are reused
+    assert client.get(f"/api/results/{sid}").json()["computed_at"] == provisional["computed_at"]
+
+    client.post("/api/status", json={"status": "終了"})
+    results_engine.worker.join(timeout=10)
+    r = client.get(f"/api/results/{sid}")
+    body = r.json()
+    assert body["final"] is True and body["course_id"] == cid
+    assert body["student"]["coverage_pct"] == pytest.approx(50, abs=3)
+    assert body["student"]["duration_s"] == 250
+    assert client.get(f"/api/results/{sid}", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+    computations = results_engine.computations
+    client.post("/api/status", json={"status": "結果"})
+    assert sid in [s["student_id"] for s in client.get("/api/results").json()["students"]]
+    assert results_engine.computations == computations
+    assert client.get(f"/api/results/nobody-{uuid4()}").status_code == 404
+
+
+def test_new_classroom_starts_in_debug_status():
+    room = f"room-new-{uuid4().hex[:8]}"
+    r = client.get("/api/status", params={"classroom": room})
+    assert r.status_code == 200 and r.json()["status"] == "デバッグ"
+    write_behind.flush()
+    with read_connection() as conn:
+        rows = conn.execute("SELECT status FROM statuses WHERE classroom_id = ?", (room,)).fetchall()
+    assert [row["status"] for row in rows] == ["デバッグ"]
+
+
+def test_classrooms_are_isolated():
+    a, b = f"room-a-{uuid4().hex[:8]}", {"X-Classroom": f"room-b-{uuid4().hex[:8]}"}
+    client.post("/api/courses", json={"id": "room-course", "content": SAMPLE_GPX})
+    client.post("/api/status", params={"classroom": a}, json={"status": "実行中"})
+    client.post("/api/status", headers=b, json={"status": "チュートリアル"})
+    assert client.get("/api/status", params={"classroom": a}).json()["status"] == "実行中"
+    assert client.get("/api/status", headers=b).json()["status"] == "チュートリアル"
+
+    client.post("/api/class_course/room-course", params={"classroom": a})
+    assert client.get("/api/class_course", params={"classroom": a}).json()["course_id"] == "room-course"
+    assert client.get("/api/class_course", headers=b).status_code == 404
+
+    sid = client.post("/api/students", params={"classroom": a}, json={"name": "A組"}).json()["student_id"]
+    client.post("/api/comments", params={"classroom": a}, json={"user_id": "u", "text": "a only", "student_id": sid})
+    feed = client.get("/api/comments/feed", params={"classroom": a}).json()
+    assert [c["text"] for c in feed["comments"]] == ["a only"]
+    assert client.get("/api/comments/feed", headers=b).json()["comments"] == []
+    assert [s["student_id"] for s in client.get("/api/students", params={"classroom": a}).json()] == [sid]
+    assert "a only" not in [c["text"] for c in client.get("/api/comments").json()]
+    assert client.get("/api/dashboard", headers=b).json()["totals"]["comments"] == 0
+    assert client.get("/api/status", params={"classroom": "no spaces"}).status_code == 422
+
+    with read_connection() as conn:
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM comments WHERE classroom_id = ? ORDER BY created_at DESC LIMIT 5", (a,)
+        ).fetchall()
+    assert "idx_comments_classroom_created" in " ".join(row[3] for row in plan)
+
+    # the near query stays a bounding-box search of the R*Tree, not one R*Tree probe per classroom row
+    with read_connection() as conn:
+        plan = " ".join(
+            row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + comments_new.NEAR_SQL, (35, 36, 139, 140, 35, 36, 139, 140, a, 10))
+        )
+    assert "VIRTUAL TABLE INDEX 2:" in plan and "INDEX 1:" not in plan
+
+
+def test_metrics_label_route_templates_and_time_queries():
+    student_id = client.post("/api/students", json={"name": "計測"}).json()["student_id"]
+    client.get(f"/api/students/{student_id}")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert 'machi_http_requests_total{method="GET",route="/api/students/{student_id}",status="200"}' in body
+    assert student_id not in body
+    assert 'machi_http_request_db_seconds_total{method="POST",route="/api/students"}' in body
+    assert 'machi_db_seconds_count{op="insert"}' in body
+    assert 'machi_db_seconds_bucket{op="commit",le="+Inf"}' in body
+    assert "machi_db_pool_acquires" in body
+
+
+def test_groq_call_counts_errors():
+    async def failing():
+        async with metrics.groq_call("test"):
+            raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(failing())
+    assert metrics.groq_errors.value(("test", "TimeoutError")) >= 1
+    assert metrics.groq_latency.count(("test", "timeout")) >= 1
+
+
+def _spin(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(200))
+
+
+def test_sampling_profile_captures_worker_threads(tmp_path):
+    import pstats
+
+    session = profiling.sampler.start(profiling.ProfileSession("test", "spin"))
+    worker = threading.Thread(target=_spin, args=(0.2,), name="spinner")
+    worker.start()
+    worker.join()
+    profiling.sampler.stop(session)
+    folded = session.folded()
+    assert any(line.startswith("spinner;") and "_spin (tests/test_new_endpoints.py:" in line for line in folded.splitlines())
+    store = profiling.ProfileStore(tmp_path, keep=1)
+    store.save(session)
+    stats = pstats.Stats(str(store.path(session.id, "pstats")))
+    assert any(name == "_spin" for (_, _, name) in stats.stats)
+    older = session.id
+    store.save(profiling.sampler.stop(profiling.sampler.start(profiling.ProfileSession("test", "empty"))))
+    assert not store.path(older, "folded").exists()
+
+
+def test_profiling_requires_token(tmp_path, monkeypatch):
+    assert client.get("/api/profiles").status_code == 404
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "sesame")
+    monkeypatch.setattr(profiling.store, "directory", tmp_path)
+    profiled = TestClient(profiling.ProfilingMiddleware(app, routes=lambda: app.routes))
+    assert "x-profile-id" not in profiled.get("/api/comments").headers
+    r = profiled.get("/api/comments", headers={"X-Profile-Token": "sesame"})
+    profile_id = r.headers["x-profile-id"]
+    assert profiled.get("/api/profiles").status_code == 403
+    listed = profiled.get("/api/profiles", headers={"X-Profile-Token": "sesame"}).json()
+    assert listed[0]["profile_id"] == profile_id and listed[0]["label"] == "GET /api/comments"
+    folded = profiled.get(f"/api/profiles/{profile_id}", headers={"X-Profile-Token": "sesame"})
+    assert folded.status_code == 200 and folded.headers["content-type"].startswith("text/plain")
+    assert profiled.get("/api/profiles/../etc", headers={"X-Profile-Token": "sesame"}).status_code == 404
+
+
+def test_init_db_moves_single_class_course_to_default_classroom(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE class_course (id INTEGER PRIMARY KEY CHECK (id = 1), course_id TEXT, set_at TEXT)")
+    conn.execute("INSERT INTO class_course VALUES (1, 'old-course', '2025-01-01T00:00:00Z')")
+    conn.execute("CREATE TABLE comments (comment_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, text TEXT NOT NULL, reply_to TEXT, genre TEXT, student_id TEXT, created_at TEXT NOT NULL)")
+    conn.execute("INSERT INTO comments (rowid, comment_id, user_id, text, created_at) VALUES (7, 'c1', 'u', 'hi', '2025-01-01T00:00:00Z')")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.init_db()
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT classroom_id, course_id FROM class_course").fetchall() == [("default", "old-course")]
+    assert conn.execute("SELECT classroom_id FROM comments").fetchall() == [("default",)]
+    # the implicit rowid is kept as the stable seq key that feed cursors use
+    assert conn.execute("SELECT seq, comment_id FROM comments").fetchall() == [(7, "c1")]
+    assert ("seq", 1) in [(r[1], r[5]) for r in conn.execute("PRAGMA table_info(comments)")]
+    conn.close()
+
+
+def test_migrations_apply_once_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "fresh.db")
+    latest = db.MIGRATIONS[-1][0]
+    assert db.init_db() == list(range(1, latest + 1))
+    assert db.init_db() == []
+
+    calls = []
+
+    def add_flag(conn):
+        calls.append(1)
+        conn.execute("ALTER TABLE students ADD COLUMN flag INTEGER")
+
+    def broken(conn):
+        conn.execute("ALTER TABLE students ADD COLUMN half_done INTEGER")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(db, "MIGRATIONS", (*db.MIGRATIONS, (latest + 1, add_flag), (latest + 2, broken)))
+    with pytest.raises(RuntimeError):
+        db.init_db()
+    conn = db.get_connection()
+    assert db.schema_version(conn) == latest + 1
+    cols = db._columns(conn, "students")
+    conn.close()
+    # the failed migration rolled back with its version bump; the good one is not re-run
+    assert "flag" in cols and "half_done" not in cols
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:-1])
+    assert db.init_db() == [] and calls == [1]